@@ -0,0 +1,92 @@
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from covid import get_ontario_cases, get_phu_cases
+from helper import get_regional_panel
+from instrument import count
+from rt import bayes_filter, get_likelihoods, get_prior, get_process_operator, init_worker, prepare_cases, \
+    r_t_range, summarize_posteriors, worker_state
+from snapshot import CASES, list_snapshots, load_case_snapshot
+
+
+def vintage_cases(date, region=None):
+    '''
+    :param date: Date of a stored case snapshot
+    :param region: Reporting_PHU_City name as in covid.get_phu_cases, the whole province if None
+    :return: Series of daily case counts as the pipeline built them on that date
+    '''
+    # The pipeline counts on the EPOCH anchored axis up to the day of the update
+    regional = get_regional_panel({'cases': load_case_snapshot(date)}, date)
+    return get_ontario_cases(regional) if region is None else get_phu_cases(regional)[region]
+
+
+def shared_prefix(smoothed, previous):
+    # Number of leading days two vintages smoothed to the same counts on the same dates
+    n = min(len(smoothed), len(previous))
+    same = (smoothed.index[:n] == previous.index[:n]) & (smoothed.values[:n] == previous.values[:n])
+    return n if same.all() else int(np.argmin(same))
+
+
+def backfill_vintages(dates, region=None, sigma=.25, process_matrix=None):
+    '''
+    :param dates: Snapshot dates in increasing order
+    :param region: Reporting_PHU_City name, the whole province if None
+    :param sigma: Standard deviation of the day to day change in R_t
+    :param process_matrix: Prebuilt get_process_operator(sigma), to share it between calls
+    :return: List of (date, DataFrame of R_t as calculate_rt gave it on that date)
+    '''
+    if process_matrix is None:
+        process_matrix = get_process_operator(sigma)
+    results, previous = [], None
+    for date in dates:
+        _, smoothed = prepare_cases(vintage_cases(date, region))
+        if smoothed.empty:
+            results.append((date, pd.DataFrame(index=smoothed.index, columns=['ML', 'Low_90', 'High_90'],
+                                               dtype=float)))
+            continue
+
+        # Revisions only reach back so far, the filter resumes from the last posterior both vintages share
+        shared = shared_prefix(smoothed, previous['smoothed']) if previous is not None else 0
+        start = max(shared - 1, 0)
+        prior = previous['posteriors'][:, start] if shared else get_prior()
+        count(rows=len(smoothed) - start)
+
+        posteriors, _ = bayes_filter(get_likelihoods(smoothed.iloc[start:]), process_matrix, prior)
+        result = summarize_posteriors(pd.DataFrame(data=posteriors, index=r_t_range,
+                                                   columns=smoothed.index[start:]))
+        if start:
+            posteriors = np.concatenate([previous['posteriors'][:, :start], posteriors], axis=1)
+            result = pd.concat([previous['result'].iloc[:start], result])
+        previous = {'smoothed': smoothed, 'posteriors': posteriors, 'result': result}
+        results.append((date, result))
+    return results
+
+
+def backfill_worker(dates, region):
+    return backfill_vintages(dates, region, worker_state['sigma'], worker_state['process_matrix'])
+
+
+def backfill_rt(dates=None, region=None, sigma=.25, processes=None):
+    '''
+    :param dates: Snapshot dates to replay, every stored case snapshot if None
+    :param region: Reporting_PHU_City name, the whole province if None
+    :param sigma: Standard deviation of the day to day change in R_t
+    :param processes: Number of worker processes, defaults to the number of cores
+    :return: DataFrame with the most likely R_t and its highest density interval, indexed by vintage and date
+    '''
+    dates = sorted(list_snapshots(CASES) if dates is None else dates)
+    if not dates:
+        return pd.DataFrame(columns=['ML', 'Low_90', 'High_90'], dtype=float)
+    # Consecutive vintages go to the same worker so that each one resumes from the one before
+    chunks = [chunk.tolist() for chunk in np.array_split(dates, min(processes or os.cpu_count(), len(dates)))]
+    process_matrix = get_process_operator(sigma)
+    if len(chunks) == 1:
+        results = backfill_vintages(chunks[0], region, sigma, process_matrix)
+    else:
+        with Pool(len(chunks), initializer=init_worker, initargs=(sigma, process_matrix)) as pool:
+            results = [result for chunk in pool.starmap(backfill_worker, [(chunk, region) for chunk in chunks])
+                       for result in chunk]
+    return pd.concat(dict(results), names=['vintage'])
@@ -0,0 +1,153 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import synthetic
+from fetch import text_to_kv_pair
+from helper import get_regional_data, window_average
+from rt import calculate_rt, get_posteriors, highest_density_interval, prepare_cases
+
+REGRESSION_THRESHOLD = 1.2
+
+
+def setup_regional_data(cases, days, seed):
+    data = {'features': synthetic.case_features(cases, days, seed)}
+    return lambda: get_regional_data(data)
+
+
+def setup_text_to_kv_pair(cases, days, seed):
+    text = synthetic.status_csv(days, seed)
+    return lambda: text_to_kv_pair(text)
+
+
+def setup_window_average(cases, days, seed):
+    _, cities = get_regional_data({'features': synthetic.case_features(cases, days, seed)})
+    return lambda: [window_average(city, 7) for city in cities.values()]
+
+
+def province_cases(cases, days, seed):
+    ontario, _ = get_regional_data({'features': synthetic.case_features(cases, days, seed)})
+    index = pd.DatetimeIndex(list(ontario.keys()), name='date')
+    # Counts are padded up to today, keep only the synthetic days
+    return pd.Series(list(ontario.values()), index=index, name='ON cases')[:str(synthetic.FIRST_DAY + days - 1)]
+
+
+def setup_get_posteriors(cases, days, seed):
+    _, smoothed = prepare_cases(province_cases(cases, days, seed))
+    return lambda: get_posteriors(smoothed)
+
+
+def setup_highest_density_interval(cases, days, seed):
+    _, smoothed = prepare_cases(province_cases(cases, days, seed))
+    posteriors, _ = get_posteriors(smoothed)
+    return lambda: highest_density_interval(posteriors, p=.9)
+
+
+def setup_calculate_rt(cases, days, seed):
+    series = province_cases(cases, days, seed)
+    return lambda: calculate_rt(series)
+
+
+# Each setup builds its synthetic inputs outside of the measurement and returns the call that is measured
+BENCHMARKS = {
+    'get_regional_data': setup_regional_data,
+    'text_to_kv_pair': setup_text_to_kv_pair,
+    'window_average': setup_window_average,
+    'get_posteriors': setup_get_posteriors,
+    'highest_density_interval': setup_highest_density_interval,
+    'calculate_rt': setup_calculate_rt,
+}
+
+
+def measure(function, repeat):
+    '''
+    :param function: Call without arguments
+    :param repeat: Number of timed calls
+    :return: Dictionary of the fastest and mean wall time and the peak of traced memory
+    '''
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows every allocation, so memory is measured on a separate call
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'mean_seconds': sum(times) / len(times), 'peak_bytes': peak}
+
+
+def run_benchmarks(names, cases, days, seed=0, repeat=3):
+    results = dict()
+    for name in names:
+        function = BENCHMARKS[name](cases, days, seed)
+        results[name] = measure(function, repeat)
+        print(f'{name:<26}{results[name]["seconds"] * 1000:>12.2f} ms{results[name]["peak_bytes"] / 2 ** 20:>12.2f} MiB')
+    return {
+        'config': {'cases': cases, 'days': days, 'seed': seed, 'repeat': repeat},
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform()},
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    '''
+    :param report: Report of run_benchmarks
+    :param baseline: Report saved from an earlier run
+    :param threshold: Ratio to the baseline above which a time or peak memory counts as a regression
+    :return: List of the benchmarks that regressed
+    '''
+    if report['config'] != baseline['config']:
+        print(f'Baseline was run with {baseline["config"]}, not {report["config"]}')
+    regressions = []
+    for name, result in report['results'].items():
+        if (base := baseline['results'].get(name)) is None:
+            continue
+        time_ratio = result['seconds'] / base['seconds']
+        memory_ratio = result['peak_bytes'] / max(base['peak_bytes'], 1)
+        flag = time_ratio > threshold or memory_ratio > threshold
+        print(f'{name:<26}{time_ratio:>10.2f}x time{memory_ratio:>10.2f}x memory{"  REGRESSION" if flag else ""}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the hot paths on synthetic Ontario data')
+    parser.add_argument('--cases', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=synthetic.WAVE_DAYS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--save', help='Write the report to this JSON file')
+    parser.add_argument('--baseline', help='Compare against a report saved with --save')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.only, args.cases, args.days, args.seed, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
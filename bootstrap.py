@@ -0,0 +1,123 @@
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from instrument import count
+from rt import GAMMA, get_process_operator, get_prior, init_worker, prepare_cases, r_t_range, worker_state
+
+# Replicates run through the filter together, the stacked posteriors stay a few MB
+BATCH_REPLICATES = 256
+# Width of the Gaussian smoothing window of prepare_cases and the standard deviations a replicate may use
+SMOOTHING_WINDOW = 7
+SMOOTHING_STDS = np.array([1.5, 2, 2.5])
+QUANTILES = (.05, .25, .5, .75, .95)
+
+
+def smooth_replicates(counts, stds, window_length=SMOOTHING_WINDOW):
+    '''
+    :param counts: Array of daily case counts, one replicate per row
+    :param stds: Array of the standard deviation of the Gaussian window of each replicate
+    :return: Rounded centered Gaussian rolling means, equal to the pandas rolling mean of prepare_cases
+    '''
+    half, days = window_length // 2, counts.shape[-1]
+    weights = np.exp(-.5 * ((np.arange(window_length) - half) / np.asarray(stds, dtype=float)[:, None]) ** 2)
+    padded = np.pad(counts.astype(float), ((0, 0), (half, half)))
+    # Windows cut off at either end are divided by the weights they still cover
+    inside = np.pad(np.ones(days), half)
+    sums, covered = np.zeros(counts.shape), np.zeros(counts.shape)
+    for offset in range(window_length):
+        sums += padded[:, offset:offset + days] * weights[:, offset, None]
+        covered += inside[offset:offset + days] * weights[:, offset, None]
+    return np.round(sums / covered)
+
+
+def filter_replicates(smoothed, process_matrix, dtype=np.float32):
+    '''
+    :param smoothed: Array of smoothed daily case counts, one replicate per row
+    :param process_matrix: ProcessKernel of get_process_operator(sigma)
+    :return: Array of the most likely R_t of each replicate (rows) for each day (columns)
+    '''
+    replicates, days = smoothed.shape
+    smoothed = smoothed.astype(dtype)
+    growth = (GAMMA * (r_t_range - 1)).astype(dtype)
+    lam_factor = np.exp(growth)
+    posteriors = np.tile(get_prior().astype(dtype), (replicates, 1))
+    most_likely = np.empty((replicates, days))
+    most_likely[:, 0] = r_t_range[np.argmax(posteriors, axis=1)]
+
+    for day in range(1, days):
+        k, previous = smoothed[:, day], smoothed[:, day - 1]
+        # log P(k|R_t) up to terms that don't depend on R_t, which cancel once each posterior is normalized.
+        # Shifting every row to a maximum of 0 keeps exp in range for any count.
+        numerators = np.multiply.outer(k, growth)
+        numerators -= np.multiply.outer(previous, lam_factor)
+        # No cases the day before tells nothing about R_t, the replicate keeps its prior
+        numerators[previous == 0] = 0
+        numerators -= numerators.max(axis=1, keepdims=True)
+        np.exp(numerators, out=numerators)
+
+        current_priors = process_matrix @ posteriors
+        numerators *= current_priors
+        denominators = np.sum(numerators, axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            posteriors = np.where(denominators > 0, numerators / denominators, current_priors)
+        most_likely[:, day] = r_t_range[np.argmax(posteriors, axis=1)]
+    return most_likely
+
+
+def bootstrap_batch(cases, start, replicates, seed, dtype=np.float32):
+    '''
+    :param cases: Array of daily case counts
+    :param start: First day kept after smoothing, as prepare_cases cuts the unperturbed series
+    :param replicates: Number of replicates in the batch
+    :param seed: SeedSequence of the batch, the same seed gives the same replicates on any worker
+    :return: Array of the most likely R_t of each replicate (rows) for each day from start (columns)
+    '''
+    rng = np.random.default_rng(seed)
+    # Reporting noise resamples each day's count, and each replicate smooths with its own window
+    counts = rng.poisson(np.asarray(cases, dtype=float), size=(replicates, len(cases)))
+    stds = rng.choice(SMOOTHING_STDS, replicates)
+    count(rows=replicates * (len(cases) - start))
+    return filter_replicates(smooth_replicates(counts, stds)[:, start:], worker_state['process_matrix'], dtype)
+
+
+def bootstrap_rt_regions(regions, replicates=1000, sigma=.25, quantiles=QUANTILES, seed=0, processes=None,
+                         dtype=np.float32):
+    '''
+    :param regions: Dictionary with k, v pair region name, Series of daily case counts indexed by date
+    :param replicates: Number of perturbed series run through the filter for each region
+    :param sigma: Standard deviation of the day to day change in R_t
+    :param quantiles: Quantiles of the ensemble of most likely R_t reported for each day
+    :param seed: Seed of the random generator, results don't depend on the number of processes
+    :param processes: Number of worker processes, defaults to the number of cores
+    :param dtype: Floating point type of the filter, the spread of the ensemble dwarfs float32 round off
+    :return: DataFrame with a column of R_t per quantile, indexed by region and date
+    '''
+    tasks, dates = [], dict()
+    for region, cases in regions.items():
+        _, smoothed = prepare_cases(cases)
+        if smoothed.empty:
+            continue
+        dates[region] = smoothed.index
+        start = cases.index.get_loc(smoothed.index[0])
+        for first in range(0, replicates, BATCH_REPLICATES):
+            tasks.append((region, cases.values, start, min(BATCH_REPLICATES, replicates - first)))
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+
+    process_matrix = get_process_operator(sigma, dtype)
+    with Pool(min(processes or os.cpu_count(), max(len(tasks), 1)), initializer=init_worker,
+              initargs=(sigma, process_matrix)) as pool:
+        batches = pool.starmap(bootstrap_batch, [task[1:] + (task_seed, dtype)
+                                                 for task, task_seed in zip(tasks, seeds)])
+
+    columns = [f'Q_{q * 100:g}' for q in quantiles]
+    results = dict()
+    for region in dates:
+        ensemble = np.concatenate([batch for task, batch in zip(tasks, batches) if task[0] == region])
+        results[region] = pd.DataFrame(np.quantile(ensemble, quantiles, axis=0).T, index=dates[region],
+                                       columns=columns)
+    if not results:
+        return pd.DataFrame(columns=columns, dtype=float)
+    return pd.concat(results, names=['region'])
@@ -0,0 +1,178 @@
+import argparse
+import json
+import sys
+from datetime import datetime
+
+import instrument
+from fetch import BASE_URL, ONTARIO_COVID19_CSV, ONTARIO_COVID19_GEOJSON, ONTARIO_COVID19_POS_LINK, \
+    ONTARIO_COVID19_STATUS_LINK, check_for_update
+
+NO_NEW_DATA = 1
+DATASETS = {
+    'status': (ONTARIO_COVID19_STATUS_LINK, ONTARIO_COVID19_CSV),
+    'cases': (ONTARIO_COVID19_POS_LINK, ONTARIO_COVID19_GEOJSON),
+}
+
+
+def get_today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def check(args):
+    '''
+    Only reads the dataset pages, nothing is downloaded or computed
+    '''
+    new_data = False
+    for name, (link, filetype) in DATASETS.items():
+        try:
+            updated, _ = check_for_update(args.date, link, filetype, args.base_url)
+        except FileNotFoundError:
+            # Nothing was downloaded yet
+            updated = True
+        new_data |= updated
+        print(f'{name}: {"new data" if updated else "no new data"}')
+    return 0 if new_data else NO_NEW_DATA
+
+
+def indicators(args):
+    # The analysis modules are only loaded once there is something to compute
+    from covid import run_pipeline
+    from service import json_value
+
+    update = run_pipeline(args.date, args.base_url)['update']
+    key_info = {key: json_value(value.item() if hasattr(value, 'item') else value)
+                for key, value in update['today_key_info'].items()}
+    if args.json:
+        print(json.dumps({'today_key_info': key_info, 'plots': update['plots']}))
+        return 0
+    print(f'Key indicators for {key_info["date"]}')
+    print(f'{key_info["case count"]} new cases, {key_info["test count"]} tests completed')
+    print(f'Infection rate: {key_info["r_t"]:.2f}')
+    print(f'{key_info["case per 100k"]:2.2f} cases per 100,000')
+    print(f'{key_info["positivity"]:2.2f}% positivity rate')
+    return 0
+
+
+def render(args):
+    from covid import render_update, run_pipeline
+
+    drawn = render_update(run_pipeline(args.date, args.base_url), args.format, args.out, args.processes)
+    print(f'{len(drawn)} charts drawn in {args.out}' if drawn else 'Charts are up to date')
+    return 0
+
+
+def area(args):
+    from covid import WINDOW_SIZE, get_phu_rt
+    from snapshot import load_case_snapshot
+    from spatial import area_panel, get_grid_index
+
+    if (cases := load_case_snapshot()) is None:
+        print('No case snapshot yet, run indicators or render first')
+        return NO_NEW_DATA
+    index, columns = get_grid_index(cases), cases['columns']
+    if args.polygon:
+        rows = index.within_polygon(json.loads(args.polygon), columns['Longitude'], columns['Latitude'])
+    else:
+        rows = index.within_radius(args.lon, args.lat, args.radius_km, columns['Longitude'], columns['Latitude'])
+    panel = area_panel(cases, {args.name: rows})
+    average = panel.rolling_mean(WINDOW_SIZE).series(args.name)
+    print(f'{len(rows)} cases in {args.name}, {average[-1]:.1f} a day over the last {WINDOW_SIZE} days')
+    rt = get_phu_rt(panel)
+    if len(rt) and len(rt.xs(args.name)):
+        print(f'Infection rate: {rt.xs(args.name)["ML"].iloc[-1]:.2f}')
+    return 0
+
+
+def backfill(args):
+    from backfill import backfill_rt
+    from snapshot import CASES, list_snapshots
+
+    dates = [date for date in list_snapshots(CASES)
+             if (args.since is None or date >= args.since) and (args.until is None or date <= args.until)]
+    result = backfill_rt(dates, args.region, processes=args.processes)
+    result.to_csv(args.out)
+    print(f'R_t of {len(dates)} snapshots written to {args.out}')
+    return 0
+
+
+def bootstrap(args):
+    from bootstrap import bootstrap_rt_regions
+    from covid import get_ontario_cases, get_phu_cases, run_pipeline
+    from series import PROVINCE
+
+    regional = run_pipeline(args.date, args.base_url)['regional']
+    regions = {PROVINCE: get_ontario_cases(regional), **get_phu_cases(regional)}
+    result = bootstrap_rt_regions(regions, args.replicates, seed=args.seed, processes=args.processes)
+    result.to_csv(args.out)
+    print(f'R_t quantiles of {args.replicates} replicates for {len(regions)} regions written to {args.out}')
+    return 0
+
+
+def publish(args):
+    from covid import run_pipeline
+    from reddit import FileTransport, Publisher, render_post
+
+    update = run_pipeline(args.date, args.base_url)['update']
+    publisher = Publisher(FileTransport(args.dry_run) if args.dry_run else None)
+    queued = publisher.enqueue(render_post(update['today_key_info'], update['plots'], args.url))
+    # One pass over the outbox, posts that fail stay queued with their backoff for the next run
+    wait = publisher.drain()
+    print(f'{"Queued" if queued else "Already queued or sent"}, '
+          f'{"outbox empty" if wait is None else f"{len(publisher.pending())} posts still queued"}')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless Ontario COVID-19 update, never prompts')
+    parser.add_argument('--date', default=get_today(), help='Date of the update as YYYY-MM-DD, today by default')
+    parser.add_argument('--base-url', default=BASE_URL, help='Site serving the dataset pages')
+    parser.add_argument('--instrument', metavar='PATH', help='Write a per-stage timing and memory report to PATH')
+    parser.add_argument('--profile', metavar='STAGE', help='Dump a cProfile of STAGE next to the report')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('check', help=f'Exit with {NO_NEW_DATA} when neither dataset has new data') \
+        .set_defaults(run=check)
+    indicators_parser = commands.add_parser('indicators', help='Print the key indicators of the latest data')
+    indicators_parser.add_argument('--json', action='store_true', help='Print the update as JSON')
+    indicators_parser.set_defaults(run=indicators)
+    render_parser = commands.add_parser('render', help='Draw every chart to image files, unchanged charts are kept')
+    render_parser.add_argument('--format', nargs='+', default=['png'], choices=['png', 'svg', 'pdf'])
+    render_parser.add_argument('--out', default='./charts', help='Directory of the images')
+    render_parser.add_argument('--processes', type=int, help='Number of worker processes, all cores by default')
+    render_parser.set_defaults(run=render)
+    area_parser = commands.add_parser('area', help='Daily cases and Rt of the cases within a radius or a polygon')
+    area_parser.add_argument('--name', default='area', help='Name of the area in the output')
+    area_parser.add_argument('--lon', type=float, help='Longitude of the center of the radius')
+    area_parser.add_argument('--lat', type=float, help='Latitude of the center of the radius')
+    area_parser.add_argument('--radius-km', type=float, default=25)
+    area_parser.add_argument('--polygon', help='JSON list of [longitude, latitude] vertices, instead of a radius')
+    area_parser.set_defaults(run=area)
+    backfill_parser = commands.add_parser('backfill', help='R_t as it was known on the date of every stored snapshot')
+    backfill_parser.add_argument('--since', help='First snapshot date replayed, YYYY-MM-DD')
+    backfill_parser.add_argument('--until', help='Last snapshot date replayed, YYYY-MM-DD')
+    backfill_parser.add_argument('--region', help='Reporting_PHU_City name, the whole province by default')
+    backfill_parser.add_argument('--out', default='rt_vintages.csv', help='CSV file of R_t by vintage and date')
+    backfill_parser.add_argument('--processes', type=int, help='Number of worker processes, all cores by default')
+    backfill_parser.set_defaults(run=backfill)
+    bootstrap_parser = commands.add_parser('bootstrap', help='R_t quantiles over perturbed case counts')
+    bootstrap_parser.add_argument('--replicates', type=int, default=1000, help='Perturbed series per region')
+    bootstrap_parser.add_argument('--seed', type=int, default=0)
+    bootstrap_parser.add_argument('--out', default='rt_bootstrap.csv', help='CSV file of R_t by region and date')
+    bootstrap_parser.add_argument('--processes', type=int, help='Number of worker processes, all cores by default')
+    bootstrap_parser.set_defaults(run=bootstrap)
+    publish_parser = commands.add_parser('publish', help='Queue the update post and send whatever is due')
+    publish_parser.add_argument('--url', required=True, help='Link of the post')
+    publish_parser.add_argument('--dry-run', metavar='PATH', help='Append the posts to PATH instead of Reddit')
+    publish_parser.set_defaults(run=publish)
+    args = parser.parse_args(argv)
+
+    if args.instrument:
+        instrument.enable(args.profile, f'{args.profile}.prof' if args.profile else None)
+    try:
+        return args.run(args)
+    finally:
+        if args.instrument:
+            instrument.write_report(args.instrument)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
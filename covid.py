@@ -1,118 +1,202 @@
+import atexit
+import re
 from json import load
 from math import log
 from datetime import datetime
-import matplotlib.pyplot as plt
-from helper import get_regional_data, window_average
-from fetch import get_date_and_data, save_data_to_file, text_to_kv_pair, ONTARIO_COVID19_GEOJSON, ONTARIO_COVID19_CSV, \
-    ONTARIO_COVID19_POS_LINK, ONTARIO_COVID19_STATUS_LINK
-from rt import *
-from reddit import send_update
-import csv
-import asciichartpy
+from helper import get_regional_panel
+from series import CASES_METRIC, PROVINCE, DailyPanel, to_date, to_day
+from fetch import BASE_URL, get_ontario_datasets
+from pipeline import Pipeline, Stage
+from render import FIGURE_SIZE, FORMATS, PATH_TO_CHARTS, Chart, render_charts
+import instrument
 
+# pandas, scipy and matplotlib are imported by the functions that use them,
+# so checking for new data or reading cached results starts quickly
+
+PATH_TO_PIPELINE_CACHE = "./pipeline_cache"
 THREE_WEEK_DELAY = 21
 WINDOW_SIZE = 5
 LAST_N_DAYS = (WINDOW_SIZE * 7) + 1
 FIRST_N_WEEKS = (LAST_N_DAYS // WINDOW_SIZE) + 1
+CASE_PLOT_REGIONS = ['Hamilton', 'Oakville', 'Windsor', 'Point Edward', PROVINCE]
+CASE_PLOT_LABELS = ['Hamilton', 'Oakville', 'Windsor', 'Sarnia/Lambton', 'Ontario']
+
+
+def generate_plots_of(keys, status):
+    '''
+    :param keys: Cumulative status headers to plot
+    :param status: DailyPanel of the status file
+    :return: DailyPanel of the daily values of keys
+    '''
+    return status.select(metrics=keys).diff()
+
+
+def draw_panel(fig, plot_title, panel, labels=None):
+    '''
+    :param fig: Empty figure
+    :param plot_title: Title of the figure
+    :param panel: DailyPanel with one line per region and metric
+    :param labels: Label per line, the metric names for a single region and the region names otherwise
+    '''
+    lines = [(region, metric) for region in panel.regions for metric in panel.metrics]
+    labels = labels or [metric if len(panel.regions) == 1 else region for region, metric in lines]
+    recent = panel.last(LAST_N_DAYS)
+    average_dates, averages = panel.blocked_mean(WINDOW_SIZE)
+    ax = fig.add_subplot()
+    for (region, metric), label in zip(lines, labels):
+        i, j = panel.regions.index(region), panel.metrics.index(metric)
+        ax.scatter(recent.dates, recent.values[i, :, j], label=label, alpha=0.7)
+        ax.plot(average_dates[:FIRST_N_WEEKS], averages[i, :FIRST_N_WEEKS, j], label=f'{label} Average', alpha=0.7)
+
+    ax.set_xticks(recent.dates)
+    ax.tick_params(axis='x', labelrotation=90)
+    fig.suptitle(plot_title)
+    ax.legend()
+
+
+def draw_rt(fig, result, region_name):
+    from matplotlib import dates as mdates
+    from rt import plot_rt
+
+    ax = fig.add_subplot()
+    plot_rt(result, fig, ax, region_name)
+    ax.set_title(f'Real-time $R_t$ for {region_name}')
+    ax.xaxis.set_major_locator(mdates.WeekdayLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
 
 
-def generate_plots_of(keys, data_set, dates):
-    plots = []
-    for key in keys:
-        itr = cumulative_to_daily([item[key] for item in data_set])
-        plot = {
-            'name': key,
-            'data': dict(zip(dates, itr)),
-            'avg_data': window_average(dict(zip(dates, itr)), WINDOW_SIZE),
-        }
-        plots.append(plot)
-    return {'plots': plots, 'dates': dates}
+@instrument.instrumented('plot')
+def make_plots(plot_title, panel, labels=None):
+    import matplotlib.pyplot as plt
+
+    draw_panel(plt.figure(), plot_title, panel, labels)
+    plt.show()
 
 
-def make_plots(plot_title, plots):
-    plts, dates = plots['plots'], plots['dates']
-    for plot in plts:
-        plt.scatter(list(plot['data'].keys())[-LAST_N_DAYS:], list(plot['data'].values())[-LAST_N_DAYS:],
-                    label=plot['name'], alpha=0.7)
-        plt.plot(list(plot['avg_data'].keys())[:FIRST_N_WEEKS], list(plot['avg_data'].values())[:FIRST_N_WEEKS],
-                 label=f'{plot["name"]} Average', alpha=0.7)
+def chart_name(region):
+    return re.sub(r'[^0-9a-z]+', '_', region.lower()).strip('_')
 
-    plt.xticks(dates[-LAST_N_DAYS:], rotation=90)
-    plt.suptitle(plot_title)
-    plt.legend()
-    plt.show()
 
+def get_charts(outputs):
+    '''
+    :param outputs: Pipeline outputs, see run_pipeline
+    :return: List of render.Chart for the provincial charts and the average and R_t of every PHU
+    '''
+    regional, phu_result = outputs['regional'], outputs['phu_rt']
+    case_plots = regional.select(regions=CASE_PLOT_REGIONS)
+    charts = [
+        Chart('rt', draw_rt, (outputs['rt'], 'ON')),
+        Chart('deaths', draw_panel, ('Deaths in Ontario', outputs['daily_plots'])),
+        Chart('hospital', draw_panel, ('Ontario Hospital Status', outputs['hospital_plots'])),
+        Chart('weekly_average', draw_panel, ('Weekly Average', case_plots, CASE_PLOT_LABELS)),
+    ]
+    charts.extend(Chart(f'phu/{chart_name(city)}_average', draw_panel,
+                        (f'{city} Weekly Average', regional.select(regions=[city])))
+                  for city in regional.regions if city != PROVINCE)
+    charts.extend(Chart(f'phu/{chart_name(region)}_rt', draw_rt, (phu_result.loc[region], region))
+                  for region in phu_result.index.unique(level='region'))
+    return charts
 
-def cumulative_to_daily(values):
-    result = [values[i + 1] - values[i] for i in range(0, len(values) - 1)]
-    result.insert(0, values[0])
-    return result
 
+@instrument.instrumented('render')
+def render_update(outputs, formats=FORMATS, path=PATH_TO_CHARTS, processes=None):
+    return render_charts(get_charts(outputs), formats, path, processes)
+
+
+def get_phu_cases(regional):
+    import pandas as pd
+    index = pd.DatetimeIndex(regional.dates, name='date')
+    return {city: pd.Series(regional.series(city, CASES_METRIC), index=index, name=f'{city} cases').iloc[50:-7]
+            for city in regional.regions if city != PROVINCE}
 
-def service_update(today):
-    ontario_data = get_date_and_data(today, ONTARIO_COVID19_STATUS_LINK, ONTARIO_COVID19_CSV)
-    if (date := ontario_data['date']) == today:
-        save_data_to_file(date, ontario_data['data'], ONTARIO_COVID19_CSV)
-
-    ontario_case_data = get_date_and_data(today, ONTARIO_COVID19_POS_LINK, ONTARIO_COVID19_GEOJSON)
-    if (date := ontario_case_data['date']) == today:
-        save_data_to_file(date, ontario_case_data['data'], ONTARIO_COVID19_GEOJSON)
-
-    ontario, cities = get_regional_data(ontario_case_data)
-    if date == today:
-        with open('ef_ont.csv', 'w') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['date', 'positive'])
-            for key, value in ontario.items():
-                writer.writerow([key, value])
-
-    with open('ef_ont.csv', 'r') as f:
-        ontario_rt = pd.read_csv(f,
-                                 usecols=['date', 'positive'],
-                                 parse_dates=['date'],
-                                 index_col=['date'],
-                                 squeeze=True).sort_index()
-
-    ontario_rt = ontario_rt.iloc[50:-7]
-    cases = ontario_rt.rename("ON cases")
-    cases.index.names = ['date']
-    result = calculate_rt(cases)
-
-    ontario_values = ontario_data['data'].values()
-    ontario_dates = list(ontario_data['data'].keys())
-
-    daily_plots = generate_plots_of(['Deaths', 'Total Cases'], ontario_values, ontario_dates)
-    hospital_plots = generate_plots_of(['Number of patients hospitalized with COVID-19',
-                                        'Number of patients in ICU with COVID-19',
-                                        'Number of patients in ICU on a ventilator with COVID-19'],
-                                       ontario_values, ontario_dates)
 
+def get_ontario_cases(regional):
+    import pandas as pd
+    index = pd.DatetimeIndex(regional.dates, name='date')
+    return pd.Series(regional.series(PROVINCE, CASES_METRIC), index=index, name='ON cases').iloc[50:-7]
+
+
+def get_positivity(status):
     ta = 'Total patients approved for testing as of Reporting Date'
     cp = 'Total Cases'
-    yd = ontario_data['data'][ontario_dates[-2]]
-    td = ontario_data['data'][ontario_dates[-1]]
-    positivity_rate = 100 * ((td[cp] - yd[cp]) / (td[ta] - yd[ta]))
+    new_cases, new_tests = (int(status.last(2).diff().series(PROVINCE, key)[-1]) for key in (cp, ta))
+    return new_cases, new_tests, 100 * (new_cases / new_tests)
+
 
+def get_cases_per_100k(regional):
     POPULATION_ONTARIO = 14446515
     H100k = 100000
-    avg = window_average(ontario, WINDOW_SIZE)
-    cases_per_100k = (list(avg.values())[1] / POPULATION_ONTARIO) * H100k
+    _, averages = regional.select(regions=[PROVINCE]).blocked_mean(WINDOW_SIZE)
+    return (averages[0, 1, 0] / POPULATION_ONTARIO) * H100k
 
-    data = {
+
+def get_update(today, result, phu_result, positivity, cases_per_100k):
+    new_cases, new_tests, positivity_rate = positivity
+    return {
         'today_key_info': {
-            'case count': (td[cp] - yd[cp]),
-            'test count': (td[ta] - yd[ta]),
+            'case count': new_cases,
+            'test count': new_tests,
             'date': today,
             'r_t': result.iloc[-1]['ML'],
             'case per 100k': cases_per_100k,
             'positivity': positivity_rate
         },
         'plots': {
-            'rt': result['ML'].tolist()
+            'rt': result['ML'].tolist(),
+            'phu_rt': {region: phu_result.loc[region]['ML'].tolist()
+                       for region in phu_result.index.unique(level='region')}
         }
     }
 
-    return data
+
+def get_status(status_data, today):
+    # The status file may hold days after the date of the update
+    return DailyPanel.from_status(status_data['table']).days(stop=to_date(to_day(today) + 1))
+
+
+def get_rt(regional):
+    from rt import PATH_TO_RT_STATE_FILE, calculate_rt
+    return calculate_rt(get_ontario_cases(regional), state_path=PATH_TO_RT_STATE_FILE)
+
+
+def get_phu_rt(regional):
+    from rt import calculate_rt_regions
+    return calculate_rt_regions(get_phu_cases(regional))
+
+
+def get_daily_plots(status):
+    return generate_plots_of(['Deaths', 'Total Cases'], status)
+
+
+def get_hospital_plots(status):
+    return generate_plots_of(['Number of patients hospitalized with COVID-19',
+                              'Number of patients in ICU with COVID-19',
+                              'Number of patients in ICU on a ventilator with COVID-19'], status)
+
+
+# Every stage is rerun only when one of its inputs changed since the last run, in this process or an earlier one
+pipeline = Pipeline(
+    Stage('regional', get_regional_panel, ['case_data', 'today']),
+    Stage('status', get_status, ['status_data', 'today']),
+    Stage('rt', get_rt, ['regional']),
+    Stage('phu_rt', get_phu_rt, ['regional']),
+    Stage('daily_plots', get_daily_plots, ['status']),
+    Stage('hospital_plots', get_hospital_plots, ['status']),
+    Stage('positivity', get_positivity, ['status']),
+    Stage('cases_per_100k', get_cases_per_100k, ['regional']),
+    Stage('update', get_update, ['today', 'rt', 'phu_rt', 'positivity', 'cases_per_100k']),
+    cache_path=PATH_TO_PIPELINE_CACHE,
+)
+
+
+def run_pipeline(today, base_url=BASE_URL):
+    with instrument.stage('fetch'):
+        ontario_data, ontario_case_data = get_ontario_datasets(today, base_url)
+    return pipeline.run(today=today, status_data=ontario_data, case_data=ontario_case_data)
+
+
+def service_update(today):
+    return run_pipeline(today)['update']
 
 
 def main():
@@ -120,102 +204,33 @@ def main():
     year, month, day = current_date.year, str(current_date.month).zfill(2), str(current_date.day).zfill(2)
     today = f'{year}-{month}-{day}'
 
-    ontario_data = get_date_and_data(today, ONTARIO_COVID19_STATUS_LINK, ONTARIO_COVID19_CSV)
-    if (date := ontario_data['date']) == today:
-        save_data_to_file(date, ontario_data['data'], ONTARIO_COVID19_CSV)
-
-    ontario_case_data = get_date_and_data(today, ONTARIO_COVID19_POS_LINK, ONTARIO_COVID19_GEOJSON)
-    if (date := ontario_case_data['date']) == today:
-        save_data_to_file(date, ontario_case_data['data'], ONTARIO_COVID19_GEOJSON)
-
-    ontario, cities = get_regional_data(ontario_case_data)
-    if date == today:
-        with open('ef_ont.csv', 'w') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['date', 'positive'])
-            for key, value in ontario.items():
-                writer.writerow([key, value])
-
-    with open('ef_ont.csv', 'r') as f:
-        ontario_rt = pd.read_csv(f,
-                                 usecols=['date', 'positive'],
-                                 parse_dates=['date'],
-                                 index_col=['date'],
-                                 squeeze=True).sort_index()
-
-    ontario_rt = ontario_rt.iloc[50:-7]
-    cases = ontario_rt.rename("ON cases")
-    cases.index.names = ['date']
-    result = calculate_rt(cases)
-
-    ontario_values = ontario_data['data'].values()
-    ontario_dates = list(ontario_data['data'].keys())
-
-    daily_plots = generate_plots_of(['Deaths', 'Total Cases'], ontario_values, ontario_dates)
-    hospital_plots = generate_plots_of(['Number of patients hospitalized with COVID-19',
-                                        'Number of patients in ICU with COVID-19',
-                                        'Number of patients in ICU on a ventilator with COVID-19'],
-                                       ontario_values, ontario_dates)
+    # Set INSTRUMENT_REPORT to a path to get the time, rows, bytes and memory of each stage
+    if report_path := instrument.enable_from_environment():
+        atexit.register(instrument.write_report, report_path)
 
-    ta = 'Total patients approved for testing as of Reporting Date'
-    cp = 'Total Cases'
-    yd = ontario_data['data'][ontario_dates[-2]]
-    td = ontario_data['data'][ontario_dates[-1]]
-    positivity_rate = 100 * ((td[cp] - yd[cp]) / (td[ta] - yd[ta]))
-
-    POPULATION_ONTARIO = 14446515
-    H100k = 100000
-    avg = window_average(ontario, WINDOW_SIZE)
-    cases_per_100k = (list(avg.values())[1] / POPULATION_ONTARIO) * H100k
-    print(f'{cases_per_100k:2.2f} cases per 100,000')
+    outputs = run_pipeline(today)
+    regional, result, phu_result = outputs['regional'], outputs['rt'], outputs['phu_rt']
+    _, _, positivity_rate = outputs['positivity']
+    print(f'{outputs["cases_per_100k"]:2.2f} cases per 100,000')
     print(f'{positivity_rate:2.2f}% positivity rate')
     print(result.iloc[-1])
+    print(phu_result.groupby(level='region').tail(1))
 
-    case_plots = {
-        'plots': [
-            {
-                'name': 'Hamilton',
-                'data': cities['Hamilton'],
-                'avg_data': window_average(cities['Hamilton'], WINDOW_SIZE)
-            },
-            {
-                'name': 'Oakville',
-                'data': cities['Oakville'],
-                'avg_data': window_average(cities['Oakville'], WINDOW_SIZE)
-            },
-            {
-                'name': 'Windsor',
-                'data': cities['Windsor'],
-                'avg_data': window_average(cities['Windsor'], WINDOW_SIZE)
-            },
-            {
-                'name': 'Sarnia/Lambton',
-                'data': cities['Point Edward'],
-                'avg_data': window_average(cities['Point Edward'], WINDOW_SIZE)
-            },
-            {
-                'name': 'Ontario',
-                'data': ontario,
-                'avg_data': window_average(ontario, WINDOW_SIZE)
-            }
-        ],
-        'dates': list(ontario.keys())
-    }
+    case_plots = regional.select(regions=CASE_PLOT_REGIONS)
 
     arg = input('Continue? Y/[N] ')
     if arg[0].lower() != 'y':
         return 0
 
-    fig, ax = plt.subplots(figsize=(1200 / 72, 800 / 72))
-    plot_rt(result, fig, ax, 'ON')
-    ax.set_title(f'Real-time $R_t$ for ON')
-    ax.xaxis.set_major_locator(mdates.WeekdayLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
-    plt.show()
+    import matplotlib.pyplot as plt
+
+    with instrument.stage('plot'):
+        draw_rt(plt.figure(figsize=FIGURE_SIZE), result, 'ON')
+        plt.show()
 
-    make_plots('Deaths in Ontario', daily_plots)
-    make_plots('Ontario Hospital Status', hospital_plots)
-    make_plots('Weekly Average', case_plots)
+    make_plots('Deaths in Ontario', outputs['daily_plots'])
+    make_plots('Ontario Hospital Status', outputs['hospital_plots'])
+    make_plots('Weekly Average', case_plots, CASE_PLOT_LABELS)
 
 
 if __name__ == "__main__":
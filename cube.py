@@ -0,0 +1,144 @@
+import numpy as np
+
+from helper import BATCH_SIZE, DATE_KEY, MISSING_DAY
+from series import CASES_METRIC, DailyPanel, to_day
+from snapshot import load_case_snapshot, load_snapshot_arrays, save_snapshot_arrays
+
+CUBE = "cube"
+CUBE_KEYS = ('Reporting_PHU', 'Age_Group', 'Outcome1')
+
+
+class CaseCube:
+    '''
+    Case counts by each category in keys and by episode date, stored as running totals along the dates.
+    prefix[..., i] counts the cases before first_day + i, so the count over any run of days is
+    the difference of two entries and picking one value per category is plain indexing.
+    '''
+
+    def __init__(self, keys, names, first_day, prefix):
+        self.keys = tuple(keys)
+        self.names = {key: list(names[key]) for key in self.keys}
+        self.first_day = int(first_day)
+        self.prefix = prefix
+        self._codes = {key: {name: code for code, name in enumerate(self.names[key])} for key in self.keys}
+
+    def __len__(self):
+        return self.prefix.shape[-1] - 1
+
+    def offset(self, date, default):
+        if date is None:
+            return default
+        return min(max(int(to_day(date)) - self.first_day, 0), len(self))
+
+    def select(self, selection, keep=()):
+        '''
+        :param selection: Dictionary of k, v pair key, name or list of names, keys left out keep every name
+        :param keep: Keys left whole whatever the selection
+        :return: View of the running totals with single names indexed away, then the tuple of
+                 the (axis, codes) still to take for the keys given a list of names
+        '''
+        unknown = set(selection) - set(self.keys)
+        if unknown:
+            raise KeyError(f'The cube has no {sorted(unknown)}, only {self.keys}')
+        index, lists, axis = [], [], 0
+        for key in self.keys:
+            value = None if key in keep else selection.get(key)
+            if value is None:
+                index.append(slice(None))
+                axis += 1
+            elif isinstance(value, str):
+                index.append(self._codes[key][value])
+            else:
+                index.append(slice(None))
+                lists.append((axis, [self._codes[key][name] for name in value]))
+                axis += 1
+        return self.prefix[tuple(index)], lists
+
+    def count(self, start=None, stop=None, **selection):
+        '''
+        :param start: First episode date counted, the first day of the cube if None
+        :param stop: Episode date after the last one counted, the end of the cube if None
+        :param selection: Names per key, e.g. Reporting_PHU='Toronto Public Health', Age_Group=['20s', '30s']
+        :return: Number of cases matching the selection with an episode date in [start, stop)
+        '''
+        block, lists = self.select(selection)
+        # Only the two date edges are read, before the lists of names are taken
+        edges = block[..., [self.offset(start, 0), self.offset(stop, len(self))]]
+        for axis, codes in lists:
+            edges = np.take(edges, codes, axis=axis)
+        return int((edges[..., 1] - edges[..., 0]).sum())
+
+    def panel(self, by, start=None, stop=None, **selection):
+        '''
+        :param by: Key whose names become the regions of the panel
+        :param selection: Names per key the counts are limited to, see count
+        :return: DailyPanel of daily case counts for each name of by, summed over the other keys
+        '''
+        block, lists = self.select(selection, keep=(by,))
+        first, last = self.offset(start, 0), self.offset(stop, len(self))
+        block = block[..., first:last + 1]
+        for axis, codes in lists:
+            block = np.take(block, codes, axis=axis)
+        # Axes of single names are gone, so by is the only whole axis left before the dates that isn't summed
+        by_axis = [key for key in self.keys if key == by or not isinstance(selection.get(key), str)].index(by)
+        totals = np.moveaxis(block, by_axis, 0).reshape(block.shape[by_axis], -1, block.shape[-1]).sum(axis=1)
+        return DailyPanel(np.diff(totals, axis=-1)[:, :, None], self.first_day + first, self.names[by],
+                          [CASES_METRIC])
+
+
+def build_case_cube(cases, keys=CUBE_KEYS, batch_size=BATCH_SIZE * 16):
+    '''
+    :param cases: Case snapshot, see snapshot.load_case_snapshot
+    :param keys: Coded properties of the snapshot that become the axes of the cube
+    :param batch_size: Number of cases counted per vectorized pass
+    :return: CaseCube of every case with an episode date
+    '''
+    days, columns = cases['columns'][DATE_KEY], [cases['columns'][key] for key in keys]
+    names = {key: cases['names'][key] for key in keys}
+    shape = tuple(len(names[key]) for key in keys)
+
+    batches = [slice(start, start + batch_size) for start in range(0, len(days), batch_size)]
+    first_day, last_day = 0, -1
+    for batch in batches:
+        if len(known := days[batch][days[batch] != MISSING_DAY]):
+            low, high = int(known.min()), int(known.max())
+            first_day, last_day = (low, high) if last_day < first_day else (min(first_day, low), max(last_day, high))
+    width = last_day - first_day + 1
+
+    counts = np.zeros(int(np.prod(shape)) * width, dtype=np.int64)
+    for batch in batches:
+        batch_days = days[batch]
+        keep = batch_days != MISSING_DAY
+        flat = np.zeros(int(keep.sum()), dtype=np.int64)
+        for column, size in zip(columns, shape):
+            flat = flat * size + column[batch][keep]
+        counts += np.bincount(flat * width + batch_days[keep] - first_day, minlength=len(counts))
+
+    prefix = np.zeros(shape + (width + 1,), dtype=np.int64)
+    np.cumsum(counts.reshape(shape + (width,)), axis=-1, out=prefix[..., 1:])
+    return CaseCube(keys, names, first_day, prefix)
+
+
+def save_case_cube(date, cube):
+    save_snapshot_arrays(date, CUBE, {'prefix': cube.prefix},
+                         {'keys': cube.keys, 'names': cube.names, 'first_day': cube.first_day})
+
+
+def load_case_cube(date):
+    if (stored := load_snapshot_arrays(date, CUBE, ('prefix',))) is None:
+        return None
+    arrays, meta = stored
+    return CaseCube(meta['keys'], meta['names'], meta['first_day'], arrays['prefix'])
+
+
+def get_case_cube(cases=None):
+    '''
+    :param cases: Case snapshot, the latest one if None
+    :return: CaseCube stored next to the snapshot, built and saved on first use
+    '''
+    if cases is None and (cases := load_case_snapshot()) is None:
+        return None
+    if (cube := load_case_cube(cases['date'])) is None:
+        cube = build_case_cube(cases)
+        save_case_cube(cases['date'], cube)
+    return cube
@@ -1,14 +1,27 @@
+import hashlib
+import os
+import re
 import requests
-from json import dump, load, loads
-from bs4 import BeautifulSoup
-from urllib.error import HTTPError
-from urllib.error import URLError
-from urllib.request import urlopen
+from codecs import getincrementaldecoder
+from concurrent.futures import ThreadPoolExecutor
+from json import JSONDecodeError, JSONDecoder, dump, load
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from cube import get_case_cube
+from instrument import count, instrumented
+from snapshot import CASES, latest_snapshot, load_case_snapshot, load_status_snapshot, save_case_snapshot, \
+    save_status_snapshot
+from spatial import get_grid_index
+from status import StatusTable, parse_status_csv
 
 PATH_TO_JSON_DATE_FILE = "./datefilejson"
 PATH_TO_GEOJSON_DATE_FILE = "./datefilegeojson"
 PATH_TO_JSON_DATA_FILE = "./data.json"
 PATH_TO_GEOJSON_DATA_FILE = "./conposcovidloc.geojson"
+PATH_TO_CSV_DATA_FILE = "./ont.csv"
+PATH_TO_JSON_HASH_FILE = "./hashfilejson"
+PATH_TO_GEOJSON_HASH_FILE = "./hashfilegeojson"
+PATH_TO_HTTP_CACHE_FILE = "./httpcache.json"
 LAST_VALIDATED_DATE = "Last Validated Date"
 TAG_RESOURCE = 'resource-url-analytics btn btn-primary dataset-download-link'
 BASE_URL = "https://data.ontario.ca/"
@@ -16,52 +29,79 @@ ONTARIO_COVID19_GEOJSON = ".geojson"
 ONTARIO_COVID19_CSV = ".csv"
 ONTARIO_COVID19_POS_LINK = "dataset/confirmed-positive-cases-of-covid-19-in-ontario"
 ONTARIO_COVID19_STATUS_LINK = "dataset/status-of-covid-19-cases-in-ontario"
+CHUNK_SIZE = 1 << 16
+GEOJSON_FEATURES_KEY = '"features"'
+JSON_SEPARATORS = re.compile(r'[\s,]*')
 
-
-def get_html(url):
-    html = None
-    try:
-        html = urlopen(url)
-    except HTTPError as e:
-        print(e)
-    except URLError as u:
-        print(u)
-    finally:
-        return html
+# One pooled session for all requests, so both datasets reuse their connections to data.ontario.ca
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+http_cache_lock = Lock()
 
 
 def text_to_kv_pair(text):
-    csv_key_pair = dict()
-    row_strings = text.split('\n')
-
-    def clean(list_of_strings):
-        return [x.strip('\r') for x in list_of_strings]
+    return parse_status_csv(text).to_dict()
 
-    rows = [clean(a) for a in [x.split(',') for x in row_strings]]
 
-    def string_to_int(int_string):
-        return 0 if int_string == '' else int(int_string)
+def get_hash_from_file(filetype):
+    path_to_hash_file = PATH_TO_JSON_HASH_FILE if filetype == ONTARIO_COVID19_CSV else PATH_TO_GEOJSON_HASH_FILE
+    if not os.path.exists(path_to_hash_file):
+        return None
+    with open(path_to_hash_file, 'r') as f:
+        return f.read()
 
-    headers, data = rows[0], rows[1:-1]
-    for row in data:
-        date = row[0]
-        csv_key_pair[date] = dict(zip(headers[1:], list(map(string_to_int, row[1:]))))
-    return csv_key_pair
 
+def save_hash_to_file(sha256, filetype):
+    path_to_hash_file = PATH_TO_JSON_HASH_FILE if filetype == ONTARIO_COVID19_CSV else PATH_TO_GEOJSON_HASH_FILE
+    with open(path_to_hash_file, 'w') as f:
+        f.write(sha256)
 
-def save_data_to_file(date, data, filetype):
-    if filetype == ONTARIO_COVID19_CSV:
-        path_to_file = PATH_TO_JSON_DATA_FILE
-        path_to_date_file = PATH_TO_JSON_DATE_FILE
-    else:
-        path_to_file = PATH_TO_GEOJSON_DATA_FILE
-        path_to_date_file = PATH_TO_GEOJSON_DATE_FILE
 
-    with open(path_to_file, 'w') as outfile:
-        dump(data, outfile)
+def save_date_to_file(date, filetype):
+    path_to_date_file = PATH_TO_JSON_DATE_FILE if filetype == ONTARIO_COVID19_CSV else PATH_TO_GEOJSON_DATE_FILE
     with open(path_to_date_file, 'w') as f:
         f.write(date)
 
+
+def load_http_cache():
+    try:
+        with open(PATH_TO_HTTP_CACHE_FILE, 'r') as f:
+            return load(f)
+    except (FileNotFoundError, JSONDecodeError):
+        return dict()
+
+
+def conditional_get(url, stream=False):
+    '''
+    :param url: URL to request, with the validators of its last response if there is one
+    :param stream: Leave the body to be read in chunks
+    :return: Response, with status code 304 and no body if it has not changed, and the cached values for the URL
+    '''
+    with http_cache_lock:
+        cached = load_http_cache().get(url, dict())
+
+    headers = dict()
+    if etag := cached.get('etag'):
+        headers['If-None-Match'] = etag
+    if last_modified := cached.get('last_modified'):
+        headers['If-Modified-Since'] = last_modified
+    return session.get(url, headers=headers, stream=stream), cached
+
+
+def remember_response(url, res, **values):
+    # Only called once the response has been processed, so a failed run asks for the full body again
+    with http_cache_lock:
+        cache = load_http_cache()
+        cache[url] = {
+            'etag': res.headers.get('ETag'),
+            'last_modified': res.headers.get('Last-Modified'),
+            **values
+        }
+        with open(PATH_TO_HTTP_CACHE_FILE, 'w') as f:
+            dump(cache, f)
+
+
 def get_date_from_file(filetype):
     if filetype == ONTARIO_COVID19_CSV:
         path_to_date_file = PATH_TO_JSON_DATE_FILE
@@ -74,49 +114,228 @@ def get_date_from_file(filetype):
     return date_from_file
 
 
-def check_for_update(local_date, link, filetype):
+def check_for_update(local_date, link, filetype, base_url=BASE_URL):
     server_date = None
     date_from_file = get_date_from_file(filetype)
 
     if date_from_file != local_date:
-        server_date, update_link = get_resource(link, filetype)
+        server_date, update_link = get_resource(link, filetype, base_url)
 
     if server_date and server_date == local_date:
         return True, update_link
     return False, None
 
 
-def get_date_and_data(local_date, link, filetype):
-    updated, update_link = check_for_update(local_date, link, filetype)
+class StatusData(dict):
+    '''
+    Status dataset of get_date_and_data, the dictionary view of the table under 'data' is only built when read
+    '''
+
+    def __missing__(self, key):
+        if key != 'data':
+            raise KeyError(key)
+        self['data'] = self['table'].to_dict()
+        return self['data']
+
+
+def get_date_and_data(local_date, link, filetype=ONTARIO_COVID19_CSV, base_url=BASE_URL):
+    '''
+    :param local_date: Today's date as YYYY-MM-DD
+    :param link: Path of the dataset page
+    :param filetype: Only ONTARIO_COVID19_CSV, the case GeoJSON is read by get_date_and_cases
+    :param base_url: Site serving the dataset pages
+    :return: StatusData with the validated date, the StatusTable and the hash of the file
+    '''
+    if filetype != ONTARIO_COVID19_CSV:
+        raise ValueError(f'get_date_and_data only reads {ONTARIO_COVID19_CSV} files, use get_date_and_cases')
+    updated, update_link = check_for_update(local_date, link, ONTARIO_COVID19_CSV, base_url)
+    sha256, changed = get_hash_from_file(ONTARIO_COVID19_CSV), False
     if updated:
         print("Requesting new data")
-        if (res := requests.get(update_link)).status_code != 200:
+        res, _ = conditional_get(update_link, stream=True)
+        if res.status_code == 304:
+            print("Data unchanged since the last download")
+        elif res.status_code != 200:
             raise Exception(f"Failed to retrieve date {res.status_code}")
         else:
-            if filetype == ONTARIO_COVID19_CSV:
-                with open('ont.csv', 'w') as f:
-                    f.write(res.text)
-                result = text_to_kv_pair(res.text)
+            digest = download_to_file(res, PATH_TO_CSV_DATA_FILE)
+            # The same file can come back under a new validated date, only parse it when its content changed
+            if changed := digest != sha256:
+                with open(PATH_TO_CSV_DATA_FILE, 'r') as infile:
+                    result = parse_status_csv(infile.read())
+                save_status_snapshot(local_date, result)
+                save_hash_to_file(digest, ONTARIO_COVID19_CSV)
+                sha256 = digest
             else:
-                result = loads(res.text)
-            remote_date = local_date
+                print("Data matches the last processed snapshot")
+            remember_response(update_link, res)
+        save_date_to_file(local_date, ONTARIO_COVID19_CSV)
+
+    if not changed and (result := load_status_snapshot()) is None:
+        # Status data saved before there were snapshots
+        with open(PATH_TO_JSON_DATA_FILE, 'r') as infile:
+            result = StatusTable.from_dict(load(infile))
+
+    return StatusData({
+        'date': get_date_from_file(ONTARIO_COVID19_CSV),
+        'table': result,
+        'sha256': sha256,
+        'changed': changed
+    })
+
+
+def iter_geojson_features(chunks):
+    '''
+    :param chunks: Iterable of bytes making up a GeoJSON FeatureCollection
+    :return: Generator of feature dicts, decoded one at a time as the chunks arrive
+    '''
+    decoder, text_decoder = JSONDecoder(), getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos, in_features = '', 0, False
 
-    else:  # load data from file
-        date_from_file = get_date_from_file(filetype)
-        if filetype == ONTARIO_COVID19_CSV:
-            path_to_file = PATH_TO_JSON_DATA_FILE
+    def fill(keep_from):
+        chunk = next(chunks, None)
+        if chunk is None:
+            return None
+        return buffer[keep_from:] + text_decoder.decode(chunk)
+
+    while True:
+        if not in_features:
+            # Skip the collection header until the opening bracket of the feature list
+            start = buffer.find(GEOJSON_FEATURES_KEY, pos)
+            bracket = buffer.find('[', start) if start >= 0 else -1
+            if bracket >= 0:
+                pos, in_features = bracket + 1, True
+                continue
+            keep_from = start if start >= 0 else max(pos, len(buffer) - len(GEOJSON_FEATURES_KEY))
+            if (buffer := fill(keep_from)) is None:
+                return
+            pos = 0
+            continue
+
+        pos = JSON_SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == ']':
+            # Read the rest of the collection so that the chunks can finish caching the file
+            for _ in chunks:
+                pass
+            return
+        try:
+            feature, pos = decoder.raw_decode(buffer, pos)
+        except JSONDecodeError:
+            # Feature is split across chunks, read more and try again
+            if (more := fill(pos)) is None:
+                raise
+            buffer, pos = more, 0
+            continue
+        yield feature
+
+
+def read_chunks(path_to_file, chunk_size=CHUNK_SIZE):
+    with open(path_to_file, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def stream_to_file(res, path_to_file, digest):
+    '''
+    :param res: Streamed response
+    :param path_to_file: Path of the cached copy, only replaced once the whole body has arrived
+    :param digest: hashlib object updated with every chunk
+    :return: Generator of the chunks of the body, each one yielded once it is written and hashed
+    '''
+    size, partial_path = 0, f'{path_to_file}.part'
+    try:
+        with open(partial_path, 'wb') as f:
+            for chunk in res.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+                yield chunk
+        expected_size = res.headers.get('Content-Length')
+        if expected_size is not None and 'Content-Encoding' not in res.headers and int(expected_size) != size:
+            raise Exception(f"Incomplete download {size} of {expected_size} bytes")
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, path_to_file)
+    count(size=size)
+
+
+@instrumented('download')
+def download_to_file(res, path_to_file):
+    '''
+    :param res: Streamed response
+    :param path_to_file: Path of the cached copy, only replaced once the whole body has arrived
+    :return: sha256 hex digest of the body, computed while it is written
+    '''
+    sha256 = hashlib.sha256()
+    for _ in stream_to_file(res, path_to_file, sha256):
+        pass
+    return sha256.hexdigest()
+
+
+def get_date_and_cases(local_date, link, base_url=BASE_URL):
+    updated, update_link = check_for_update(local_date, link, ONTARIO_COVID19_GEOJSON, base_url)
+    sha256, changed = get_hash_from_file(ONTARIO_COVID19_GEOJSON), False
+    if updated:
+        print("Requesting new data")
+        res, _ = conditional_get(update_link, stream=True)
+        if res.status_code == 304:
+            print("Data unchanged since the last download")
+        elif res.status_code != 200:
+            raise Exception(f"Failed to retrieve date {res.status_code}")
         else:
-            path_to_file = PATH_TO_GEOJSON_DATA_FILE
-        with open(path_to_file, 'r') as infile:
-            result = load(infile)
-        remote_date = date_from_file
+            digest, first_snapshot = hashlib.sha256(), latest_snapshot(CASES) is None
+            chunks = stream_to_file(res, PATH_TO_GEOJSON_DATA_FILE, digest)
+
+            def content_changed():
+                # Whatever follows the feature list still has to reach the hash and the file
+                for _ in chunks:
+                    pass
+                return digest.hexdigest() != sha256 or first_snapshot
+
+            # Features are encoded as the chunks arrive, the snapshot is thrown away if the content is the same
+            save_case_snapshot(local_date, iter_geojson_features(chunks), keep=content_changed)
+            changed = content_changed()
+            # The snapshot replaces the raw file
+            os.remove(PATH_TO_GEOJSON_DATA_FILE)
+            save_hash_to_file(sha256 := digest.hexdigest(), ONTARIO_COVID19_GEOJSON)
+            remember_response(update_link, res)
+        save_date_to_file(local_date, ONTARIO_COVID19_GEOJSON)
+
+    if latest_snapshot(CASES) is None and os.path.exists(PATH_TO_GEOJSON_DATA_FILE):
+        # Carry over a raw file cached before there were snapshots
+        save_case_snapshot(get_date_from_file(ONTARIO_COVID19_GEOJSON),
+                           iter_geojson_features(read_chunks(PATH_TO_GEOJSON_DATA_FILE)))
+
+    # The aggregate cube and the spatial index are built once per snapshot and stored next to it
+    if (cases := load_case_snapshot()) is not None:
+        get_case_cube(cases)
+        get_grid_index(cases)
 
     return {
-        'date': remote_date,
-        'data': result
+        'date': get_date_from_file(ONTARIO_COVID19_GEOJSON),
+        'cases': cases,
+        'sha256': sha256,
+        'changed': changed
     }
 
 
+def get_ontario_datasets(local_date, base_url=BASE_URL):
+    '''
+    :param local_date: Today's date as YYYY-MM-DD
+    :param base_url: Site serving the dataset pages
+    :return: The status data of get_date_and_data and the case snapshot of get_date_and_cases
+    '''
+    # Check, download and snapshot both datasets at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        status = executor.submit(get_date_and_data, local_date, ONTARIO_COVID19_STATUS_LINK, ONTARIO_COVID19_CSV,
+                                 base_url)
+        cases = executor.submit(get_date_and_cases, local_date, ONTARIO_COVID19_POS_LINK, base_url)
+        return status.result(), cases.result()
+
+
 def find_table_str_value(bs, table_str):
     section = bs.find('section', {"class": "additional-info"})
     table = section.find('table')
@@ -132,10 +351,22 @@ def find_download_link(bs, download_tag, filetype):
             return button['href']
 
 
-def get_resource(resource_path, filetype):
-    html = get_html(f'{BASE_URL}{resource_path}')
-    bs = BeautifulSoup(html.read(), 'html.parser')
+@instrumented('scrape')
+def get_resource(resource_path, filetype, base_url=BASE_URL):
+    url = f'{base_url}{resource_path}'
+    res, cached = conditional_get(url)
+    if res.status_code == 304 and cached.get('filetype') == filetype:
+        return cached['date'], cached['link']
+    if res.status_code != 200:
+        print(f"Failed to retrieve {url} {res.status_code}")
+        return None, None
+
+    from bs4 import BeautifulSoup
+
+    count(size=len(res.content))
+    bs = BeautifulSoup(res.content, 'html.parser')
     date = find_table_str_value(bs, LAST_VALIDATED_DATE)
     download_link = find_download_link(bs, TAG_RESOURCE, filetype)
+    remember_response(url, res, filetype=filetype, date=date, link=download_link)
 
     return date, download_link
@@ -1,62 +1,217 @@
-from datetime import datetime
-
-days_in_months_2020 = {
-    '01': 31,
-    '02': 29,
-    '03': 31,
-    '04': 30,
-    '05': 31,
-    '06': 30,
-    '07': 31,
-    '08': 31,
-    '09': 30,
-    '10': 31,
-    '11': 30,
-    '12': 31
-}
-
-
-def initialize_region_dates(region):
-    current_date = datetime.now()
-    month, day = str(current_date.month).zfill(2), str(current_date.day).zfill(2)
-    for _month, days in days_in_months_2020.items():
-        for _day in range(1, days + 1):
-            region[f'2020-{_month}-{_day:02d}'] = 0
-            if _month == month and day == str(_day).zfill(2):
-                break
-        if _month == month:
-            break
-
-
-def get_regional_data(data):
-    province, cities = dict(), dict()
-    initialize_region_dates(province)
-    age_groups = ['<20', '20s', '30s', '40s', '50s', '60s', '70s', '80s', '90s', 'UNKNOWN']
-    date_key = 'Accurate_Episode_Date'
-    for item in data['data']['features']:
-        datum = item['properties']
-        if datum['Age_Group'] not in age_groups:
-            continue
-        if (case_date := datum[date_key]) is None:
-            continue
+import os
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+
+from instrument import count
+from series import EPOCH, DailyPanel, current_day, to_date
+from window import blocked_mean
+
+AGE_GROUPS = ['<20', '20s', '30s', '40s', '50s', '60s', '70s', '80s', '90s', 'UNKNOWN']
+DATE_KEY = 'Accurate_Episode_Date'
+CITY_KEY = 'Reporting_PHU_City'
+AGE_KEY = 'Age_Group'
+CASE_KEYS = (DATE_KEY, CITY_KEY, AGE_KEY)
+BATCH_SIZE = 1 << 16
+MISSING_DAY = np.iinfo(np.int32).min
+PATH_TO_REGIONAL_DATA_FILE = "./regional.npz"
+
+def get_regional_data(data, date=None):
+    return regional_to_dict(get_regional_array(data, date))
+
+
+def get_regional_panel(data, date=None):
+    return DailyPanel.from_regional(get_regional_array(data, date))
+
+
+def regional_to_dict(regional):
+    return counts_to_dict(regional['dates'], regional['province']), {
+        city: counts_to_dict(regional['dates'], counts) for city, counts in zip(regional['cities'], regional['counts'])
+    }
+
+
+def get_regional_array(data, date=None):
+    '''
+    :param data: Case data with the case snapshot under 'cases' or the GeoJSON features
+    :param date: Date of the update the counts end on, today if None
+    :return: Dictionary with the dense date axis, city names, province counts and city x date counts
+    '''
+    # Reuse the counts of the last run when the case file has the same content
+    if (sha256 := data.get('sha256')) and (regional := load_regional_array(sha256)) is not None:
+        return extend_to_today(regional, date)
+
+    if 'cases' in data:
+        regional = aggregate_case_columns(data['cases'])
+    else:
+        regional = aggregate_cases(data['features'] if 'features' in data else data['data']['features'])
+    if sha256:
+        save_regional_array(regional, sha256)
+    # The saved counts keep every day, so an update of any date can reuse them
+    return extend_to_today(regional, date)
+
+
+def load_regional_array(sha256):
+    if not os.path.exists(PATH_TO_REGIONAL_DATA_FILE):
+        return None
+    with np.load(PATH_TO_REGIONAL_DATA_FILE) as f:
+        if str(f['sha256']) != sha256:
+            return None
+        return {
+            'dates': f['dates'],
+            'cities': f['cities'].tolist(),
+            'province': f['province'],
+            'counts': f['counts'],
+        }
+
+
+def save_regional_array(regional, sha256):
+    partial_path = f'{PATH_TO_REGIONAL_DATA_FILE}.part'
+    with open(partial_path, 'wb') as f:
+        np.savez(f, sha256=sha256, dates=regional['dates'], cities=np.array(regional['cities'], dtype=str),
+                 province=regional['province'], counts=regional['counts'])
+    os.replace(partial_path, PATH_TO_REGIONAL_DATA_FILE)
+
+
+def extend_to_today(regional, date=None):
+    '''
+    :param regional: Dictionary of regional counts, see get_regional_array
+    :param date: Date of the update, the counts are padded with zeros or cut to end on it, today if None
+    :return: Dictionary of regional counts, days after today are only cut when date is given
+    '''
+    last_day = to_date(current_day()) if date is None else np.datetime64(date, 'D')
+    first_day = regional['dates'][0] if len(regional['dates']) else EPOCH
+    days = int((last_day - first_day).astype(np.int64)) + 1
+    if date is not None and days < len(regional['dates']):
+        days = max(days, 0)
+        return {
+            'dates': regional['dates'][:days],
+            'cities': regional['cities'],
+            'province': regional['province'][:days],
+            'counts': regional['counts'][:, :days],
+        }
+    if (missing := days - len(regional['dates'])) <= 0:
+        return regional
+    return {
+        'dates': first_day + np.arange(len(regional['dates']) + missing),
+        'cities': regional['cities'],
+        'province': np.pad(regional['province'], (0, missing)),
+        'counts': np.pad(regional['counts'], ((0, 0), (0, missing))),
+    }
+
+
+def counts_to_dict(dates, counts):
+    return dict(zip(np.datetime_as_string(dates, unit='D'), counts.tolist()))
+
 
-        case_date = case_date[:10]
-        if case_date not in province:
-            province[case_date] = 1
-        else:
-            province[case_date] += 1
+class CategoryCodes:
+    def __init__(self, names=()):
+        self.names = list(names)
+        self._codes = {name: code for code, name in enumerate(self.names)}
 
-        if (city := datum['Reporting_PHU_City']) not in cities:
-            cities[city] = dict()
-            initialize_region_dates(cities[city])
+    def encode(self, values):
+        try:
+            return np.fromiter(map(self._codes.__getitem__, values), dtype=np.int32, count=len(values))
+        except KeyError:
+            return np.fromiter(map(self._code, values), dtype=np.int32, count=len(values))
+
+    def _code(self, name):
+        if name not in self._codes:
+            self._codes[name] = len(self.names)
+            self.names.append(name)
+        return self._codes[name]
+
+
+def case_encoders(keys=CASE_KEYS):
+    return {key: CategoryCodes(AGE_GROUPS if key == AGE_KEY else ()) for key in keys}
+
+
+def iter_case_batches(features, encoders, batch_size=BATCH_SIZE):
+    '''
+    :param features: Iterable of GeoJSON case features
+    :param encoders: Dictionary of CategoryCodes per property, shared across batches
+    :param batch_size: Number of features per batch
+    :return: Generator of dicts with the integer coded columns of each batch
+    '''
+    features = iter(features)
+    while batch := list(map(itemgetter('properties'), islice(features, batch_size))):
+        yield case_columns(batch, encoders)
+
+
+def case_columns(properties, encoders):
+    return {key: encoder.encode(property_values(properties, key)) for key, encoder in encoders.items()}
+
+
+def property_values(properties, key):
+    try:
+        return list(map(itemgetter(key), properties))
+    except KeyError:
+        # Older versions of the case file don't have every property
+        return [datum.get(key) for datum in properties]
+
+
+def episode_days(encoder, first_day=EPOCH):
+    # The U10 dtype keeps only the YYYY-MM-DD part of each distinct timestamp
+    dates = np.array([name or 'NaT' for name in encoder.names], dtype='U10').astype('datetime64[D]')
+    return np.where(np.isnat(dates), MISSING_DAY, (dates - first_day).astype(np.int64))
+
+
+def aggregate_cases(features, batch_size=BATCH_SIZE, date=None):
+    '''
+    :param features: Iterable of GeoJSON case features
+    :param batch_size: Number of features counted per vectorized pass
+    :param date: Date of the update the counts end on, today if None
+    :return: Dictionary with the dense date axis, city names, province counts and city x date counts
+    '''
+    encoders = case_encoders()
+    batches = ((episode_days(encoders[DATE_KEY])[columns[DATE_KEY]], columns[CITY_KEY], columns[AGE_KEY])
+               for columns in iter_case_batches(features, encoders, batch_size))
+    return count_cases(batches, encoders[CITY_KEY].names, date)
+
+
+def aggregate_case_columns(cases, batch_size=BATCH_SIZE * 16, date=None):
+    '''
+    :param cases: Case snapshot with integer coded columns, see snapshot.load_case_snapshot
+    :param batch_size: Number of cases counted per vectorized pass
+    :param date: Date of the update the counts end on, today if None
+    :return: Dictionary with the dense date axis, city names, province counts and city x date counts
+    '''
+    days, cities, ages = (cases['columns'][key] for key in CASE_KEYS)
+    batches = ((days[i:i + batch_size], cities[i:i + batch_size], ages[i:i + batch_size])
+               for i in range(0, len(days), batch_size))
+    return count_cases(batches, cases['names'][CITY_KEY], date)
+
+
+def count_cases(batches, city_names, date=None):
+    '''
+    :param batches: Iterable of (days since EPOCH, city code, age group code) arrays
+    :param city_names: List of city names by code, may grow as the batches are read
+    :param date: Date of the update the counts end on, today if None
+    :return: Dictionary with the dense date axis, city names, province counts and city x date counts
+    '''
+    counts, first_day = np.zeros((0, 0), dtype=np.int64), 0
+    for days, cities, ages in batches:
+        count(rows=len(days))
+        keep = (ages < len(AGE_GROUPS)) & (days != MISSING_DAY)
+        if not keep.any():
+            continue
 
-        current_city = cities[city]
-        if case_date not in cities[city]:
-            current_city[case_date] = 1
-        else:
-            current_city[case_date] += 1
+        cities, days = cities[keep], days[keep].astype(np.int64) - first_day
+        low, high = min(days.min(), 0), max(days.max() + 1, counts.shape[1])
+        # Grow the dense counts to cover any new cities or dates, then count the batch in one pass
+        counts = np.pad(counts, ((0, len(city_names) - counts.shape[0]), (-low, high - counts.shape[1])))
+        first_day, days = first_day + low, days - low
+        width = counts.shape[1]
+        counts += np.bincount(cities * width + days, minlength=counts.size).reshape(counts.shape)
 
-    return province, cities
+    # Cities only seen on filtered out cases get no row
+    seen = np.flatnonzero(counts.any(axis=1))
+    return extend_to_today({
+        'dates': EPOCH + first_day + np.arange(counts.shape[1]),
+        'cities': [city_names[code] for code in seen],
+        'province': counts.sum(axis=0),
+        'counts': counts[seen],
+    }, date)
 
 
 def window_average(data, window_length):
@@ -65,11 +220,6 @@ def window_average(data, window_length):
     :param window_length: length of the window that will be averaged
     :return: Dictionary with k, v pair Date, average count, date is the last date for the window
     '''
-    reverse_chronological_order = list(reversed(data.items()))
-    length = len(reverse_chronological_order)
-    average = dict()
-    for i in range(0, length, window_length):
-        window = [item[1] for item in reverse_chronological_order[i:i + window_length]]
-        average[reverse_chronological_order[i][0]] = sum(window) / window_length
-
-    return average
+    dates = list(data.keys())
+    last_days, means = blocked_mean(np.fromiter(data.values(), dtype=np.float64, count=len(dates)), window_length)
+    return dict(zip((dates[day] for day in last_days), means.tolist()))
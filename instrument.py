@@ -0,0 +1,210 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS is left out of the report
+    resource = None
+
+ENV_REPORT = 'INSTRUMENT_REPORT'
+ENV_PROFILE = 'INSTRUMENT_PROFILE'
+PATH_TO_CLEAR_REFS = '/proc/self/clear_refs'
+PATH_TO_STATUS = '/proc/self/status'
+DISABLED = nullcontext()
+
+recorder = None
+
+
+class Recorder:
+    '''
+    Totals of each named stage across calls and threads, plus an optional cProfile of one stage.
+    Resetting the high-water mark of the resident set resets it for the whole process, so only stages
+    of the main thread entered while no other thread is in a stage get their own peak_rss_bytes.
+    Any other stage reports process_peak_rss_bytes, the peak of the process so far.
+    '''
+
+    def __init__(self, profile_stage=None, profile_path=None):
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.start_wall, self.start_cpu = time.perf_counter(), time.process_time()
+        self.start_children_cpu = children_cpu()
+        self.profile_stage = profile_stage
+        self.profile_path = profile_path or f'{profile_stage}.prof'
+        self.stages = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threaded_stages = 0
+
+    @contextmanager
+    def stage(self, name):
+        totals = {'calls': 1, 'wall_seconds': 0., 'cpu_seconds': 0., 'children_cpu_seconds': 0., 'rows': 0,
+                  'bytes': 0}
+        stack = self._local.__dict__.setdefault('stack', [])
+        main = threading.current_thread() is threading.main_thread()
+        with self._lock:
+            # A reset would also wipe the peak of stages running on other threads
+            resettable = main and not self._threaded_stages
+            self._threaded_stages += not main
+        if resettable and stack and (peak := stage_peak_rss()) is not None:
+            # Resetting the high-water mark below would hide what the enclosing stage used so far
+            stack[-1]['peak_rss_bytes'] = max(stack[-1].get('peak_rss_bytes', 0), peak)
+        stack.append(totals)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        resettable = resettable and reset_peak_rss()
+        wall, cpu, children = time.perf_counter(), time.thread_time(), children_cpu()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(self.profile_path)
+            # CPU time is per thread since the two datasets are fetched at the same time,
+            # worker processes are counted once they exited, when their pool closes
+            totals['wall_seconds'] = time.perf_counter() - wall
+            totals['cpu_seconds'] = time.thread_time() - cpu
+            totals['children_cpu_seconds'] = children_cpu() - children
+            if resettable:
+                totals['peak_rss_bytes'] = max(totals.get('peak_rss_bytes', 0), stage_peak_rss() or 0)
+            else:
+                # Without a resettable high-water mark only the peak of the whole process is known
+                totals['process_peak_rss_bytes'] = peak_rss()
+            stack.pop()
+            if stack and resettable:
+                stack[-1]['peak_rss_bytes'] = max(stack[-1].get('peak_rss_bytes', 0), totals['peak_rss_bytes'])
+            if not main:
+                with self._lock:
+                    self._threaded_stages -= 1
+            self.add(name, totals)
+
+    def add(self, name, totals):
+        with self._lock:
+            if (stage := self.stages.get(name)) is None:
+                self.stages[name] = totals
+                return
+            for key in ('calls', 'wall_seconds', 'cpu_seconds', 'children_cpu_seconds', 'rows', 'bytes'):
+                stage[key] += totals[key]
+            for key in ('peak_rss_bytes', 'process_peak_rss_bytes'):
+                if key in totals:
+                    stage[key] = max(stage.get(key) or 0, totals[key] or 0)
+
+    def count(self, rows=0, size=0):
+        if stack := getattr(self._local, 'stack', None):
+            stack[-1]['rows'] += rows
+            stack[-1]['bytes'] += size
+
+    def report(self):
+        return {
+            'started': self.started,
+            'wall_seconds': time.perf_counter() - self.start_wall,
+            'cpu_seconds': time.process_time() - self.start_cpu,
+            'children_cpu_seconds': children_cpu() - self.start_children_cpu,
+            'process_peak_rss_bytes': peak_rss(),
+            'profile': self.profile_path if self.profile_stage else None,
+            'stages': self.stages,
+        }
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    '''
+    :return: True if the high-water mark of the resident set now starts again from the current size
+    '''
+    try:
+        with open(PATH_TO_CLEAR_REFS, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def stage_peak_rss():
+    # High-water mark since the last reset_peak_rss, only Linux exposes and resets it
+    try:
+        with open(PATH_TO_STATUS, 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def children_cpu():
+    if resource is None:
+        return 0.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def enable(profile_stage=None, profile_path=None):
+    global recorder
+    recorder = Recorder(profile_stage, profile_path)
+    return recorder
+
+
+def enable_from_environment():
+    '''
+    :return: Path the report should be written to, None if instrumentation stays disabled
+    '''
+    if (report_path := os.environ.get(ENV_REPORT)) is None:
+        return None
+    enable(os.environ.get(ENV_PROFILE))
+    return report_path
+
+
+def disable():
+    global recorder
+    recorder = None
+
+
+def stage(name):
+    '''
+    :param name: Name the time, rows and bytes are reported under, repeated names are summed
+    :return: Context manager measuring its block, a shared no-op when instrumentation is disabled
+    '''
+    return DISABLED if recorder is None else recorder.stage(name)
+
+
+def instrumented(name):
+    '''
+    :param name: Stage name of every call of the decorated function
+    '''
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if recorder is None:
+                return function(*args, **kwargs)
+            with recorder.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(rows=0, size=0):
+    '''
+    Add rows processed and bytes read to the innermost stage of the calling thread
+    '''
+    if recorder is not None:
+        recorder.count(rows, size)
+
+
+def write_report(path_to_file):
+    if recorder is None:
+        return
+    with open(path_to_file, 'w') as f:
+        json.dump(recorder.report(), f, indent=2)
@@ -0,0 +1,104 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import stats as sps
+from scipy.signal import fftconvolve
+from scipy.special import gammaln
+
+# The Gaussian process noise is cut off this many standard deviations from its mean,
+# the weights left out are below 1e-14 of the peak
+BAND_STDS = 8
+LOG_FACTORIAL_SIZE = 1 << 12
+
+log_factorial_table = gammaln(np.arange(LOG_FACTORIAL_SIZE) + 1)
+
+
+class ProcessKernel:
+    '''
+    Banded stand-in for the dense process matrix on an evenly spaced R_t grid.
+    The Gaussian only depends on the distance between two R_t values, so applying
+    the matrix is a convolution of the column normalized posterior with one band.
+    '''
+
+    def __init__(self, sigma, r_t_range, dtype=np.float64):
+        step = (r_t_range[-1] - r_t_range[0]) / (len(r_t_range) - 1)
+        sigmas = np.atleast_1d(sigma)
+        half_width = min(int(np.ceil(BAND_STDS * sigmas.max() / step)), len(r_t_range) - 1)
+        offsets = np.arange(-half_width, half_width + 1) * step
+
+        # One row per sigma, narrower sigmas are padded with zeros
+        bands = sps.norm(scale=sigmas[:, None]).pdf(offsets)
+        bands[np.abs(offsets) > BAND_STDS * sigmas[:, None]] = 0
+
+        # Normalize all columns to sum to 1, columns near the edges of the grid lose part of their band
+        norms = fftconvolve(np.ones((len(sigmas), len(r_t_range))), bands, mode='full', axes=-1)
+        inverse_norms = 1 / norms[:, half_width:half_width + len(r_t_range)]
+
+        self.sigma = sigma
+        self.half_width = half_width
+        self.band = (bands if np.ndim(sigma) else bands[0]).astype(dtype)
+        self.inverse_norm = (inverse_norms if np.ndim(sigma) else inverse_norms[0]).astype(dtype)
+
+    def __matmul__(self, posteriors):
+        '''
+        :param posteriors: Array with R_t along the last axis, one row per sigma for a stacked kernel
+        :return: Array of priors for the next day, same shape as posteriors
+        '''
+        weighted = posteriors * self.inverse_norm
+        n = weighted.shape[-1]
+        if weighted.ndim == 1 and self.band.ndim == 1:
+            return np.convolve(weighted, self.band)[self.half_width:self.half_width + n]
+
+        band = self.band.reshape((1,) * (weighted.ndim - self.band.ndim) + self.band.shape)
+        priors = fftconvolve(weighted, band, mode='full', axes=-1)[..., self.half_width:self.half_width + n]
+        # FFT round off can leave tiny negative values where the prior is zero
+        return np.maximum(priors, 0, out=priors)
+
+    def to_dense(self):
+        n = self.inverse_norm.shape[-1]
+        distance = np.subtract.outer(np.arange(n), np.arange(n))
+        inside = np.abs(distance) <= self.half_width
+        dense = np.where(inside, self.band[..., np.clip(distance + self.half_width, 0, len(self.band) - 1)], 0)
+        return dense * self.inverse_norm[..., None, :]
+
+
+def get_process_kernel(sigma, r_t_range, dtype=np.float64):
+    sigma = tuple(np.ravel(sigma).tolist()) if np.ndim(sigma) else float(sigma)
+    return cached_process_kernel(sigma, float(r_t_range[0]), float(r_t_range[-1]), len(r_t_range),
+                                 np.dtype(dtype).str)
+
+
+@lru_cache(maxsize=32)
+def cached_process_kernel(sigma, start, stop, num, dtype):
+    return ProcessKernel(np.array(sigma) if isinstance(sigma, tuple) else sigma,
+                         np.linspace(start, stop, num), np.dtype(dtype))
+
+
+def log_factorial(k):
+    global log_factorial_table
+    if not np.all(np.mod(k, 1) == 0) or np.min(k, initial=0) < 0:
+        return gammaln(k + 1)
+    if (largest := int(np.max(k, initial=0))) >= len(log_factorial_table):
+        size = 1 << largest.bit_length()
+        log_factorial_table = gammaln(np.arange(size) + 1)
+    return log_factorial_table[np.asarray(k, dtype=np.int64)]
+
+
+def poisson_log_likelihoods(k, gamma, r_t_range, dtype=np.float64):
+    '''
+    :param k: Array of daily case counts
+    :param gamma: 1 / serial interval
+    :param r_t_range: Array of R_t values
+    :return: Array of log P(k|R_t) for each R_t (rows) and each day after the first (columns)
+    '''
+    k = np.asarray(k, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Lambda is k[:-1] * exp(gamma * (R_t - 1)), kept as a log so the pmf never forms k!
+        log_lam = np.log(k[:-1]) + gamma * (r_t_range[:, None] - 1)
+        k_log_lam = np.where(k[1:] == 0, 0, k[1:] * log_lam)
+        log_likelihoods = k_log_lam - np.exp(log_lam) - log_factorial(k[1:])
+    return log_likelihoods.astype(dtype)
+
+
+def poisson_likelihoods(k, gamma, r_t_range, dtype=np.float64):
+    return np.exp(poisson_log_likelihoods(k, gamma, r_t_range, dtype))
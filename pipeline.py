@@ -0,0 +1,121 @@
+import hashlib
+import inspect
+import os
+import pickle
+
+import numpy as np
+
+import instrument
+
+
+def fingerprint(value):
+    '''
+    :param value: Pipeline source, e.g. a dataset returned by fetch.get_date_and_data
+    :return: String that changes whenever the content of value changes
+    '''
+    if isinstance(value, dict) and value.get('sha256'):
+        # Downloaded datasets already carry the hash of their file
+        return f"{value.get('date')}:{value['sha256']}"
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(value).view(np.uint8)).hexdigest()
+    return hashlib.sha256(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def function_fingerprint(function):
+    '''
+    :param function: Stage function
+    :return: String that changes whenever the code of function changes
+    '''
+    try:
+        code = inspect.getsource(function).encode()
+    except (OSError, TypeError):
+        # Source isn't available, e.g. in a frozen build, the compiled code stands in for it
+        code = getattr(getattr(function, '__code__', None), 'co_code', b'')
+    name = f'{getattr(function, "__module__", "")}.{getattr(function, "__qualname__", repr(function))}'
+    return hashlib.sha256(name.encode() + b'\0' + code).hexdigest()
+
+
+class Stage:
+    '''
+    One step of a Pipeline, function is called with the outputs of the named inputs in order.
+    Outputs are cached by version, which defaults to a hash of the function's code. Bump an explicit
+    version when a change the function's own code doesn't show, e.g. in a module it calls, changes its output.
+    '''
+
+    def __init__(self, name, function, inputs=(), version=None):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.version = function_fingerprint(function) if version is None else str(version)
+
+
+class Pipeline:
+    '''
+    Stages run in the order they are declared and pass their outputs in memory.
+    Each output is kept with a key hashed from the keys of its inputs, so a run on
+    unchanged sources reuses every output and a changed source only reruns the stages after it.
+    With a cache_path the outputs are also pickled there, so a new process reuses them too.
+    '''
+
+    def __init__(self, *stages, cache_path=None):
+        self.stages = list(stages)
+        self.cache_path = cache_path
+        self._memo = dict()
+        declared = set()
+        for stage in self.stages:
+            if stage.name in declared:
+                raise ValueError(f'Stage {stage.name} is declared twice')
+            declared.add(stage.name)
+
+    def run(self, **sources):
+        '''
+        :param sources: Values of the inputs that are not stages
+        :return: Dictionary of k, v pair source or stage name, output
+        '''
+        outputs = dict(sources)
+        keys = {name: fingerprint(value) for name, value in sources.items()}
+        for stage in self.stages:
+            missing = [name for name in stage.inputs if name not in outputs]
+            if missing:
+                raise KeyError(f'Stage {stage.name} is missing its inputs {missing}')
+
+            key = hashlib.sha256('\0'.join([stage.name, stage.version] + [keys[name] for name in stage.inputs])
+                                 .encode()).hexdigest()
+            memo_key, output = self._memo.get(stage.name) or self.load(stage.name) or (None, None)
+            if memo_key != key:
+                with instrument.stage(stage.name):
+                    output = stage.function(*(outputs[name] for name in stage.inputs))
+                self.save(stage.name, key, output)
+            self._memo[stage.name] = (key, output)
+            outputs[stage.name], keys[stage.name] = output, key
+        return outputs
+
+    def stage_path(self, name):
+        return os.path.join(self.cache_path, f'{name}.pickle')
+
+    def load(self, name):
+        if self.cache_path is None or not os.path.exists(self.stage_path(name)):
+            return None
+        try:
+            with open(self.stage_path(name), 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # An unreadable entry, e.g. from an older version of a stage's output, is computed again
+            return None
+
+    def save(self, name, key, output):
+        if self.cache_path is None:
+            return
+        os.makedirs(self.cache_path, exist_ok=True)
+        partial_path = f'{self.stage_path(name)}.part'
+        with open(partial_path, 'wb') as f:
+            pickle.dump((key, output), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial_path, self.stage_path(name))
+
+    def clear(self):
+        self._memo.clear()
+        for stage in self.stages:
+            if self.cache_path is not None and os.path.exists(self.stage_path(stage.name)):
+                os.remove(self.stage_path(stage.name))
@@ -1,32 +1,233 @@
-import praw
-import asciichartpy
-from decouple import config
+import atexit
+import json
+import os
+import time
+import traceback
+from functools import lru_cache
+from threading import Event, Lock, Thread
 
-client_id = config('client_id')
-client_secret = config('client_secret')
-username = config('username')
-password = config('password')
+PATH_TO_OUTBOX = "./outbox"
+SENT = "sent"
+FAILED = "failed"
+SUBREDDIT = 'secret_secret_secret'
+MAX_ATTEMPTS = 8
+# Seconds before the first retry, doubled after every failed attempt up to MAX_BACKOFF
+BACKOFF = 30
+MAX_BACKOFF = 60 * 60
 
 
+@lru_cache(maxsize=1)
+def get_credentials():
+    # Read on the first post, so importing this module needs neither the config nor praw
+    from decouple import config
+    return {
+        'client_id': config('client_id'),
+        'client_secret': config('client_secret'),
+        'username': config('username'),
+        'password': config('password'),
+    }
+
+
+def render_post(data, plots, url):
+    '''
+    :param data: Key indicators, see covid.get_update
+    :param plots: Plot data of the update, the last 70 days of plots['rt'] are drawn as text
+    :param url: Link of the post
+    :return: Dictionary with the date, title, url and body of the post
+    '''
+    import asciichartpy
 
-def send_update(data, plots, url):
     case_count = data['case count']
     test_count = data['test count']
     date = data['date']
     rt = data["r_t"]
     case100k = data["case per 100k"]
     positivity = data["positivity"]
-    reddit = praw.Reddit(client_id=client_id,
-                         client_secret=client_secret,
-                         user_agent='py',
-                         username=username,
-                         password=password)
 
     reply_str_1 = f'Key indicators for {date} \n\n Infection rate: __{rt}__ \n\n __{case100k:2.2f}__ cases per 100k \n\n'
     reply_str_2 = f'__{positivity:2.2f}%__ positivity rate \n\n Infection rate for last 70 days: \n\n{asciichartpy.plot(plots["rt"][-70:], {"height": 10})}'
     reply_str_3 = '\n\nThe method for modeling reproductive number can be found [here](' \
                   'https://github.com/rtcovidlive/covid-model), based on [accurate episode date](' \
                   'https://data.ontario.ca/dataset/confirmed-positive-cases-of-covid-19-in-ontario) '
-    subreddit = reddit.subreddit('secret_secret_secret')
-    post = subreddit.submit(f'{date} COVID-19 Update: {case_count} new cases, {test_count} tests completed', url=url)
-    post.reply(reply_str_1 + reply_str_2 + reply_str_3)
+    return {
+        'date': str(date),
+        'title': f'{date} COVID-19 Update: {case_count} new cases, {test_count} tests completed',
+        'url': url,
+        'body': reply_str_1 + reply_str_2 + reply_str_3,
+    }
+
+
+class RedditTransport:
+    '''
+    Posts to Reddit through one praw client, made on the first post and kept for the next ones
+    '''
+
+    def __init__(self, subreddit=SUBREDDIT):
+        self.subreddit = subreddit
+        self._reddit = None
+
+    def client(self):
+        if self._reddit is None:
+            import praw
+            self._reddit = praw.Reddit(user_agent='py', **get_credentials())
+        return self._reddit
+
+    def submit(self, title, url):
+        return self.client().subreddit(self.subreddit).submit(title, url=url).id
+
+    def reply(self, post_id, body):
+        self.client().submission(id=post_id).reply(body)
+
+
+class FileTransport:
+    '''
+    Stand-in for Reddit that appends every post and reply to a JSON lines file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def submit(self, title, url):
+        post_id = f'local-{time.time_ns()}'
+        self.write({'id': post_id, 'title': title, 'url': url})
+        return post_id
+
+    def reply(self, post_id, body):
+        self.write({'id': post_id, 'reply': body})
+
+
+class Publisher:
+    '''
+    Durable outbox of posts, one JSON file per date, drained by a background thread.
+    A post moves to sent/ once delivered, so each date is posted once across restarts,
+    and the id of a submitted post is kept so a retry only sends the missing reply.
+    '''
+
+    def __init__(self, transport=None, path=PATH_TO_OUTBOX, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF):
+        self.transport = transport if transport is not None else RedditTransport()
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = None
+        for folder in (path, os.path.join(path, SENT), os.path.join(path, FAILED)):
+            os.makedirs(folder, exist_ok=True)
+
+    def entry_path(self, date, folder=''):
+        return os.path.join(self.path, folder, f'{date}.json')
+
+    def read(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def write(self, entry):
+        path = self.entry_path(entry['date'])
+        with open(f'{path}.part', 'w') as f:
+            json.dump(entry, f)
+        os.replace(f'{path}.part', path)
+
+    def enqueue(self, post):
+        '''
+        :param post: Dictionary with the date, title, url and body of the post, see render_post
+        :return: False if the post of that date was already sent or is already queued
+        '''
+        with self._lock:
+            if os.path.exists(self.entry_path(post['date'], SENT)) or os.path.exists(self.entry_path(post['date'])):
+                return False
+            self.write({**post, 'post_id': None, 'attempts': 0, 'next_attempt': 0, 'error': None})
+        self._wake.set()
+        return True
+
+    def pending(self):
+        return sorted(name[:-len('.json')] for name in os.listdir(self.path) if name.endswith('.json'))
+
+    def deliver(self, date):
+        '''
+        :return: Seconds until the post of date is due, 0 once it is sent or given up on
+        '''
+        with self._lock:
+            entry = self.read(self.entry_path(date))
+        if (wait := entry['next_attempt'] - time.time()) > 0:
+            return wait
+        try:
+            if entry['post_id'] is None:
+                entry['post_id'] = self.transport.submit(entry['title'], entry['url'])
+                # Recorded before replying, so a failed reply never leads to a second post
+                with self._lock:
+                    self.write(entry)
+            self.transport.reply(entry['post_id'], entry['body'])
+            folder = SENT
+        except Exception as e:
+            traceback.print_exc()
+            entry['attempts'] += 1
+            entry['error'] = repr(e)
+            if entry['attempts'] < self.max_attempts:
+                delay = min(self.backoff * 2 ** (entry['attempts'] - 1), self.max_backoff)
+                entry['next_attempt'] = time.time() + delay
+                with self._lock:
+                    self.write(entry)
+                return delay
+            folder = FAILED
+        with self._lock:
+            self.write(entry)
+            os.replace(self.entry_path(date), self.entry_path(date, folder))
+        return 0
+
+    def drain(self):
+        '''
+        :return: Seconds until the next queued post is due, None when the queue is empty
+        '''
+        waits = []
+        for date in self.pending():
+            if self._stopped.is_set():
+                break
+            if (wait := self.deliver(date)) > 0:
+                waits.append(wait)
+        return min(waits) if waits else (0 if self.pending() else None)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            wait = self.drain()
+            self._wake.wait(wait)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = Thread(target=self.run, name='publish', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def publish(self, post):
+        '''
+        Queues the post and returns at once, the background thread sends it
+        '''
+        queued = self.enqueue(post)
+        self.start()
+        return queued
+
+
+@lru_cache(maxsize=1)
+def get_publisher():
+    publisher = Publisher()
+    # Give a post in flight a moment to finish, anything left is sent by the next run
+    atexit.register(publisher.stop, 10)
+    return publisher
+
+
+def send_update(data, plots, url):
+    return get_publisher().publish(render_post(data, plots, url))
@@ -0,0 +1,107 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline import fingerprint
+
+PATH_TO_CHARTS = "./charts"
+MANIFEST = "charts.json"
+FORMATS = ('png',)
+FIGURE_SIZE = (1200 / 72, 800 / 72)
+DPI = 72
+
+# Figures kept by each worker, keyed by size, and cleared between charts instead of being rebuilt
+figures = dict()
+
+
+class Chart:
+    '''
+    One image file per format, drawn by draw(figure, *args) on an empty figure
+    '''
+
+    def __init__(self, name, draw, args, size=FIGURE_SIZE):
+        self.name = name
+        self.draw = draw
+        self.args = tuple(args)
+        self.size = tuple(size)
+
+    def key(self, formats):
+        draw_name = f'{self.draw.__module__}.{self.draw.__qualname__}'
+        return fingerprint((draw_name, self.size, tuple(formats), fingerprint(self.args)))
+
+    def paths(self, path, formats):
+        return [os.path.join(path, f'{self.name}.{extension}') for extension in formats]
+
+
+def init_render_worker():
+    # Workers never open a window, Agg renders straight to memory
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def get_figure(size):
+    from matplotlib.figure import Figure
+
+    if (figure := figures.get(size)) is None:
+        figure = figures[size] = Figure(figsize=size, dpi=DPI)
+    figure.clf()
+    return figure
+
+
+def render_chart(chart, paths):
+    figure = get_figure(chart.size)
+    chart.draw(figure, *chart.args)
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f'{path}.part'
+        figure.savefig(partial_path, format=os.path.splitext(path)[1][1:], facecolor=figure.get_facecolor())
+        os.replace(partial_path, path)
+    return chart.name
+
+
+def load_manifest(path):
+    path_to_manifest = os.path.join(path, MANIFEST)
+    if not os.path.exists(path_to_manifest):
+        return dict()
+    with open(path_to_manifest, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    path_to_manifest = os.path.join(path, MANIFEST)
+    with open(f'{path_to_manifest}.part', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{path_to_manifest}.part', path_to_manifest)
+
+
+def render_charts(charts, formats=FORMATS, path=PATH_TO_CHARTS, processes=None):
+    '''
+    :param charts: List of Chart
+    :param formats: Image formats written for every chart, e.g. png and svg
+    :param path: Directory of the images and of the manifest of what they were drawn from
+    :param processes: Number of worker processes, all cores if None and in this process if 1
+    :return: List of the names of the charts drawn, charts whose inputs didn't change are skipped
+    '''
+    os.makedirs(path, exist_ok=True)
+    manifest = load_manifest(path)
+    keys = {chart.name: chart.key(formats) for chart in charts}
+    stale = [chart for chart in charts
+             if manifest.get(chart.name) != keys[chart.name]
+             or not all(os.path.exists(chart_path) for chart_path in chart.paths(path, formats))]
+    if not stale:
+        return []
+
+    drawn = []
+    try:
+        if processes == 1 or len(stale) == 1:
+            # Figures are made without pyplot, so this process keeps its own backend
+            drawn.extend(render_chart(chart, chart.paths(path, formats)) for chart in stale)
+        else:
+            with ProcessPoolExecutor(max_workers=min(processes or os.cpu_count(), len(stale)),
+                                     initializer=init_render_worker) as executor:
+                drawn.extend(executor.map(render_chart, stale, [chart.paths(path, formats) for chart in stale]))
+    finally:
+        # Only charts that were written are recorded, a failed run draws the rest again
+        manifest.update({name: keys[name] for name in drawn})
+        save_manifest(path, manifest)
+    return drawn
@@ -1,103 +1,206 @@
+import os
+import traceback
+from multiprocessing import Pool
+
 import pandas as pd
 import numpy as np
 
-from matplotlib import pyplot as plt
-from matplotlib.dates import date2num, num2date
-from matplotlib import dates as mdates
-from matplotlib import ticker
-from matplotlib.colors import ListedColormap
-from matplotlib.patches import Patch
+from scipy.special import logsumexp
 
-from scipy import stats as sps
-from scipy.interpolate import interp1d
+from instrument import count
+from kernel import get_process_kernel, poisson_likelihoods, poisson_log_likelihoods
 
 GAMMA = 1 / 7
 # Gamma is 1/serial interval
 # https://wwwnc.cdc.gov/eid/article/26/7/20-0282_article
 # https://www.nejm.org/doi/full/10.1056/NEJMoa2001316
-k = np.array([20, 40, 55, 90])
 R_T_MAX = 12
 r_t_range = np.linspace(0, R_T_MAX, R_T_MAX * 100 + 1)
+# Days at the end of the smoothed series that still change as new cases arrive, half the smoothing window
+RT_STATE_TAIL = 3
+PATH_TO_RT_STATE_FILE = "./rt_state.npz"
+# Candidate standard deviations of the day to day change in R_t
+SIGMAS = np.linspace(1 / 20, 1, 20)
+# Cells of the levels x R_t x days arrays of one highest density interval search, about 2 MiB each
+HDI_BLOCK_SIZE = 1 << 18
 
+# Values shared by every task of a pool, set once in each worker process by init_worker
+worker_state = dict()
 
-def highest_density_interval(pmf, p=.9, debug=False):
-    # If we pass a DataFrame, just call this recursively on the columns
-    if (isinstance(pmf, pd.DataFrame)):
-        return pd.DataFrame([highest_density_interval(pmf[col], p=p) for col in pmf],
-                            index=pmf.columns)
-
-    cumsum = np.cumsum(pmf.values)
-
-    # N x N matrix of total probability mass for each low, high
-    total_p = cumsum - cumsum[:, None]
 
-    # Return all indices with total_p > p
-    lows, highs = (total_p > p).nonzero()
+def highest_density_interval(pmf, p=.9, debug=False):
+    '''
+    :param pmf: Series of probabilities indexed by R_t, or DataFrame with one such column per day
+    :param p: Credibility level, or a list of levels that are all found in the same pass
+    :return: Series of the interval bounds, or a DataFrame with a row of bounds per column of pmf
+    '''
+    levels = np.atleast_1d(p)
+    values = pmf.values if isinstance(pmf, pd.DataFrame) else pmf.values[:, None]
+    lows, highs = hdi_indices(values, levels)
+
+    # Columns without any interval holding p (e.g. a posterior of NaNs) get NaN bounds
+    r_t = np.append(pmf.index.values.astype(float), np.nan)
+    bounds = np.stack([r_t[lows], r_t[highs]], axis=-1).transpose(1, 0, 2).reshape(-1, len(levels) * 2)
+    columns = [f'{bound}_{level * 100:.0f}' for level in levels for bound in ('Low', 'High')]
+
+    if isinstance(pmf, pd.DataFrame):
+        return pd.DataFrame(bounds, index=pmf.columns, columns=columns)
+    return pd.Series(bounds[0], index=columns)
+
+
+def hdi_indices(pmfs, levels):
+    '''
+    :param pmfs: Array of probabilities for each R_t (rows) and day (columns)
+    :param levels: Array of credibility levels
+    :return: Arrays of the low and high row index of the narrowest interval for each level (rows) and day (columns)
+    '''
+    # The search holds a few levels x R_t x days arrays, a bounded number of days at a time keeps them small
+    n, days = pmfs.shape
+    step = max(HDI_BLOCK_SIZE // (len(levels) * n), 1)
+    blocks = [hdi_block_indices(pmfs[:, first:first + step], levels) for first in range(0, days, step)]
+    if not blocks:
+        return np.zeros((len(levels), 0), dtype=np.int64), np.zeros((len(levels), 0), dtype=np.int64)
+    return tuple(np.concatenate(indices, axis=1) for indices in zip(*blocks))
+
+
+def hdi_block_indices(pmfs, levels):
+    cumsum = np.cumsum(pmfs, axis=0)
+    n, days = cumsum.shape
+    columns = np.arange(days)
+
+    # For every low, binary search the first high with total_p > p, for all days and levels at once.
+    # total_p only grows with high, so this finds the same intervals as checking every low, high pair.
+    lows = np.arange(n)[None, :, None]
+    start, end = np.broadcast_to(lows, (len(levels), n, days)), np.full((len(levels), n, days), n)
+    threshold = levels[:, None, None]
+    while (searching := start < end).any():
+        middle = (start + end) // 2
+        total_p = cumsum[np.minimum(middle, n - 1), columns] - cumsum
+        found = total_p > threshold
+        end = np.where(searching & found, middle, end)
+        start = np.where(searching & ~found, middle + 1, start)
+
+    # Find the smallest range (highest density), the first low wins ties
+    widths = np.where(end < n, end - lows, n)
+    best = widths.argmin(axis=1)
+    highs = np.take_along_axis(end, best[:, None, :], axis=1)[:, 0, :]
+    return np.where(highs < n, best, n), highs
+
+
+def get_likelihoods(sr, log_space=False, dtype=np.float64):
+    # (1) Calculate Lambda and (2) each day's likelihood, from a table of log factorials
+    if log_space:
+        return poisson_log_likelihoods(sr.values, GAMMA, r_t_range, dtype=dtype)
+    return poisson_likelihoods(sr.values, GAMMA, r_t_range, dtype=dtype)
+
+
+def get_process_operator(sigma, dtype=np.float64):
+    # (3) The Gaussian process noise between R_t values, as a banded kernel cached by sigma and r_t_range
+    return get_process_kernel(sigma, r_t_range, dtype=dtype)
+
+
+def get_prior():
+    # (4) Calculate the initial prior
+    # prior0 = sps.gamma(a=4).pdf(r_t_range)
+    prior0 = np.ones_like(r_t_range) / len(r_t_range)
+    prior0 /= prior0.sum()
+    return prior0
 
-    # Find the smallest range (highest density)
-    best = (highs - lows).argmin()
 
-    low = pmf.index[lows[best]]
-    high = pmf.index[highs[best]]
+def get_posteriors(sr, sigma=0.15, log_space=False, dtype=np.float64):
+    likelihoods = get_likelihoods(sr, log_space=log_space, dtype=dtype)
 
-    return pd.Series([low, high],
-                     index=[f'Low_{p * 100:.0f}',
-                            f'High_{p * 100:.0f}'])
+    # (5) Iteratively apply Bayes' rule
+    posteriors, log_evidence = bayes_filter(likelihoods, get_process_operator(sigma, dtype), get_prior(),
+                                            log_space=log_space)
+
+    # Only wrap the posteriors for each day in a DataFrame once they are all computed
+    posteriors = pd.DataFrame(data=posteriors, index=r_t_range, columns=sr.index)
+    return posteriors, np.sum(log_evidence)
+
+
+def bayes_filter(likelihoods, process_matrix, prior, log_space=False):
+    '''
+    :param likelihoods: Array of P(k|R_t) for each R_t (rows) and day (columns), log P(k|R_t) if log_space
+    :param process_matrix: Array of the transition probabilities between R_t values, or its ProcessKernel
+    :param prior: Posterior of the day before the first likelihood column
+    :param log_space: Apply Bayes' rule to log probabilities so long series don't underflow
+    :return: Array of posteriors with the prior as the first column, and the array of log P(k) for each day
+    '''
+    days = likelihoods.shape[1]
+    # Column major so that each day's posterior is contiguous
+    posteriors = np.empty((len(prior), days + 1), dtype=likelihoods.dtype, order='F')
+    posteriors[:, 0] = prior
+
+    # We said we'd keep track of the log of the probability of the data
+    # for maximum likelihood calculation.
+    log_evidence = np.empty(days)
+
+    for day in range(days):
+        # (5a) Calculate the new prior
+        current_prior = process_matrix @ posteriors[:, day]
 
+        if log_space:
+            # (5b) Calculate the log numerator of Bayes' Rule: log P(k|R_t)P(R_t)
+            with np.errstate(divide='ignore'):
+                log_numerator = likelihoods[:, day] + np.log(current_prior)
 
-def get_posteriors(sr, sigma=0.15):
-    # (1) Calculate Lambda
-    lam = sr[:-1].values * np.exp(GAMMA * (r_t_range[:, None] - 1))
+            # (5c) Calcluate the log denominator of Bayes' Rule log P(k)
+            log_denominator = logsumexp(log_numerator)
 
-    # (2) Calculate each day's likelihood
-    likelihoods = pd.DataFrame(
-        data=sps.poisson.pmf(sr[1:].values, lam),
-        index=r_t_range,
-        columns=sr.index[1:])
+            # A day no R_t explains (no cases the day before, some today) carries the prior forward
+            posteriors[:, day + 1] = np.exp(log_numerator - log_denominator) if np.isfinite(log_denominator) \
+                else current_prior
+            log_evidence[day] = log_denominator
+        else:
+            # (5b) Calculate the numerator of Bayes' Rule: P(k|R_t)P(R_t)
+            numerator = likelihoods[:, day] * current_prior
 
-    # (3) Create the Gaussian Matrix
-    process_matrix = sps.norm(loc=r_t_range,
-                              scale=sigma
-                              ).pdf(r_t_range[:, None])
+            # (5c) Calcluate the denominator of Bayes' Rule P(k)
+            denominator = np.sum(numerator)
 
-    # (3a) Normalize all rows to sum to 1
-    process_matrix /= process_matrix.sum(axis=0)
+            # Execute full Bayes' Rule, a day no R_t explains carries the prior forward
+            posteriors[:, day + 1] = numerator / denominator if denominator > 0 else current_prior
 
-    # (4) Calculate the initial prior
-    # prior0 = sps.gamma(a=4).pdf(r_t_range)
-    prior0 = np.ones_like(r_t_range) / len(r_t_range)
-    prior0 /= prior0.sum()
+            with np.errstate(divide='ignore'):
+                log_evidence[day] = np.log(denominator)
 
-    # Create a DataFrame that will hold our posteriors for each day
-    # Insert our prior as the first posterior.
-    posteriors = pd.DataFrame(
-        index=r_t_range,
-        columns=sr.index,
-        data={sr.index[0]: prior0}
-    )
+    return posteriors, log_evidence
 
-    # We said we'd keep track of the sum of the log of the probability
-    # of the data for maximum likelihood calculation.
-    log_likelihood = 0.0
 
-    # (5) Iteratively apply Bayes' rule
-    for previous_day, current_day in zip(sr.index[:-1], sr.index[1:]):
-        # (5a) Calculate the new prior
-        current_prior = process_matrix @ posteriors[previous_day]
+def get_log_likelihoods(sr, sigmas=SIGMAS):
+    '''
+    :param sr: Series of smoothed daily case counts
+    :param sigmas: Array of candidate standard deviations of the day to day change in R_t
+    :return: Array of the log likelihood of the series for each sigma
+    '''
+    likelihoods = get_likelihoods(sr)
 
-        # (5b) Calculate the numerator of Bayes' Rule: P(k|R_t)P(R_t)
-        numerator = likelihoods[current_day] * current_prior
+    # Run one filter per sigma side by side on a stacked process kernel
+    process_kernels = get_process_operator(sigmas)
+    posteriors = np.tile(get_prior(), (len(sigmas), 1))
+    log_likelihoods = np.zeros(len(sigmas))
 
-        # (5c) Calcluate the denominator of Bayes' Rule P(k)
-        denominator = np.sum(numerator)
+    for day in range(likelihoods.shape[1]):
+        current_priors = process_kernels @ posteriors
+        numerators = likelihoods[:, day] * current_priors
+        denominators = np.sum(numerators, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            posteriors = np.where(denominators[:, None] > 0, numerators / denominators[:, None], current_priors)
+        with np.errstate(divide='ignore'):
+            log_likelihoods += np.log(denominators)
 
-        # Execute full Bayes' Rule
-        posteriors[current_day] = numerator / denominator
+    return log_likelihoods
 
-        # Add to the running sum of log likelihoods
-        log_likelihood += np.log(denominator)
 
-    return posteriors, log_likelihood
+def select_sigma(smoothed_series, sigmas=SIGMAS):
+    '''
+    :param smoothed_series: List of Series of smoothed daily case counts, e.g. one per region
+    :param sigmas: Array of candidate standard deviations of the day to day change in R_t
+    :return: The sigma with the highest total log likelihood over all the series
+    '''
+    total = np.sum([get_log_likelihoods(sr, sigmas) for sr in smoothed_series], axis=0)
+    return sigmas[np.nanargmax(total)]
 
 
 def prepare_cases(cases, cutoff=1):
@@ -114,26 +217,127 @@ def prepare_cases(cases, cutoff=1):
     return original, smoothed
 
 
-def calculate_rt(cases):
-    # Map Rt into lambda so we can substitute it into the equation below
-    # Note that we have N-1 lambdas because on the first day of an outbreak
-    # you do not know what to expect.
-    lam = k[:-1] * np.exp(GAMMA * (r_t_range[:, None] - 1))
-    # Evaluate the likelihood on each day and normalize sum of each day to 1.0
-    likelihood_r_t = sps.poisson.pmf(k[1:], lam)
-    likelihood_r_t /= np.sum(likelihood_r_t, axis=0)
+def calculate_rt(cases, sigma=.25, state_path=None, process_matrix=None, dtype=np.float64):
+    '''
+    :param cases: Series of daily case counts indexed by date
+    :param sigma: Standard deviation of the day to day change in R_t, None picks the most likely of SIGMAS
+    :param state_path: File holding the filter state of the last run, only the days after it are recomputed
+    :param process_matrix: Prebuilt get_process_operator(sigma), to share it between calls
+    :param dtype: Floating point type of the filter, np.float32 halves its memory
+    :return: DataFrame with the most likely R_t and its highest density interval for each day
+    '''
     original, smoothed = prepare_cases(cases)
-    # Note that we're fixing sigma to a value just for the example
-    posteriors, log_likelihood = get_posteriors(smoothed, sigma=.25)
+    count(rows=len(smoothed))
+    if smoothed.empty:
+        return pd.DataFrame(index=smoothed.index, columns=['ML', 'Low_90', 'High_90'], dtype=float)
+    if sigma is None:
+        sigma = select_sigma([smoothed])
+    if process_matrix is None:
+        process_matrix = get_process_operator(sigma, dtype)
+
+    if (state := load_rt_state(state_path, smoothed, sigma) if state_path else None) is None:
+        start, prior, log_likelihood = 0, get_prior(), 0.0
+    else:
+        # Resume from the last day whose smoothed count could not have changed since the last run
+        start, prior, log_likelihood = int(state['checkpoint']), state['posterior'], float(state['log_likelihood'])
+
+    likelihoods = get_likelihoods(smoothed.iloc[start:], dtype=dtype)
+    posteriors, log_evidence = bayes_filter(likelihoods, process_matrix, prior)
+    posteriors = pd.DataFrame(data=posteriors, index=r_t_range, columns=smoothed.index[start:])
+    result = summarize_posteriors(posteriors)
+    if state is not None:
+        previous = pd.DataFrame(data=state['result'][:start], index=smoothed.index[:start],
+                                columns=state['result_columns'])
+        result = pd.concat([previous, result])
+
+    if state_path and (checkpoint := len(smoothed) - 1 - RT_STATE_TAIL) >= start:
+        log_likelihood += np.sum(log_evidence[:checkpoint - start])
+        save_rt_state(state_path, smoothed, sigma, checkpoint, posteriors[smoothed.index[checkpoint]].values,
+                      log_likelihood, result)
+    return result
+
+
+def calculate_rt_regions(regions, sigma=.25, processes=None):
+    '''
+    :param regions: Dictionary with k, v pair region name, Series of daily case counts indexed by date
+    :param sigma: Standard deviation of the day to day change in R_t, None picks the most likely one per region
+    :param processes: Number of worker processes, defaults to the number of cores
+    :return: DataFrame with the most likely R_t and its highest density interval, indexed by region and date
+    '''
+    # Build the process kernel once and hand it to each worker when it starts, not with every region
+    process_matrix = get_process_operator(sigma) if sigma is not None else None
+    with Pool(processes, initializer=init_worker, initargs=(sigma, process_matrix)) as pool:
+        results = pool.starmap(calculate_region_rt, regions.items())
+    return pd.concat(dict(results), names=['region'])
+
+
+def init_worker(sigma, process_matrix):
+    '''
+    Pool initializer, hands a worker process the sigma and process kernel of all its tasks once
+    '''
+    worker_state.update(sigma=sigma, process_matrix=process_matrix)
+
+
+def calculate_region_rt(region, cases):
+    try:
+        return region, calculate_rt(cases, sigma=worker_state['sigma'], process_matrix=worker_state['process_matrix'])
+    except Exception:
+        # One region's bad data leaves that region out instead of failing every region
+        traceback.print_exc()
+        return region, pd.DataFrame(index=pd.DatetimeIndex([], name='date'), columns=['ML', 'Low_90', 'High_90'],
+                                    dtype=float)
+
+
+def summarize_posteriors(posteriors):
     hdis = highest_density_interval(posteriors, p=.9)
     most_likely = posteriors.idxmax().rename('ML')
     # Look into why you shift -1
-    result = pd.concat([most_likely, hdis], axis=1)
-    result.tail()
-    return result
+    return pd.concat([most_likely, hdis], axis=1)
+
+
+def load_rt_state(state_path, smoothed, sigma):
+    if not os.path.exists(state_path):
+        return None
+    dates = smoothed.index.values.astype('datetime64[ns]').astype(np.int64)
+    try:
+        with np.load(state_path) as f:
+            state = dict(f)
+        # Any revision to the cases before the checkpoint means starting over
+        checkpoint = int(state['checkpoint']) + 1
+        if state['sigma'] != sigma or len(state['posterior']) != len(r_t_range) \
+                or len(smoothed) < len(state['dates']) \
+                or not np.array_equal(state['dates'][:checkpoint], dates[:checkpoint]) \
+                or not np.array_equal(state['smoothed'][:checkpoint], smoothed.values[:checkpoint]):
+            return None
+    except Exception:
+        # An unreadable state, e.g. cut short by a crash or missing a value, means starting over too
+        return None
+    return state
+
+
+def save_rt_state(state_path, smoothed, sigma, checkpoint, posterior, log_likelihood, result):
+    partial_path = f'{state_path}.part'
+    with open(partial_path, 'wb') as f:
+        np.savez(f,
+                 sigma=sigma,
+                 dates=smoothed.index.values.astype('datetime64[ns]').astype(np.int64),
+                 smoothed=smoothed.values,
+                 checkpoint=checkpoint,
+                 posterior=posterior,
+                 log_likelihood=log_likelihood,
+                 result=result.values.astype(float),
+                 result_columns=np.array(result.columns, dtype=str))
+    os.replace(partial_path, state_path)
 
 
 def plot_rt(result, fig, ax, region_name):
+    # Plotting is the only use of matplotlib, so computing R_t never loads it
+    from matplotlib.dates import date2num
+    from matplotlib import dates as mdates
+    from matplotlib import ticker
+    from matplotlib.colors import ListedColormap
+    from scipy.interpolate import interp1d
+
     ax.set_title(f"{region_name}")
     # Colors
     ABOVE = [1, 0, 0]
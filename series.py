@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import numpy as np
+
+from window import blocked_mean, rolling_mean
+
+# Every daily array is laid out on whole days since EPOCH
+EPOCH = np.datetime64('2020-01-01')
+PROVINCE = 'Ontario'
+CASES_METRIC = 'cases'
+
+
+def to_day(date):
+    '''
+    :param date: Date string, datetime64, datetime.date or array of them
+    :return: Days since EPOCH
+    '''
+    return (np.asarray(date, dtype='datetime64[D]') - EPOCH).astype(np.int64)
+
+
+def to_date(day):
+    return EPOCH + np.asarray(day, dtype=np.int64)
+
+
+def current_day():
+    return int(to_day(datetime.now().date()))
+
+
+class DailyPanel:
+    '''
+    Dense regions x days x metrics array of daily values on the EPOCH day calendar.
+    Day i of the panel is first_day + i, so finding a date is a subtraction and any run of days is a view.
+    '''
+
+    def __init__(self, values, first_day, regions, metrics):
+        self.values = values
+        self.first_day = int(first_day)
+        self.regions = list(regions)
+        self.metrics = list(metrics)
+        self._regions = {region: i for i, region in enumerate(self.regions)}
+        self._metrics = {metric: i for i, metric in enumerate(self.metrics)}
+
+    @classmethod
+    def from_regional(cls, regional, metric=CASES_METRIC):
+        '''
+        :param regional: Dictionary of regional counts, see helper.get_regional_array
+        :param metric: Name of the counted metric
+        :return: DailyPanel of every city followed by the province
+        '''
+        first_day = to_day(regional['dates'][0]) if len(regional['dates']) else current_day()
+        values = np.vstack([np.reshape(regional['counts'], (-1, len(regional['dates']))), regional['province']])
+        return cls(values[:, :, None], first_day, list(regional['cities']) + [PROVINCE], [metric])
+
+    @classmethod
+    def from_status(cls, table, region=PROVINCE):
+        '''
+        :param table: StatusTable of the status file
+        :param region: Name of the only region in the panel
+        :return: DailyPanel of the numeric status columns.
+                 Empty cells count as 0 and days without a row repeat the row before them
+        '''
+        if not len(table):
+            return cls(np.zeros((1, 0, len(table.headers))), current_day(), [region], table.headers)
+        days = to_day(table.dates)
+        order = np.argsort(days, kind='stable')
+        days, first_day = days[order], days[order[0]]
+        # Each calendar day takes the latest row reported on or before it
+        rows = np.searchsorted(days, first_day + np.arange(days[-1] - first_day + 1), side='right') - 1
+        values = np.nan_to_num(np.asarray(table.values)[order[rows]])
+        return cls(values[None], first_day, [region], table.headers)
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    @property
+    def last_day(self):
+        return self.first_day + len(self) - 1
+
+    @property
+    def dates(self):
+        return to_date(self.first_day + np.arange(len(self)))
+
+    def date_strings(self):
+        return np.datetime_as_string(self.dates, unit='D').tolist()
+
+    def offset(self, date):
+        return int(to_day(date)) - self.first_day
+
+    def at(self, date):
+        '''
+        :return: regions x metrics view of one date
+        '''
+        return self.values[:, self.offset(date)]
+
+    def series(self, region=PROVINCE, metric=None):
+        '''
+        :return: View of the daily values of one region and metric, the only metric if None
+        '''
+        return self.values[self._regions[region], :, self._metrics[metric] if metric else 0]
+
+    def select(self, regions=None, metrics=None):
+        region_index = [self._regions[region] for region in regions] if regions is not None else slice(None)
+        metric_index = [self._metrics[metric] for metric in metrics] if metrics is not None else slice(None)
+        values = self.values[region_index][:, :, metric_index]
+        return DailyPanel(values, self.first_day, regions or self.regions, metrics or self.metrics)
+
+    def days(self, start=None, stop=None):
+        '''
+        :param start: First date kept, the first day of the panel if None
+        :param stop: Date after the last date kept, the end of the panel if None
+        :return: DailyPanel sharing the values of this one
+        '''
+        start = 0 if start is None else min(max(self.offset(start), 0), len(self))
+        stop = len(self) if stop is None else min(max(self.offset(stop), start), len(self))
+        return DailyPanel(self.values[:, start:stop], self.first_day + start, self.regions, self.metrics)
+
+    def last(self, n):
+        start = max(len(self) - n, 0)
+        return DailyPanel(self.values[:, start:], self.first_day + start, self.regions, self.metrics)
+
+    def diff(self):
+        '''
+        :return: DailyPanel of daily values from cumulative ones, the first day keeps its total
+        '''
+        return DailyPanel(np.diff(self.values, axis=1, prepend=0), self.first_day, self.regions, self.metrics)
+
+    def rolling_mean(self, window_length, center=False):
+        return DailyPanel(rolling_mean(self.values, window_length, axis=1, center=center), self.first_day,
+                          self.regions, self.metrics)
+
+    def blocked_mean(self, window_length):
+        '''
+        :return: Array of the last date of each block and regions x blocks x metrics array of means,
+                 latest block first, see window.blocked_mean
+        '''
+        last_days, means = blocked_mean(self.values, window_length, axis=1)
+        return to_date(self.first_day + last_days), means
+
+    def to_dict(self, region=PROVINCE, metric=None):
+        return dict(zip(self.date_strings(), self.series(region, metric).tolist()))
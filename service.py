@@ -0,0 +1,172 @@
+import argparse
+import json
+import math
+import multiprocessing
+import traceback
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+import instrument
+from covid import run_pipeline
+from fetch import BASE_URL
+
+POLL_INTERVAL = 15 * 60
+HOST = '127.0.0.1'
+PORT = 8080
+
+
+def get_today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def json_value(value):
+    # NaN isn't valid JSON, days without an interval are sent as null
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def frame_to_json(frame):
+    '''
+    :param frame: DataFrame indexed by date, as made by rt.calculate_rt
+    :return: Dictionary of the dates and of each column as lists
+    '''
+    columns = {'date': frame.index.strftime('%Y-%m-%d').tolist()}
+    columns.update({column: list(map(json_value, frame[column].tolist())) for column in frame.columns})
+    return columns
+
+
+def outputs_to_routes(outputs):
+    '''
+    :param outputs: Pipeline outputs, see covid.run_pipeline
+    :return: Dictionary of k, v pair path, encoded JSON body
+    '''
+    key_info = {key: json_value(value.item() if hasattr(value, 'item') else value)
+                for key, value in outputs['update']['today_key_info'].items()}
+    phu_rt = outputs['phu_rt']
+    routes = {
+        '/today_key_info': key_info,
+        '/rt': frame_to_json(outputs['rt']),
+        '/phu_rt': {region: frame_to_json(phu_rt.loc[region]) for region in phu_rt.index.unique(level='region')},
+    }
+    return {path: json.dumps(body).encode() for path, body in routes.items()}
+
+
+class UpdateService:
+    '''
+    Keeps the latest pipeline outputs in memory, polls the datasets on a schedule and
+    serves the results as JSON. Bodies are encoded once per update so a request only copies bytes.
+    '''
+
+    def __init__(self, base_url=BASE_URL, interval=POLL_INTERVAL, report_path=None):
+        self.base_url = base_url
+        self.interval = interval
+        self.report_path = report_path
+        self.routes = dict()
+        self.last_checked = None
+        self.last_updated = None
+        self.last_error = None
+        self._update = None
+        self._lock = Lock()
+        self._stopped = Event()
+
+    def poll(self):
+        '''
+        :return: True if new results were published
+        '''
+        today = get_today()
+        # The datasets are only downloaded once check_for_update sees a new validated date,
+        # and the pipeline reuses every stage whose inputs are unchanged
+        outputs = run_pipeline(today, self.base_url)
+        if self.report_path:
+            instrument.write_report(self.report_path)
+        with self._lock:
+            self.last_checked = datetime.now().isoformat(timespec='seconds')
+            if outputs['update'] is self._update:
+                return False
+            self.routes = outputs_to_routes(outputs)
+            self._update = outputs['update']
+            self.last_updated = self.last_checked
+        return True
+
+    def status(self):
+        return json.dumps({
+            'checked': self.last_checked,
+            'updated': self.last_updated,
+            'error': self.last_error,
+        }).encode()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the last results, the next poll tries again
+                traceback.print_exc()
+                self.last_error = repr(e)
+            self._stopped.wait(self.interval)
+
+    def start(self):
+        thread = Thread(target=self.run, name='poll', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped.set()
+
+    def make_server(self, host=HOST, port=PORT):
+        return ThreadingHTTPServer((host, port), make_handler(self))
+
+
+def make_handler(service):
+    class UpdateHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes, without this a kept alive connection waits on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            path = self.path.split('?', 1)[0].rstrip('/')
+            body = service.status() if path == '/status' else service.routes.get(path)
+            if body is None:
+                status = 503 if path in ('/today_key_info', '/rt', '/phu_rt') else 404
+                body = json.dumps({'error': 'No results yet' if status == 503 else 'Not found'}).encode()
+            else:
+                status = 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return UpdateHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the latest Ontario COVID-19 update as JSON')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='Seconds between polls')
+    parser.add_argument('--base-url', default=BASE_URL, help='Site serving the dataset pages')
+    args = parser.parse_args()
+
+    # Polls run the worker pools of the pipeline next to the server threads, a forked worker could
+    # inherit a lock another thread holds and deadlock, so workers start as fresh interpreters instead
+    multiprocessing.set_start_method('spawn')
+    service = UpdateService(args.base_url, args.interval, instrument.enable_from_environment())
+    server = service.make_server(args.host, args.port)
+    service.start()
+    print(f'Serving on http://{args.host}:{server.server_address[1]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
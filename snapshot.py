@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+from itertools import islice
+
+import numpy as np
+
+from helper import BATCH_SIZE, DATE_KEY, case_encoders, case_columns, episode_days
+from instrument import count, instrumented
+from status import StatusTable
+
+PATH_TO_SNAPSHOTS = "./snapshots"
+STATUS = "status"
+CASES = "cases"
+# Properties kept from each case feature, dates are stored as days since EPOCH and the rest as category codes
+CASE_DATE_KEYS = (DATE_KEY, 'Case_Reported_Date', 'Test_Reported_Date', 'Specimen_Date')
+CASE_CATEGORY_KEYS = ('Age_Group', 'Client_Gender', 'Case_AcquisitionInfo', 'Outcome1', 'Outbreak_Related',
+                      'Reporting_PHU', 'Reporting_PHU_City')
+LONGITUDE = 'Longitude'
+LATITUDE = 'Latitude'
+COPY_SIZE = BATCH_SIZE * 16
+
+
+def snapshot_path(date, kind):
+    return os.path.join(PATH_TO_SNAPSHOTS, date, kind)
+
+
+def list_snapshots(kind):
+    '''
+    :param kind: STATUS or CASES
+    :return: Sorted list of the dates with a complete snapshot of that kind
+    '''
+    if not os.path.isdir(PATH_TO_SNAPSHOTS):
+        return []
+    return sorted(date for date in os.listdir(PATH_TO_SNAPSHOTS) if os.path.isdir(snapshot_path(date, kind)))
+
+
+def latest_snapshot(kind):
+    return snapshots[-1] if (snapshots := list_snapshots(kind)) else None
+
+
+def commit_snapshot(partial_path, path):
+    # Snapshots are written next to their final place and renamed once complete
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(partial_path, path)
+
+
+def new_partial_snapshot(date, kind):
+    partial_path = f'{snapshot_path(date, kind)}.part'
+    if os.path.exists(partial_path):
+        shutil.rmtree(partial_path)
+    os.makedirs(partial_path)
+    return partial_path
+
+
+def save_status_snapshot(date, table):
+    '''
+    :param date: Snapshot date
+    :param table: StatusTable as made by status.parse_status_csv
+    '''
+    partial_path = new_partial_snapshot(date, STATUS)
+    np.save(os.path.join(partial_path, 'dates.npy'), table.dates)
+    np.save(os.path.join(partial_path, 'headers.npy'), np.array(table.headers, dtype=str))
+    np.save(os.path.join(partial_path, 'values.npy'), np.asarray(table.values, dtype=np.float64))
+    for i, (header, column) in enumerate(table.text.items()):
+        np.save(os.path.join(partial_path, f'text{i}.npy'), np.array([header, *column], dtype=str))
+    commit_snapshot(partial_path, snapshot_path(date, STATUS))
+
+
+def load_status_snapshot(date=None):
+    '''
+    :param date: Snapshot date, the latest one if None
+    :return: StatusTable with a memory mapped dates x headers array of values
+    '''
+    if (date := date or latest_snapshot(STATUS)) is None:
+        return None
+    path = snapshot_path(date, STATUS)
+    # Text columns are stored with their header as the first element
+    text = [np.load(os.path.join(path, name)) for name in sorted(os.listdir(path)) if name.startswith('text')]
+    return StatusTable(np.load(os.path.join(path, 'dates.npy')),
+                       np.load(os.path.join(path, 'headers.npy')).tolist(),
+                       np.load(os.path.join(path, 'values.npy'), mmap_mode='r'),
+                       {str(column[0]): column[1:] for column in text})
+
+
+def save_snapshot_arrays(date, kind, arrays, meta):
+    '''
+    :param date: Snapshot date
+    :param kind: Kind of snapshot the arrays are stored as, also the name of the metadata file
+    :param arrays: Dictionary of k, v pair name, numpy array saved as name.npy
+    :param meta: Dictionary of JSON serializable values stored next to the arrays
+    '''
+    partial_path = new_partial_snapshot(date, kind)
+    for name, array in arrays.items():
+        np.save(os.path.join(partial_path, f'{name}.npy'), array)
+    with open(os.path.join(partial_path, f'{kind}.json'), 'w') as f:
+        json.dump(meta, f)
+    commit_snapshot(partial_path, snapshot_path(date, kind))
+
+
+def load_snapshot_arrays(date, kind, names):
+    '''
+    :param date: Snapshot date
+    :param kind: Kind of snapshot saved by save_snapshot_arrays
+    :param names: Names of the arrays to load
+    :return: Dictionary of memory mapped arrays by name and the metadata, None if there is no such snapshot
+    '''
+    path = snapshot_path(date, kind)
+    if not os.path.isdir(path):
+        return None
+    with open(os.path.join(path, f'{kind}.json'), 'r') as f:
+        meta = json.load(f)
+    return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in names}, meta
+
+
+@instrumented('snapshot_cases')
+def save_case_snapshot(date, features, batch_size=BATCH_SIZE, keep=None):
+    '''
+    :param date: Snapshot date
+    :param features: Iterable of GeoJSON case features, read one batch at a time
+    :param batch_size: Number of features encoded per batch
+    :param keep: Called once every feature is read, the snapshot is thrown away if it returns False
+    :return: Number of cases in the snapshot
+    '''
+    partial_path = new_partial_snapshot(date, CASES)
+    encoders = case_encoders(CASE_DATE_KEYS + CASE_CATEGORY_KEYS)
+    columns = {key: np.int32 for key in encoders}
+    columns.update({LONGITUDE: np.float64, LATITUDE: np.float64})
+
+    # Append each batch to a raw file per column so memory stays bounded by the batch size
+    raw_files = {key: open(os.path.join(partial_path, f'{key}.bin'), 'wb') for key in columns}
+    rows, features = 0, iter(features)
+    try:
+        while batch := list(islice(features, batch_size)):
+            coded = case_columns([item['properties'] for item in batch], encoders)
+            coordinates = np.array([feature_coordinates(item) for item in batch], dtype=np.float64).reshape(-1, 2)
+            coded[LONGITUDE], coded[LATITUDE] = coordinates[:, 0], coordinates[:, 1]
+            for key, raw_file in raw_files.items():
+                coded[key].astype(columns[key]).tofile(raw_file)
+            rows += len(batch)
+    finally:
+        for raw_file in raw_files.values():
+            raw_file.close()
+    if keep is not None and not keep():
+        shutil.rmtree(partial_path)
+        return rows
+
+    # Date codes only become days once every distinct date string has been seen
+    lookups = {key: episode_days(encoders[key]).astype(np.int32) for key in CASE_DATE_KEYS}
+    for key, dtype in columns.items():
+        raw_path = os.path.join(partial_path, f'{key}.bin')
+        raw = np.memmap(raw_path, dtype=dtype, mode='r', shape=(rows,)) if rows else np.zeros(0, dtype=dtype)
+        column = np.lib.format.open_memmap(os.path.join(partial_path, f'{key}.npy'), mode='w+', dtype=dtype,
+                                           shape=(rows,))
+        for start in range(0, rows, COPY_SIZE):
+            chunk = raw[start:start + COPY_SIZE]
+            column[start:start + COPY_SIZE] = lookups[key][chunk] if key in lookups else chunk
+        column.flush()
+        del raw, column
+        os.remove(raw_path)
+
+    for key in CASE_CATEGORY_KEYS:
+        np.save(os.path.join(partial_path, f'{key}.names.npy'), np.array(encoders[key].names, dtype=str))
+    commit_snapshot(partial_path, snapshot_path(date, CASES))
+    count(rows=rows)
+    return rows
+
+
+def feature_coordinates(feature):
+    if (geometry := feature.get('geometry')) and (coordinates := geometry.get('coordinates')):
+        return coordinates[:2]
+    return np.nan, np.nan
+
+
+def load_case_snapshot(date=None):
+    '''
+    :param date: Snapshot date, the latest one if None
+    :return: Dictionary with memory mapped columns by property and the category names of the coded ones
+    '''
+    if (date := date or latest_snapshot(CASES)) is None:
+        return None
+    path = snapshot_path(date, CASES)
+    keys = CASE_DATE_KEYS + CASE_CATEGORY_KEYS + (LONGITUDE, LATITUDE)
+    return {
+        'date': date,
+        'columns': {key: np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r') for key in keys},
+        'names': {key: np.load(os.path.join(path, f'{key}.names.npy')).tolist() for key in CASE_CATEGORY_KEYS},
+    }
@@ -0,0 +1,171 @@
+import numpy as np
+
+from helper import AGE_GROUPS, AGE_KEY, BATCH_SIZE, DATE_KEY, MISSING_DAY
+from series import CASES_METRIC, DailyPanel, current_day
+from snapshot import LATITUDE, LONGITUDE, load_case_snapshot, load_snapshot_arrays, save_snapshot_arrays
+
+GRID = "grid"
+GRID_ARRAYS = ('cells', 'starts', 'order')
+# Cells of about 11 km north to south, small enough that a query only checks the cases near it
+CELL_DEGREES = .1
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+class GridIndex:
+    '''
+    Case rows bucketed into a regular longitude/latitude grid.
+    Rows are sorted by cell, so the cases of a run of cells along a grid row are one slice of order.
+    '''
+
+    def __init__(self, origin, cell_degrees, columns, cells, starts, order):
+        self.origin = tuple(origin)
+        self.cell_degrees = cell_degrees
+        self.columns = columns
+        self.cells = cells
+        self.starts = starts
+        self.order = order
+
+    def cell_rows(self, low, high):
+        '''
+        :return: Array of the rows of every case in the cells covering the box from low to high (lon, lat)
+        '''
+        (first_column, first_row), (last_column, last_row) = self.cell_of(*low), self.cell_of(*high)
+        first_column, last_column = max(first_column, 0), min(last_column, self.columns - 1)
+        if first_column > last_column:
+            return np.zeros(0, dtype=self.order.dtype)
+        slices = []
+        for row in range(max(first_row, 0), last_row + 1):
+            # Cell ids along one grid row are consecutive, so the cases of the row's cells are contiguous
+            lo, hi = np.searchsorted(self.cells, [row * self.columns + first_column,
+                                                  row * self.columns + last_column + 1])
+            if lo < hi:
+                slices.append(self.order[self.starts[lo]:self.starts[hi]])
+        return np.concatenate(slices) if slices else np.zeros(0, dtype=self.order.dtype)
+
+    def cell_of(self, longitude, latitude):
+        return (int(np.floor((longitude - self.origin[0]) / self.cell_degrees)),
+                int(np.floor((latitude - self.origin[1]) / self.cell_degrees)))
+
+    def within_radius(self, longitude, latitude, radius_km, longitudes, latitudes):
+        '''
+        :param longitude: Longitude of the center
+        :param latitude: Latitude of the center
+        :param radius_km: Great circle distance from the center
+        :param longitudes: Longitude column the index was built from
+        :param latitudes: Latitude column the index was built from
+        :return: Sorted array of the rows of the cases within radius_km of the center
+        '''
+        lat_degrees = radius_km / KM_PER_DEGREE
+        lon_degrees = min(radius_km / (KM_PER_DEGREE * max(np.cos(np.radians(abs(latitude) + lat_degrees)), 1e-6)),
+                          180)
+        rows = self.cell_rows((longitude - lon_degrees, latitude - lat_degrees),
+                              (longitude + lon_degrees, latitude + lat_degrees))
+        distances = haversine_km(longitude, latitude, longitudes[rows], latitudes[rows])
+        return np.sort(rows[distances <= radius_km])
+
+    def within_polygon(self, polygon, longitudes, latitudes):
+        '''
+        :param polygon: Sequence of (longitude, latitude) vertices, closed or not
+        :return: Sorted array of the rows of the cases inside the polygon
+        '''
+        polygon = np.asarray(polygon, dtype=np.float64)
+        rows = self.cell_rows(polygon.min(axis=0), polygon.max(axis=0))
+        inside = points_in_polygon(longitudes[rows], latitudes[rows], polygon)
+        return np.sort(rows[inside])
+
+
+def haversine_km(longitude, latitude, longitudes, latitudes):
+    lon1, lat1, lon2, lat2 = map(np.radians, (longitude, latitude, longitudes, latitudes))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def points_in_polygon(longitudes, latitudes, polygon):
+    # Even-odd rule, a point is inside when a ray going east crosses the edges an odd number of times
+    inside = np.zeros(len(longitudes), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if y1 == y2:
+            continue
+        crosses = (latitudes > min(y1, y2)) & (latitudes <= max(y1, y2))
+        x = x1 + (latitudes - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (longitudes < x)
+    return inside
+
+
+def coordinate_range(column):
+    # nanmin and nanmax only take an initial value for empty columns from numpy 1.22 on
+    known = column[~np.isnan(column)]
+    return (float(known.min()), float(known.max())) if len(known) else (0., 0.)
+
+
+def build_grid_index(cases, cell_degrees=CELL_DEGREES, batch_size=BATCH_SIZE * 16):
+    '''
+    :param cases: Case snapshot, see snapshot.load_case_snapshot
+    :param cell_degrees: Width and height of a grid cell
+    :return: GridIndex of every case with coordinates
+    '''
+    longitudes, latitudes = cases['columns'][LONGITUDE], cases['columns'][LATITUDE]
+    (west, east), (south, _) = coordinate_range(longitudes), coordinate_range(latitudes)
+    origin = (float(np.floor(west)), float(np.floor(south)))
+    columns = int(np.floor((east - origin[0]) / cell_degrees)) + 1
+
+    # Cases without coordinates get the cell id -1 and are left out
+    ids = np.empty(len(longitudes), dtype=np.int64)
+    for start in range(0, len(ids), batch_size):
+        lon, lat = longitudes[start:start + batch_size], latitudes[start:start + batch_size]
+        known = ~(np.isnan(lon) | np.isnan(lat))
+        cell = (np.floor((np.where(known, lat, origin[1]) - origin[1]) / cell_degrees) * columns
+                + np.floor((np.where(known, lon, origin[0]) - origin[0]) / cell_degrees))
+        ids[start:start + batch_size] = np.where(known, cell, -1)
+
+    order = np.argsort(ids, kind='stable')
+    order = order[ids[order] >= 0]
+    cells, starts = np.unique(ids[order], return_index=True)
+    dtype = np.int32 if len(ids) < np.iinfo(np.int32).max else np.int64
+    return GridIndex(origin, cell_degrees, columns, cells, np.append(starts, len(order)), order.astype(dtype))
+
+
+def save_grid_index(date, index):
+    save_snapshot_arrays(date, GRID, {name: getattr(index, name) for name in GRID_ARRAYS},
+                         {'origin': index.origin, 'cell_degrees': index.cell_degrees, 'columns': index.columns})
+
+
+def load_grid_index(date):
+    if (stored := load_snapshot_arrays(date, GRID, GRID_ARRAYS)) is None:
+        return None
+    arrays, meta = stored
+    return GridIndex(meta['origin'], meta['cell_degrees'], meta['columns'], **arrays)
+
+
+def get_grid_index(cases=None):
+    '''
+    :param cases: Case snapshot, the latest one if None
+    :return: GridIndex stored next to the snapshot, built and saved on first use
+    '''
+    if cases is None and (cases := load_case_snapshot()) is None:
+        return None
+    if (index := load_grid_index(cases['date'])) is None:
+        index = build_grid_index(cases)
+        save_grid_index(cases['date'], index)
+    return index
+
+
+def area_panel(cases, areas):
+    '''
+    :param cases: Case snapshot, see snapshot.load_case_snapshot
+    :param areas: Dictionary of k, v pair area name, rows of the cases in the area from a GridIndex query
+    :return: DailyPanel of the daily cases of each area, counted like helper.count_cases
+    '''
+    days_column, ages_column = cases['columns'][DATE_KEY], cases['columns'][AGE_KEY]
+    counted = dict()
+    for name, rows in areas.items():
+        days, ages = days_column[rows], ages_column[rows]
+        counted[name] = days[(ages < len(AGE_GROUPS)) & (days != MISSING_DAY)].astype(np.int64)
+
+    found = [days for days in counted.values() if len(days)]
+    first_day = min((int(days.min()) for days in found), default=current_day())
+    last_day = max(max((int(days.max()) for days in found), default=first_day), current_day())
+    values = np.stack([np.bincount(days - first_day, minlength=last_day - first_day + 1)
+                       for days in counted.values()]) if counted else np.zeros((0, 1), dtype=np.int64)
+    return DailyPanel(values[:, :, None], first_day, list(areas), [CASES_METRIC])
@@ -0,0 +1,76 @@
+import csv
+
+import numpy as np
+
+from instrument import count, instrumented
+
+
+class StatusTable:
+    '''
+    Columns of the status of COVID-19 cases in Ontario, one row per reported date.
+    Numeric columns share one float array with NaN for empty cells, any other column is kept as text.
+    '''
+
+    def __init__(self, dates, headers, values, text=None):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.headers = list(headers)
+        self.values = values
+        self.text = text or dict()
+        self._columns = {header: i for i, header in enumerate(self.headers)}
+
+    def __getitem__(self, header):
+        if header in self.text:
+            return self.text[header]
+        return self.values[:, self._columns[header]]
+
+    def __contains__(self, header):
+        return header in self._columns or header in self.text
+
+    def __len__(self):
+        return len(self.dates)
+
+    def date_strings(self):
+        return np.datetime_as_string(self.dates, unit='D').tolist()
+
+    def to_dict(self):
+        # Same shape as the old text_to_kv_pair, empty cells count as 0
+        counts = np.nan_to_num(self.values).astype(np.int64).tolist()
+        return {date: dict(zip(self.headers, row)) for date, row in zip(self.date_strings(), counts)}
+
+    @classmethod
+    def from_dict(cls, data):
+        headers = list(next(iter(data.values()), dict()).keys())
+        values = np.array([[row.get(header, np.nan) for header in headers] for row in data.values()],
+                          dtype=np.float64).reshape(len(data), len(headers))
+        return cls(list(data.keys()), headers, values)
+
+
+@instrumented('parse_status')
+def parse_status_csv(text):
+    '''
+    :param text: Status CSV, the first column holds the reported date
+    :return: StatusTable of the rows that have a date
+    '''
+    rows = [row for row in csv.reader(text.splitlines()) if row and row[0].strip()]
+    if not rows:
+        return StatusTable([], [], np.zeros((0, 0)))
+
+    header_row, rows = rows[0], rows[1:]
+    width = len(header_row)
+    # Transpose to columns in one pass, short rows are padded with empty cells
+    columns = list(zip(*(row[:width] + [''] * (width - len(row)) for row in rows))) or [()] * width
+
+    # The U10 dtype keeps only the YYYY-MM-DD part of each date
+    dates = np.array([date.strip() for date in columns[0]], dtype='U10').astype('datetime64[D]')
+    headers, numeric, text_columns = [], [], dict()
+    for header, column in zip(header_row[1:], columns[1:]):
+        cells = np.char.strip(np.array(column, dtype=str)) if column else np.zeros(0, dtype=str)
+        try:
+            numeric.append(np.where(cells == '', 'nan', cells).astype(np.float64))
+            headers.append(header)
+        except ValueError:
+            text_columns[header] = cells
+
+    values = np.column_stack(numeric) if numeric else np.zeros((len(dates), 0))
+    count(rows=len(dates), size=len(text))
+    return StatusTable(dates, headers, values, text_columns)
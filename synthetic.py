@@ -0,0 +1,195 @@
+import argparse
+import json
+
+import numpy as np
+
+from helper import AGE_GROUPS, BATCH_SIZE
+
+FIRST_DAY = np.datetime64('2020-03-01')
+# Public health units with their office city and coordinates, weighted roughly by their share of cases
+PHUS = [
+    ('Toronto Public Health', 'Toronto', 43.6565, -79.3794, .33),
+    ('Peel Public Health', 'Mississauga', 43.6479, -79.7089, .2),
+    ('York Region Public Health Services', 'Newmarket', 44.0484, -79.4804, .09),
+    ('Ottawa Public Health', 'Ottawa', 45.3457, -75.7632, .06),
+    ('Durham Region Health Department', 'Whitby', 43.8984, -78.9406, .04),
+    ('Halton Region Health Department', 'Oakville', 43.4131, -79.7441, .035),
+    ('City of Hamilton Public Health Services', 'Hamilton', 43.2571, -79.8719, .035),
+    ('Windsor-Essex County Health Unit', 'Windsor', 42.3083, -83.0336, .035),
+    ('Region of Waterloo, Public Health', 'Waterloo', 43.4633, -80.5236, .03),
+    ('Simcoe Muskoka District Health Unit', 'Barrie', 44.4108, -79.6864, .02),
+    ('Niagara Region Public Health Department', 'Thorold', 43.1165, -79.2416, .02),
+    ('Middlesex-London Health Unit', 'London', 42.9813, -81.2541, .015),
+    ('Lambton Public Health', 'Point Edward', 42.9869, -82.4079, .01),
+    ('Kingston, Frontenac and Lennox & Addington Public Health', 'Kingston', 44.2273, -76.5267, .005),
+    ('Thunder Bay District Health Unit', 'Thunder Bay', 48.4008, -89.2591, .005),
+]
+AGE_WEIGHTS = [.1, .2, .16, .14, .14, .1, .06, .06, .03, .01]
+GENDERS = (['FEMALE', 'MALE', 'UNSPECIFIED', 'GENDER DIVERSE'], [.52, .47, .008, .002])
+ACQUISITION = (['CC', 'OB', 'NO KNOWN EPI LINK', 'MISSING INFORMATION', 'TRAVEL'], [.45, .2, .25, .07, .03])
+OUTCOMES = (['Resolved', 'Not Resolved', 'Fatal'], [.95, .03, .02])
+OUTBREAK = (['Yes', 'No'], [.2, .8])
+# Waves of the epidemic curve as (peak day, width in days, relative height)
+WAVES = [(45, 18, .25), (290, 45, 1.), (400, 30, 1.1), (660, 25, 3.)]
+# Days until the last wave has faded, later days are mostly empty
+WAVE_DAYS = max(peak + 2 * width for peak, width, _ in WAVES)
+STATUS_HEADERS = ['Reported Date', 'Confirmed Negative', 'Presumptive Negative', 'Presumptive Positive',
+                  'Confirmed Positive', 'Resolved', 'Deaths', 'Total Cases',
+                  'Total patients approved for testing as of Reporting Date', 'Under Investigation',
+                  'Number of patients hospitalized with COVID-19', 'Number of patients in ICU with COVID-19',
+                  'Number of patients in ICU on a ventilator with COVID-19']
+# Columns the province only started reporting later, their cells are empty before that day or always if None
+STATUS_START_DAYS = {'Presumptive Negative': None, 'Number of patients hospitalized with COVID-19': 30,
+                     'Number of patients in ICU with COVID-19': 30,
+                     'Number of patients in ICU on a ventilator with COVID-19': 30}
+FEATURE = ('{{"type": "Feature", "properties": {{"Row_ID": {row}, "Accurate_Episode_Date": "{episode}T00:00:00", '
+           '"Case_Reported_Date": "{reported}T00:00:00", "Test_Reported_Date": "{reported}T00:00:00", '
+           '"Specimen_Date": "{specimen}T00:00:00", "Age_Group": "{age}", "Client_Gender": "{gender}", '
+           '"Case_AcquisitionInfo": "{acquisition}", "Outcome1": "{outcome}", "Outbreak_Related": {outbreak}, '
+           '"Reporting_PHU": {phu}, "Reporting_PHU_City": {city}, "Reporting_PHU_Latitude": {latitude}, '
+           '"Reporting_PHU_Longitude": {longitude}}}, '
+           '"geometry": {{"type": "Point", "coordinates": [{longitude}, {latitude}]}}}}')
+
+
+def epidemic_curve(days):
+    '''
+    :param days: Number of days since FIRST_DAY
+    :return: Array of the share of all cases on each day
+    '''
+    t = np.arange(days)
+    curve = sum(height * np.exp(-.5 * ((t - peak) / width) ** 2) for peak, width, height in WAVES) + .01
+    return curve / curve.sum()
+
+
+def case_columns(cases, days, seed=0):
+    '''
+    :param cases: Number of cases
+    :param days: Number of days the cases are spread over
+    :param seed: Seed of the random generator
+    :return: Dictionary of arrays, dates are days since FIRST_DAY and categories are indices
+    '''
+    rng = np.random.default_rng(seed)
+    phu_weights = np.array([phu[-1] for phu in PHUS])
+    episode = np.repeat(np.arange(days), rng.multinomial(cases, epidemic_curve(days)))
+    delay = rng.poisson(3, cases)
+    return {
+        'episode': episode,
+        'specimen': episode + np.minimum(delay, rng.poisson(1, cases)),
+        'reported': episode + delay,
+        'phu': rng.choice(len(PHUS), cases, p=phu_weights / phu_weights.sum()),
+        'age': rng.choice(len(AGE_GROUPS), cases, p=AGE_WEIGHTS),
+        'gender': rng.choice(len(GENDERS[0]), cases, p=GENDERS[1]),
+        'acquisition': rng.choice(len(ACQUISITION[0]), cases, p=ACQUISITION[1]),
+        'outcome': rng.choice(len(OUTCOMES[0]), cases, p=OUTCOMES[1]),
+        'outbreak': rng.choice(len(OUTBREAK[0]), cases, p=OUTBREAK[1]),
+    }
+
+
+def iter_feature_strings(cases, days, seed=0, batch_size=BATCH_SIZE):
+    '''
+    :return: Generator of the JSON text of each case feature, made a batch at a time
+    '''
+    rng = np.random.default_rng(seed)
+    for start in range(0, cases, batch_size):
+        size = min(batch_size, cases - start)
+        # Every batch draws from the whole curve, the rows of the file aren't sorted by date
+        columns = case_columns(size, days, int(rng.integers(1 << 31)))
+        order = rng.permutation(size)
+        dates = {key: np.datetime_as_string(FIRST_DAY + columns[key][order], unit='D')
+                 for key in ('episode', 'reported', 'specimen')}
+        for i, row in enumerate(order):
+            name, city, latitude, longitude, _ = PHUS[columns['phu'][row]]
+            yield FEATURE.format(
+                row=start + i + 1, episode=dates['episode'][i], reported=dates['reported'][i],
+                specimen=dates['specimen'][i], age=AGE_GROUPS[columns['age'][row]],
+                gender=GENDERS[0][columns['gender'][row]], acquisition=ACQUISITION[0][columns['acquisition'][row]],
+                outcome=OUTCOMES[0][columns['outcome'][row]],
+                outbreak=json.dumps(OUTBREAK[0][columns['outbreak'][row]]),
+                phu=json.dumps(name), city=json.dumps(city), latitude=latitude, longitude=longitude)
+
+
+def case_features(cases, days, seed=0):
+    '''
+    :return: List of GeoJSON case features as dictionaries, for benchmarks that start from parsed data
+    '''
+    return [json.loads(feature) for feature in iter_feature_strings(cases, days, seed)]
+
+
+def write_case_geojson(path_to_file, cases, days, seed=0):
+    '''
+    :param path_to_file: Path of the GeoJSON file written, the file grows one feature at a time
+    :param cases: Number of cases, tens of millions only cost disk space
+    :param days: Number of days the cases are spread over
+    :param seed: Seed of the random generator
+    '''
+    with open(path_to_file, 'w') as f:
+        f.write('{"type": "FeatureCollection", "name": "conposcovidloc", "features": [\n')
+        for i, feature in enumerate(iter_feature_strings(cases, days, seed)):
+            f.write(',\n' if i else '')
+            f.write(feature)
+        f.write('\n]}\n')
+
+
+def status_csv(days, seed=0, cases_per_day=1000):
+    '''
+    :param days: Number of reported days
+    :param seed: Seed of the random generator
+    :param cases_per_day: Mean number of new cases a day at the height of the largest wave
+    :return: Text of a status CSV with cumulative counts, in the layout of the province's file
+    '''
+    rng = np.random.default_rng(seed)
+    curve = epidemic_curve(days)
+    new_cases = rng.poisson(cases_per_day * curve / curve.max())
+    new_tests = rng.poisson(new_cases * 20 + 500)
+    total_cases = np.cumsum(new_cases)
+    deaths = np.cumsum(rng.binomial(new_cases, OUTCOMES[1][2]))
+    resolved = np.concatenate([np.zeros(14, dtype=np.int64), total_cases[:-14]])[:days] - deaths
+    hospitalized = rng.poisson(np.convolve(new_cases, np.full(10, .05))[:days])
+    icu = rng.binomial(hospitalized, .3)
+    columns = {
+        'Confirmed Negative': np.cumsum(new_tests - new_cases),
+        'Presumptive Negative': np.zeros(days, dtype=np.int64),
+        'Presumptive Positive': np.zeros(days, dtype=np.int64),
+        'Confirmed Positive': total_cases - deaths - np.maximum(resolved, 0),
+        'Resolved': np.maximum(resolved, 0),
+        'Deaths': deaths,
+        'Total Cases': total_cases,
+        'Total patients approved for testing as of Reporting Date': np.cumsum(new_tests),
+        'Under Investigation': rng.poisson(new_tests / 2),
+        'Number of patients hospitalized with COVID-19': hospitalized,
+        'Number of patients in ICU with COVID-19': icu,
+        'Number of patients in ICU on a ventilator with COVID-19': rng.binomial(icu, .6),
+    }
+    dates = np.datetime_as_string(FIRST_DAY + np.arange(days), unit='D')
+    cells = np.array([columns[header].astype(str) for header in STATUS_HEADERS[1:]], dtype=object)
+    for i, header in enumerate(STATUS_HEADERS[1:]):
+        if header in STATUS_START_DAYS:
+            start = STATUS_START_DAYS[header]
+            cells[i, :days if start is None else start] = ''
+    rows = [','.join(STATUS_HEADERS)]
+    rows.extend(','.join([date, *row]) for date, row in zip(dates, cells.T.tolist()))
+    return '\r\n'.join(rows) + '\r\n'
+
+
+def days_until_today():
+    return int((np.datetime64('today', 'D') - FIRST_DAY).astype(np.int64))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Ontario case and status files')
+    parser.add_argument('kind', choices=['cases', 'status'])
+    parser.add_argument('path')
+    parser.add_argument('--cases', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=days_until_today())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.kind == 'cases':
+        write_case_geojson(args.path, args.cases, args.days, args.seed)
+    else:
+        with open(args.path, 'w', newline='') as f:
+            f.write(status_csv(args.days, args.seed))
+
+
+if __name__ == "__main__":
+    main()
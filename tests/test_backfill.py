@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backfill import backfill_rt, vintage_cases
+from covid import get_rt
+from helper import get_regional_panel
+from snapshot import load_case_snapshot, save_case_snapshot
+
+
+def case_features(last_date, days=150, seed=0):
+    rng = np.random.default_rng(seed)
+    episodes = np.datetime64(last_date) - rng.integers(0, days, 20 * days)
+    return [{'type': 'Feature',
+             'properties': {'Accurate_Episode_Date': f'{episode}T00:00:00', 'Age_Group': '30s',
+                            'Reporting_PHU_City': city, 'Reporting_PHU': f'{city} PHU'},
+             'geometry': {'type': 'Point', 'coordinates': [-79.4, 43.7]}}
+            for episode, city in zip(episodes, rng.choice(['Toronto', 'Ottawa'], len(episodes)))]
+
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    today = np.datetime64('today', 'D')
+    dates = [str(today - 2), str(today - 1), str(today)]
+    for i, date in enumerate(dates):
+        save_case_snapshot(date, iter(case_features(date, seed=i)))
+    return dates
+
+
+def test_vintage_starts_on_the_epoch_axis(snapshots):
+    cases = vintage_cases(snapshots[0])
+    assert cases.index[0] == pd.Timestamp('2020-01-01') + pd.Timedelta(days=50)
+    assert cases.index[-1] == pd.Timestamp(snapshots[0]) - pd.Timedelta(days=7)
+
+
+def test_newest_vintage_matches_the_pipeline(snapshots):
+    result = backfill_rt(processes=1)
+    published = get_rt(get_regional_panel({'cases': load_case_snapshot()}))
+    pd.testing.assert_frame_equal(result.xs(snapshots[-1]), published, check_names=False)
+
+
+def test_vintages_match_separate_runs(snapshots):
+    from rt import calculate_rt
+    result = backfill_rt(processes=1)
+    for date in snapshots:
+        pd.testing.assert_frame_equal(result.xs(date), calculate_rt(vintage_cases(date)), check_names=False)
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from bootstrap import filter_replicates, smooth_replicates
+from rt import calculate_rt, get_process_operator, prepare_cases
+
+
+def daily_cases(days=200, seed=0):
+    rng = np.random.default_rng(seed)
+    curve = 200 * np.exp(-.5 * ((np.arange(days) - 120) / 30) ** 2) + 5
+    return pd.Series(rng.poisson(curve), index=pd.date_range('2020-03-01', periods=days, name='date'))
+
+
+def test_smoothing_matches_prepare_cases():
+    cases = daily_cases()
+    _, smoothed = prepare_cases(cases)
+    start = cases.index.get_loc(smoothed.index[0])
+    np.testing.assert_array_equal(smooth_replicates(cases.values[None], [2.])[0, start:], smoothed.values)
+
+
+def test_unperturbed_replicate_matches_calculate_rt():
+    cases = daily_cases()
+    _, smoothed = prepare_cases(cases)
+    most_likely = filter_replicates(smoothed.values[None], get_process_operator(.25), np.float64)[0]
+    np.testing.assert_allclose(most_likely, calculate_rt(cases)['ML'].values, atol=1e-6)
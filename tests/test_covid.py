@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+
+import covid
+from cli import main
+from helper import get_regional_panel
+from series import PROVINCE, to_day
+from status import parse_status_csv
+
+UPDATE_DATE = '2021-12-20'
+LAST_DATE = '2021-12-31'
+STATUS_HEADERS = ['Reported Date', 'Total Cases', 'Deaths', 'Total patients approved for testing as of Reporting Date',
+                  'Number of patients hospitalized with COVID-19', 'Number of patients in ICU with COVID-19',
+                  'Number of patients in ICU on a ventilator with COVID-19']
+
+
+def case_features(last_date=LAST_DATE, days=200, seed=0):
+    rng = np.random.default_rng(seed)
+    episodes = np.datetime64(last_date) - rng.integers(0, days, 50 * days)
+    return [{'type': 'Feature',
+             'properties': {'Accurate_Episode_Date': f'{episode}T00:00:00', 'Age_Group': '40s',
+                            'Reporting_PHU_City': city},
+             'geometry': {'type': 'Point', 'coordinates': [-79.4, 43.7]}}
+            for episode, city in zip(episodes, rng.choice(['Toronto', 'Ottawa'], len(episodes)))]
+
+
+def status_csv(last_date=LAST_DATE, days=60):
+    dates = np.datetime64(last_date) - np.arange(days)[::-1]
+    rows = [','.join(STATUS_HEADERS)]
+    rows += [f'{date},{100 * i},{i},{1000 * i},{i % 7},{i % 5},{i % 3}' for i, date in enumerate(dates, 1)]
+    return '\n'.join(rows) + '\n'
+
+
+def test_regional_panel_ends_on_the_update_date():
+    data = {'features': case_features()}
+    assert get_regional_panel(data, UPDATE_DATE).last_day == to_day(UPDATE_DATE)
+    # A later date pads with days without cases
+    later = get_regional_panel(data, '2022-01-10')
+    assert later.last_day == to_day('2022-01-10') and later.series(PROVINCE)[-10:].sum() == 0
+
+
+@pytest.fixture
+def past_datasets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    datasets = ({'table': parse_status_csv(status_csv())}, {'features': case_features()})
+    monkeypatch.setattr(covid, 'get_ontario_datasets', lambda today, base_url: datasets)
+    covid.pipeline.clear()
+    yield
+    covid.pipeline.clear()
+
+
+def test_indicators_of_a_past_date(past_datasets, capsys):
+    assert main(['--date', UPDATE_DATE, 'indicators', '--json']) == 0
+    key_info = json.loads(capsys.readouterr().out)['today_key_info']
+    assert key_info['date'] == UPDATE_DATE
+    assert np.isfinite(key_info['r_t'])
+    # The status of the day of the update, not of the last row of the file
+    assert (key_info['case count'], key_info['test count']) == (100, 1000)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from cube import CUBE_KEYS, build_case_cube
+from helper import DATE_KEY, MISSING_DAY
+from series import to_date
+
+NAMES = {
+    'Reporting_PHU': ['Toronto', 'Peel', 'Ottawa', 'York'],
+    'Age_Group': ['<20', '20s', '30s', '40s', '50s+'],
+    'Outcome1': ['Resolved', 'Not Resolved', 'Fatal'],
+}
+
+
+def random_cases(n=50000, seed=0):
+    rng = np.random.default_rng(seed)
+    days = rng.integers(60, 200, n).astype(np.int32)
+    days[::50] = MISSING_DAY
+    columns = {key: rng.integers(0, len(NAMES[key]), n).astype(np.int8) for key in CUBE_KEYS}
+    return {'date': '2020-08-01', 'columns': {DATE_KEY: days, **columns}, 'names': NAMES}
+
+
+def test_counts_match_a_full_scan():
+    cases = random_cases()
+    columns = cases['columns']
+    cube = build_case_cube(cases, batch_size=4096)
+    assert cube.first_day == columns[DATE_KEY][columns[DATE_KEY] != MISSING_DAY].min()
+    assert cube.count() == np.count_nonzero(columns[DATE_KEY] != MISSING_DAY)
+
+    start, stop = to_date(100), to_date(150)
+    selections = [dict(), {'Reporting_PHU': 'Peel'}, {'Age_Group': ['20s', '40s'], 'Outcome1': 'Fatal'},
+                  {'Reporting_PHU': ['Toronto', 'York'], 'Age_Group': '<20', 'Outcome1': ['Resolved']}]
+    for selection in selections:
+        match = (columns[DATE_KEY] >= 100) & (columns[DATE_KEY] < 150)
+        for key, value in selection.items():
+            codes = [NAMES[key].index(name) for name in ([value] if isinstance(value, str) else value)]
+            match &= np.isin(columns[key], codes)
+        assert cube.count(start, stop, **selection) == np.count_nonzero(match)
+
+
+def test_panel_matches_a_full_scan():
+    cases = random_cases()
+    columns = cases['columns']
+    cube = build_case_cube(cases)
+    panel = cube.panel('Age_Group', to_date(90), to_date(120), Reporting_PHU=['Peel', 'Ottawa'], Outcome1='Fatal')
+    assert panel.first_day == 90 and len(panel) == 30 and panel.regions == NAMES['Age_Group']
+    for code, age in enumerate(NAMES['Age_Group']):
+        match = np.isin(columns['Reporting_PHU'], [1, 2]) & (columns['Outcome1'] == 2) & (columns['Age_Group'] == code)
+        expected = np.bincount(columns[DATE_KEY][match & (columns[DATE_KEY] >= 90) & (columns[DATE_KEY] < 120)] - 90,
+                               minlength=30)
+        np.testing.assert_array_equal(panel.series(age), expected)
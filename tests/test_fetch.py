@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+import fetch
+from fetch import ONTARIO_COVID19_POS_LINK, ONTARIO_COVID19_STATUS_LINK, PATH_TO_GEOJSON_DATE_FILE, \
+    PATH_TO_JSON_DATE_FILE, get_date_and_cases, get_date_and_data, iter_geojson_features
+from helper import CITY_KEY, DATE_KEY
+from snapshot import CASES, STATUS, list_snapshots, load_case_snapshot, snapshot_path
+
+VALIDATED_DATE = '2020-07-30'
+STATUS_CSV = 'Reported Date,Total Cases,Deaths\n2020-07-28,10,1\n2020-07-29,15,2\n2020-07-30,22,2\n'
+
+
+def case_collection(n=3000):
+    cities = ['Toronto', 'Ottawa', 'Trois-Rivières', 'Île-Perrot']
+    return {'type': 'FeatureCollection', 'name': 'conposcovidloc', 'features': [
+        {'type': 'Feature', 'properties': {'Accurate_Episode_Date': f'2020-07-{1 + i % 28:02d}T00:00:00',
+                                           'Age_Group': '20s', CITY_KEY: cities[i % len(cities)]},
+         'geometry': {'type': 'Point', 'coordinates': [-79.4 + i / 1e4, 43.7]}} for i in range(n)]}
+
+
+def dataset_page(base_url, file_name):
+    return (f'<a class="{fetch.TAG_RESOURCE}" href="{base_url}{file_name}">download</a>'
+            f'<section class="additional-info"><table><tr><th>{fetch.LAST_VALIDATED_DATE}</th>'
+            f'<td> {VALIDATED_DATE} </td></tr></table></section>')
+
+
+def make_handler(base_url, requests, files):
+    class DatasetHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path.startswith(f'/{ONTARIO_COVID19_STATUS_LINK}'):
+                body = dataset_page(base_url, 'status.csv')
+            elif self.path.startswith(f'/{ONTARIO_COVID19_POS_LINK}'):
+                body = dataset_page(base_url, 'conposcovidloc.geojson')
+            else:
+                body = files[self.path.lstrip('/')]
+            body = body.encode()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            unchanged = self.headers.get('If-None-Match') == etag
+            # A truncated file announces more bytes than it sends before the connection drops
+            truncated = self.path.lstrip('/') in files.get('truncated', ())
+            requests.append((self.path, unchanged))
+            self.send_response(304 if unchanged else 200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0' if unchanged else str(len(body) + 100 * truncated))
+            self.end_headers()
+            if not unchanged:
+                self.wfile.write(body)
+            self.close_connection = truncated
+
+        def log_message(self, format, *args):
+            pass
+
+    return DatasetHandler
+
+
+@pytest.fixture
+def dataset_site(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open(PATH_TO_JSON_DATE_FILE, 'w') as f:
+        f.write('2020-07-29')
+    with open(PATH_TO_GEOJSON_DATE_FILE, 'w') as f:
+        f.write('2020-07-29')
+    requests, files = [], {'status.csv': STATUS_CSV, 'conposcovidloc.geojson': json.dumps(case_collection())}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), None)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    server.RequestHandlerClass = make_handler(base_url, requests, files)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield base_url, requests, files
+    server.shutdown()
+    server.server_close()
+
+
+def test_unchanged_dataset_is_not_downloaded_again(dataset_site):
+    base_url, requests, _ = dataset_site
+    first = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    assert first['changed'] and first['date'] == VALIDATED_DATE
+    assert requests == [(f'/{ONTARIO_COVID19_STATUS_LINK}', False), ('/status.csv', False)]
+    with open(fetch.PATH_TO_HTTP_CACHE_FILE, 'r') as f:
+        assert set(json.load(f)) == {f'{base_url}{ONTARIO_COVID19_STATUS_LINK}', f'{base_url}status.csv'}
+
+    # A date file behind the validated date checks again, both requests come back 304 without a body
+    with open(PATH_TO_JSON_DATE_FILE, 'w') as f:
+        f.write('2020-07-29')
+    requests.clear()
+    second = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    assert requests == [(f'/{ONTARIO_COVID19_STATUS_LINK}', True), ('/status.csv', True)]
+    assert not second['changed'] and second['sha256'] == first['sha256']
+    assert second['data'] == first['data']
+
+
+def test_features_split_across_chunks():
+    collection = case_collection(50)
+    body = json.dumps(collection, indent=1, ensure_ascii=False).encode()
+    for size in (1, 7, 64, len(body)):
+        chunks = [body[i:i + size] for i in range(0, len(body), size)]
+        assert list(iter_geojson_features(chunks)) == collection['features']
+
+
+def test_cases_are_snapshotted_while_they_download(dataset_site):
+    base_url, _, _ = dataset_site
+    result = get_date_and_cases(VALIDATED_DATE, ONTARIO_COVID19_POS_LINK, base_url)
+    assert result['changed'] and list_snapshots(CASES) == [VALIDATED_DATE]
+    cases, features = load_case_snapshot(), case_collection()['features']
+    assert len(cases['columns'][DATE_KEY]) == len(features)
+    assert [cases['names'][CITY_KEY][code] for code in cases['columns'][CITY_KEY][:4]] == \
+        [feature['properties'][CITY_KEY] for feature in features[:4]]
+    # The snapshot replaces the raw file, the hash of the whole body is kept
+    body = json.dumps(case_collection()).encode()
+    assert result['sha256'] == hashlib.sha256(body).hexdigest()
+    assert not os.path.exists(fetch.PATH_TO_GEOJSON_DATA_FILE)
+    assert not os.path.exists(f'{fetch.PATH_TO_GEOJSON_DATA_FILE}.part')
+
+
+def check_again():
+    # Date files behind the validated date make the next call look at the site again
+    for path in (PATH_TO_JSON_DATE_FILE, PATH_TO_GEOJSON_DATE_FILE):
+        with open(path, 'w') as f:
+            f.write('2020-07-29')
+
+
+def test_truncated_body_keeps_the_last_good_copy(dataset_site):
+    base_url, _, files = dataset_site
+    first = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    check_again()
+    files['status.csv'] = STATUS_CSV + '2020-07-31,30,3\n'
+    files['truncated'] = {'status.csv', 'conposcovidloc.geojson'}
+    with pytest.raises(Exception):
+        get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    with open(fetch.PATH_TO_CSV_DATA_FILE, 'r') as f:
+        assert f.read() == STATUS_CSV
+    assert not os.path.exists(f'{fetch.PATH_TO_CSV_DATA_FILE}.part')
+    assert fetch.get_hash_from_file(fetch.ONTARIO_COVID19_CSV) == first['sha256']
+
+    with pytest.raises(Exception):
+        get_date_and_cases(VALIDATED_DATE, ONTARIO_COVID19_POS_LINK, base_url)
+    assert list_snapshots(CASES) == []
+    assert not os.path.exists(f'{fetch.PATH_TO_GEOJSON_DATA_FILE}.part')
+
+    # Nothing of the broken transfer was remembered, the next call downloads the whole file
+    files['truncated'] = set()
+    second = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    assert second['changed'] and second['table'].date_strings()[-1] == '2020-07-31'
+    assert get_date_and_cases(VALIDATED_DATE, ONTARIO_COVID19_POS_LINK, base_url)['changed']
+
+
+def test_same_content_is_not_processed_again(dataset_site):
+    base_url, requests, _ = dataset_site
+    first_status = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    first_cases = get_date_and_cases(VALIDATED_DATE, ONTARIO_COVID19_POS_LINK, base_url)
+    # A rebuilt snapshot would replace its folder and lose the marker
+    markers = [os.path.join(snapshot_path(VALIDATED_DATE, kind), 'marker') for kind in (STATUS, CASES)]
+    for marker in markers:
+        open(marker, 'w').close()
+
+    # Without the validators of the last responses both files come back whole, with the same content
+    os.remove(fetch.PATH_TO_HTTP_CACHE_FILE)
+    check_again()
+    requests.clear()
+    status = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, base_url=base_url)
+    cases = get_date_and_cases(VALIDATED_DATE, ONTARIO_COVID19_POS_LINK, base_url)
+    assert ('/status.csv', False) in requests and ('/conposcovidloc.geojson', False) in requests
+    assert not status['changed'] and status['sha256'] == first_status['sha256']
+    assert not cases['changed'] and cases['sha256'] == first_cases['sha256']
+    assert all(map(os.path.exists, markers))
+    assert status['data'] == first_status['data']
+
+
+def test_file_type_is_still_the_third_argument(dataset_site):
+    base_url, _, _ = dataset_site
+    result = get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_STATUS_LINK, fetch.ONTARIO_COVID19_CSV, base_url)
+    # The dictionary view is only built once it is read
+    assert result['changed'] and 'data' not in result
+    assert result['data']['2020-07-30'] == {'Total Cases': 22, 'Deaths': 2}
+    with pytest.raises(ValueError):
+        get_date_and_data(VALIDATED_DATE, ONTARIO_COVID19_POS_LINK, fetch.ONTARIO_COVID19_GEOJSON, base_url)
@@ -0,0 +1,53 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import rt
+from rt import highest_density_interval, r_t_range
+
+
+def brute_force_interval(pmf, p):
+    # The original search over the N x N matrix of every low, high pair
+    cumsum = np.cumsum(pmf.values)
+    total_p = cumsum - cumsum[:, None]
+    lows, highs = (total_p > p).nonzero()
+    best = (highs - lows).argmin()
+    return pmf.index[lows[best]], pmf.index[highs[best]]
+
+
+def posteriors(days, seed=0):
+    rng = np.random.default_rng(seed)
+    centers, widths = rng.uniform(.5, 3, days), rng.uniform(.05, .5, days)
+    values = np.exp(-.5 * ((r_t_range[:, None] - centers) / widths) ** 2)
+    return pd.DataFrame(values / values.sum(axis=0), index=r_t_range,
+                        columns=pd.date_range('2020-03-01', periods=days))
+
+
+def test_matches_brute_force_across_blocks(monkeypatch):
+    # Blocks of a few days, so the days are split unevenly between them
+    monkeypatch.setattr(rt, 'HDI_BLOCK_SIZE', 3 * 2 * len(r_t_range))
+    pmfs = posteriors(25)
+    result = highest_density_interval(pmfs, p=[.5, .9])
+    for day in pmfs.columns:
+        for p in (.5, .9):
+            low, high = brute_force_interval(pmfs[day], p)
+            assert (result.loc[day, f'Low_{p * 100:.0f}'], result.loc[day, f'High_{p * 100:.0f}']) == (low, high)
+
+
+def test_series_and_nan_columns():
+    pmfs = posteriors(3)
+    pmfs.iloc[:, 1] = np.nan
+    result = highest_density_interval(pmfs)
+    assert result.iloc[1].isna().all()
+    assert tuple(highest_density_interval(pmfs.iloc[:, 0])) == brute_force_interval(pmfs.iloc[:, 0], .9)
+
+
+def test_memory_does_not_grow_with_days():
+    pmfs = posteriors(900)
+    tracemalloc.start()
+    highest_density_interval(pmfs, p=[.5, .8, .9])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Well under the hundreds of MiB of searching every day at once, the input alone is 8 MiB
+    assert peak < 40 << 20
@@ -0,0 +1,61 @@
+from collections import Counter
+
+import numpy as np
+
+from helper import AGE_GROUPS, aggregate_case_columns, aggregate_cases, get_regional_data
+from snapshot import load_case_snapshot, save_case_snapshot
+
+CITIES = ['Toronto', 'Ottawa', 'Hamilton', None, 'Unknown PHU']
+
+
+def case_features(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = [f'{date}T00:00:00' for date in np.datetime64('2020-03-01') + rng.integers(0, 120, n)]
+    features = [{'type': 'Feature', 'properties': {
+        'Accurate_Episode_Date': date if rng.random() > .02 else None,
+        'Age_Group': str(rng.choice(AGE_GROUPS + ['Unknown'])),
+        'Reporting_PHU_City': CITIES[rng.integers(len(CITIES))]}} for date in dates]
+    # A city whose only case has no known age group gets no row
+    features.append({'type': 'Feature', 'properties': {
+        'Accurate_Episode_Date': dates[0], 'Age_Group': 'Unknown', 'Reporting_PHU_City': 'Filtered Out'}})
+    return features
+
+
+def baseline_counts(features):
+    # The dictionary counting the vectorized aggregation replaced
+    province, cities = Counter(), dict()
+    for item in features:
+        datum = item['properties']
+        if datum['Age_Group'] not in AGE_GROUPS or (case_date := datum['Accurate_Episode_Date']) is None:
+            continue
+        province[case_date[:10]] += 1
+        cities.setdefault(datum['Reporting_PHU_City'], Counter())[case_date[:10]] += 1
+    return dict(province), {city: dict(counts) for city, counts in cities.items()}
+
+
+def nonzero(counts):
+    return {date: count for date, count in counts.items() if count}
+
+
+def regional_counts(regional):
+    dates = np.datetime_as_string(regional['dates'], unit='D')
+    return nonzero(dict(zip(dates, regional['province'].tolist()))), {
+        city: nonzero(dict(zip(dates, counts.tolist()))) for city, counts in zip(regional['cities'], regional['counts'])}
+
+
+def test_features_count_like_the_baseline():
+    features = case_features()
+    assert regional_counts(aggregate_cases(features, batch_size=512)) == baseline_counts(features)
+    province, cities = get_regional_data({'features': features})
+    assert (nonzero(province), {city: nonzero(counts) for city, counts in cities.items()}) == \
+        baseline_counts(features)
+
+
+def test_snapshot_columns_count_like_the_baseline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    features = case_features(seed=1)
+    save_case_snapshot('2020-07-01', iter(features))
+    province, cities = baseline_counts(features)
+    # Snapshots store the names as text, a missing PHU comes back as 'None'
+    assert regional_counts(aggregate_case_columns(load_case_snapshot(), batch_size=512)) == \
+        (province, {str(city): counts for city, counts in cities.items()})
@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import numpy as np
+import pytest
+
+import instrument
+
+
+def spin(n):
+    return sum(i * i for i in range(n))
+
+
+@pytest.fixture
+def recorder():
+    yield instrument.enable()
+    instrument.disable()
+
+
+@pytest.mark.skipif(not instrument.reset_peak_rss(), reason='The high-water mark cannot be reset here')
+def test_peak_is_per_stage(recorder):
+    with instrument.stage('heavy'):
+        block = np.ones(100 << 20, dtype=np.uint8)
+        del block
+    with instrument.stage('light'):
+        pass
+    stages = recorder.report()['stages']
+    assert stages['heavy']['peak_rss_bytes'] - stages['light']['peak_rss_bytes'] > 50 << 20
+
+
+@pytest.mark.skipif(not instrument.reset_peak_rss(), reason='The high-water mark cannot be reset here')
+def test_enclosing_stage_keeps_the_peak_of_inner_stages(recorder):
+    with instrument.stage('outer'):
+        with instrument.stage('inner'):
+            block = np.ones(100 << 20, dtype=np.uint8)
+            del block
+    stages = recorder.report()['stages']
+    assert stages['outer']['peak_rss_bytes'] >= stages['inner']['peak_rss_bytes']
+
+
+def allocate(name):
+    with instrument.stage(name):
+        block = np.ones(100 << 20, dtype=np.uint8)
+        del block
+
+
+@pytest.mark.skipif(not instrument.reset_peak_rss(), reason='The high-water mark cannot be reset here')
+def test_threaded_stages_keep_the_enclosing_peak(recorder):
+    with instrument.stage('fetch'):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(allocate, ['status', 'cases']))
+        # Entered after the threads, so it may reset the mark without hiding their peak from fetch
+        with instrument.stage('after'):
+            pass
+    stages = recorder.report()['stages']
+    # Stages off the main thread don't reset the mark of the whole process, they only report its peak
+    for name in ('status', 'cases'):
+        assert 'peak_rss_bytes' not in stages[name] and stages[name]['process_peak_rss_bytes'] > 100 << 20
+    assert stages['fetch']['peak_rss_bytes'] - stages['after']['peak_rss_bytes'] > 50 << 20
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='Worker CPU comes from getrusage')
+def test_worker_cpu_is_counted(recorder):
+    with instrument.stage('pool'):
+        with Pool(2) as pool:
+            pool.map(spin, [2_000_000] * 4)
+    stage = recorder.report()['stages']['pool']
+    assert stage['children_cpu_seconds'] > stage['cpu_seconds']
@@ -0,0 +1,41 @@
+import numpy as np
+from scipy import stats as sps
+from scipy.special import gammaln
+
+from kernel import ProcessKernel, log_factorial, poisson_likelihoods
+from rt import GAMMA, r_t_range
+
+
+def dense_process_matrix(sigma):
+    # The full Gaussian between every pair of R_t values, each column normalized to sum to 1
+    matrix = sps.norm(loc=r_t_range, scale=sigma).pdf(r_t_range[:, None])
+    return matrix / matrix.sum(axis=0)
+
+
+def test_kernel_matches_the_dense_matrix():
+    rng = np.random.default_rng(0)
+    posteriors = rng.random((3, len(r_t_range)))
+    posteriors /= posteriors.sum(axis=1, keepdims=True)
+    for sigma in (.05, .25, 1.):
+        kernel, matrix = ProcessKernel(sigma, r_t_range), dense_process_matrix(sigma)
+        np.testing.assert_allclose(kernel.to_dense(), matrix, atol=1e-12)
+        np.testing.assert_allclose(kernel @ posteriors[0], matrix @ posteriors[0], atol=1e-12)
+        np.testing.assert_allclose(kernel @ posteriors, posteriors @ matrix.T, atol=1e-12)
+
+
+def test_stacked_kernel_matches_one_matrix_per_sigma():
+    sigmas = np.array([.1, .25, .5])
+    rng = np.random.default_rng(1)
+    posteriors = rng.random((len(sigmas), len(r_t_range)))
+    priors = ProcessKernel(sigmas, r_t_range) @ posteriors
+    for row, sigma in enumerate(sigmas):
+        np.testing.assert_allclose(priors[row], dense_process_matrix(sigma) @ posteriors[row], atol=1e-12)
+
+
+def test_likelihoods_match_the_poisson_pmf():
+    k = np.array([0, 1, 5, 40, 300, 5000, 0, 12])
+    lam = k[:-1] * np.exp(GAMMA * (r_t_range[:, None] - 1))
+    np.testing.assert_allclose(poisson_likelihoods(k, GAMMA, r_t_range), sps.poisson.pmf(k[1:], lam),
+                               rtol=1e-9, atol=1e-300)
+    # Past the end of the table, which grows to fit
+    np.testing.assert_allclose(log_factorial(np.array([0, 3, 10000])), [0, np.log(6), gammaln(10001)])
@@ -0,0 +1,67 @@
+from pipeline import Pipeline, Stage
+
+
+def make_pipeline(calls, cache_path=None):
+    def double(x):
+        calls.append('double')
+        return x * 2
+
+    def add(x, y):
+        calls.append('add')
+        return x + y
+
+    return Pipeline(Stage('double', double, ['x']), Stage('add', add, ['double', 'y']), cache_path=cache_path)
+
+
+def test_only_stages_after_a_change_rerun():
+    calls = []
+    pipeline = make_pipeline(calls)
+    assert pipeline.run(x=1, y=2)['add'] == 4
+    pipeline.run(x=1, y=2)
+    assert pipeline.run(x=1, y=3)['add'] == 5
+    assert calls == ['double', 'add', 'add']
+
+
+def test_a_new_process_reuses_cached_outputs(tmp_path):
+    calls = []
+    make_pipeline(calls, tmp_path).run(x=1, y=2)
+    # A fresh pipeline stands in for the next run of the CLI
+    assert make_pipeline(calls, tmp_path).run(x=1, y=2)['add'] == 4
+    assert calls == ['double', 'add']
+    make_pipeline(calls, tmp_path).run(x=2, y=2)
+    assert calls == ['double', 'add', 'double', 'add']
+
+
+def test_clear_removes_cached_outputs(tmp_path):
+    calls = []
+    pipeline = make_pipeline(calls, tmp_path)
+    pipeline.run(x=1, y=2)
+    pipeline.clear()
+    make_pipeline(calls, tmp_path).run(x=1, y=2)
+    assert calls == ['double', 'add', 'double', 'add']
+
+
+def test_changed_stage_code_is_not_served_from_the_cache(tmp_path):
+    calls = []
+    make_pipeline(calls, tmp_path).run(x=1, y=2)
+
+    def triple(x):
+        calls.append('triple')
+        return x * 3
+
+    # Same stage name and inputs, new code
+    changed = Pipeline(Stage('double', triple, ['x']), cache_path=tmp_path)
+    assert changed.run(x=1)['double'] == 3
+    assert calls == ['double', 'add', 'triple']
+
+
+def test_explicit_version_reruns_the_stage(tmp_path):
+    calls = []
+
+    def pipeline(version):
+        return Pipeline(Stage('count', lambda x: calls.append(x) or len(calls), ['x'], version=version),
+                        cache_path=tmp_path)
+
+    pipeline(1).run(x='a')
+    assert pipeline(1).run(x='a')['count'] == 1
+    assert pipeline(2).run(x='a')['count'] == 2
@@ -0,0 +1,76 @@
+import os
+import time
+
+from reddit import FAILED, SENT, Publisher
+
+
+class FlakyTransport:
+    '''
+    Fails the first replies it is asked to send, records every post and reply
+    '''
+
+    def __init__(self, failed_replies=0):
+        self.failed_replies = failed_replies
+        self.posts, self.replies = [], []
+
+    def submit(self, title, url):
+        self.posts.append(title)
+        return f'post-{len(self.posts)}'
+
+    def reply(self, post_id, body):
+        if self.failed_replies:
+            self.failed_replies -= 1
+            raise ConnectionError('Reddit is down')
+        self.replies.append((post_id, body))
+
+
+def post(date):
+    return {'date': date, 'title': f'{date} COVID-19 Update', 'url': 'https://example.com', 'body': 'Key indicators'}
+
+
+def test_each_date_is_posted_once(tmp_path):
+    transport = FlakyTransport()
+    publisher = Publisher(transport, path=str(tmp_path))
+    assert publisher.enqueue(post('2020-07-30'))
+    assert not publisher.enqueue(post('2020-07-30'))
+    assert publisher.drain() is None
+    assert transport.posts == ['2020-07-30 COVID-19 Update'] and transport.replies == [('post-1', 'Key indicators')]
+
+    # Nor after a restart
+    restarted = Publisher(transport, path=str(tmp_path))
+    assert not restarted.enqueue(post('2020-07-30'))
+    assert restarted.pending() == []
+
+
+def test_retry_only_sends_the_missing_reply(tmp_path):
+    transport = FlakyTransport(failed_replies=2)
+    publisher = Publisher(transport, path=str(tmp_path), backoff=.01)
+    publisher.enqueue(post('2020-07-30'))
+    # The wait doubles after every failed attempt
+    for backoff in (.01, .02):
+        assert 0 < publisher.drain() <= backoff
+        time.sleep(backoff)
+    assert publisher.drain() is None
+    assert transport.posts == ['2020-07-30 COVID-19 Update'] and transport.replies == [('post-1', 'Key indicators')]
+    assert os.path.exists(publisher.entry_path('2020-07-30', SENT))
+
+
+def test_post_is_given_up_after_max_attempts(tmp_path):
+    publisher = Publisher(FlakyTransport(failed_replies=3), path=str(tmp_path), max_attempts=3, backoff=0)
+    publisher.enqueue(post('2020-07-30'))
+    for _ in range(3):
+        publisher.drain()
+    assert publisher.pending() == []
+    failed = publisher.read(publisher.entry_path('2020-07-30', FAILED))
+    assert failed['attempts'] == 3 and 'Reddit is down' in failed['error']
+
+
+def test_background_thread_sends_published_posts(tmp_path):
+    transport = FlakyTransport(failed_replies=1)
+    publisher = Publisher(transport, path=str(tmp_path), backoff=.01)
+    assert publisher.publish(post('2020-07-30'))
+    deadline = time.time() + 5
+    while not os.path.exists(publisher.entry_path('2020-07-30', SENT)) and time.time() < deadline:
+        time.sleep(.01)
+    publisher.stop(5)
+    assert transport.replies == [('post-1', 'Key indicators')]
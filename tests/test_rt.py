@@ -0,0 +1,97 @@
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rt
+from rt import bayes_filter, calculate_rt, calculate_rt_regions, get_likelihoods, get_prior, get_process_operator
+
+
+def sparse_cases(days=200, seed=0):
+    # A small PHU, smoothed zeros are followed by days with cases
+    rng = np.random.default_rng(seed)
+    return pd.Series(rng.poisson(.6, days), index=pd.date_range('2020-03-01', periods=days, name='date'))
+
+
+def wave_cases(days=160, seed=0):
+    rng = np.random.default_rng(seed)
+    expected = 40 + 30 * np.sin(np.arange(days) / 15)
+    return pd.Series(rng.poisson(expected), index=pd.date_range('2020-03-01', periods=days, name='date'))
+
+
+@pytest.fixture
+def filtered_days(monkeypatch):
+    # Number of days each calculate_rt runs through the filter
+    days, filter_days = [], rt.bayes_filter
+
+    def count_days(likelihoods, *args, **kwargs):
+        days.append(likelihoods.shape[1])
+        return filter_days(likelihoods, *args, **kwargs)
+
+    monkeypatch.setattr(rt, 'bayes_filter', count_days)
+    return days
+
+
+def test_sparse_series_keeps_a_posterior():
+    result = calculate_rt(sparse_cases())
+    assert len(result) and not result['ML'].isna().any()
+
+
+def test_sparse_series_with_sigma_selection():
+    assert not calculate_rt(sparse_cases(), sigma=None)['ML'].isna().any()
+
+
+def test_unexplained_day_carries_the_prior_forward():
+    smoothed = pd.Series([0., 3., 4.])
+    for log_space in (False, True):
+        likelihoods = get_likelihoods(smoothed, log_space=log_space)
+        posteriors, _ = bayes_filter(likelihoods, get_process_operator(.25), get_prior(), log_space=log_space)
+        assert np.isfinite(posteriors).all()
+        np.testing.assert_allclose(posteriors[:, 1], get_process_operator(.25) @ get_prior())
+
+
+def test_failed_region_is_left_out():
+    bad = pd.Series(['x'] * 20, index=pd.date_range('2020-03-01', periods=20, name='date'))
+    result = calculate_rt_regions({'sparse': sparse_cases(), 'bad': bad}, processes=2)
+    assert list(result.index.unique(level='region')) == ['sparse']
+
+
+def test_spawned_workers_get_the_process_kernel(monkeypatch):
+    # The service starts workers with spawn, so they only see what the pool initializer hands them
+    monkeypatch.setattr(rt, 'Pool', get_context('spawn').Pool)
+    regions = {'sparse': sparse_cases(), 'wave': wave_cases()}
+    result = calculate_rt_regions(regions, processes=2)
+    for region, cases in regions.items():
+        pd.testing.assert_frame_equal(result.loc[region], calculate_rt(cases), check_freq=False)
+
+
+def test_resumed_filter_matches_a_full_run(tmp_path, filtered_days):
+    state_path, cases = str(tmp_path / 'rt_state.npz'), wave_cases()
+    calculate_rt(cases.iloc[:120], state_path=state_path)
+    resumed = calculate_rt(cases, state_path=state_path)
+    full = calculate_rt(cases)
+    assert filtered_days[1] < filtered_days[2] - 30
+    pd.testing.assert_frame_equal(resumed, full)
+
+
+def test_revised_history_runs_from_the_start(tmp_path, filtered_days):
+    state_path, cases = str(tmp_path / 'rt_state.npz'), wave_cases()
+    calculate_rt(cases.iloc[:120], state_path=state_path)
+    revised = cases.copy()
+    revised.iloc[60] += 25
+    pd.testing.assert_frame_equal(calculate_rt(revised, state_path=state_path), calculate_rt(revised))
+    assert filtered_days[1] == filtered_days[2]
+
+
+def test_unusable_state_runs_from_the_start(tmp_path, filtered_days):
+    state_path, cases = str(tmp_path / 'rt_state.npz'), wave_cases()
+    calculate_rt(cases.iloc[:120], state_path=state_path)
+    pd.testing.assert_frame_equal(calculate_rt(cases, sigma=.5, state_path=state_path), calculate_rt(cases, sigma=.5))
+    assert filtered_days[1] == filtered_days[2]
+
+    for state in (b'not a state', b''):
+        with open(state_path, 'wb') as f:
+            f.write(state)
+        pd.testing.assert_frame_equal(calculate_rt(cases, state_path=state_path), calculate_rt(cases))
+    pd.testing.assert_frame_equal(calculate_rt(cases, state_path=str(tmp_path / 'missing.npz')), calculate_rt(cases))
@@ -0,0 +1,74 @@
+import json
+from threading import Thread
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import service
+from service import UpdateService
+
+
+def pipeline_outputs(ml):
+    dates = pd.date_range('2020-07-01', periods=3, name='date')
+    rt = pd.DataFrame({'ML': ml, 'Low_90': [.8, np.nan, .9], 'High_90': [1.2, np.nan, 1.3]}, index=dates)
+    return {
+        'update': {'today_key_info': {'date': '2020-07-03', 'r_t': np.float64(ml[-1])}},
+        'rt': rt,
+        'phu_rt': pd.concat({'Toronto': rt, 'Ottawa': rt}, names=['region']),
+    }
+
+
+def get(base_url, path):
+    try:
+        with urlopen(f'{base_url}{path}') as res:
+            return res.status, json.loads(res.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.fixture
+def running_service():
+    update_service = UpdateService(interval=60)
+    server = update_service.make_server(port=0)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield update_service, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_results_are_served_once_published(running_service, monkeypatch):
+    update_service, base_url = running_service
+    assert get(base_url, '/rt')[0] == 503
+    assert get(base_url, '/unknown')[0] == 404
+
+    outputs = pipeline_outputs([1., 1.1, 1.05])
+    monkeypatch.setattr(service, 'run_pipeline', lambda date, base_url: outputs)
+    assert update_service.poll()
+    # Unchanged outputs are not published again
+    assert not update_service.poll()
+
+    status, rt = get(base_url, '/rt')
+    assert status == 200
+    assert rt == {'date': ['2020-07-01', '2020-07-02', '2020-07-03'], 'ML': [1., 1.1, 1.05],
+                  'Low_90': [.8, None, .9], 'High_90': [1.2, None, 1.3]}
+    assert get(base_url, '/today_key_info') == (200, {'date': '2020-07-03', 'r_t': 1.05})
+    assert set(get(base_url, '/phu_rt')[1]) == {'Toronto', 'Ottawa'}
+    assert get(base_url, '/status')[1]['updated'] is not None
+
+
+def test_failed_poll_keeps_the_last_results(running_service, monkeypatch):
+    update_service, base_url = running_service
+    monkeypatch.setattr(service, 'run_pipeline', lambda date, base_url: pipeline_outputs([1., 1., 1.]))
+    update_service.poll()
+
+    def fail(date, base_url):
+        update_service.stop()
+        raise ConnectionError('data.ontario.ca is down')
+
+    monkeypatch.setattr(service, 'run_pipeline', fail)
+    update_service.run()
+    assert get(base_url, '/rt')[0] == 200
+    assert 'data.ontario.ca is down' in get(base_url, '/status')[1]['error']
@@ -0,0 +1,48 @@
+import numpy as np
+
+from helper import AGE_KEY, DATE_KEY
+from spatial import area_panel, build_grid_index, haversine_km, points_in_polygon
+
+
+def random_cases(n=200000, seed=0):
+    rng = np.random.default_rng(seed)
+    longitudes, latitudes = rng.uniform(-95, -74, n), rng.uniform(41.7, 56.8, n)
+    longitudes[::100] = np.nan
+    return {'date': '2020-12-01', 'columns': {
+        'Longitude': longitudes, 'Latitude': latitudes,
+        DATE_KEY: rng.integers(60, 300, n).astype(np.int32), AGE_KEY: rng.integers(0, 11, n).astype(np.int8)}}
+
+
+def test_radius_matches_a_full_scan():
+    cases = random_cases()
+    longitudes, latitudes = cases['columns']['Longitude'], cases['columns']['Latitude']
+    index = build_grid_index(cases)
+    for longitude, latitude, radius in [(-79.38, 43.65, 25), (-80, 50, 400), (-94.9, 41.75, 5), (0, 0, 10)]:
+        expected = np.flatnonzero(haversine_km(longitude, latitude, longitudes, latitudes) <= radius)
+        np.testing.assert_array_equal(index.within_radius(longitude, latitude, radius, longitudes, latitudes),
+                                      expected)
+
+
+def test_polygon_matches_a_full_scan():
+    cases = random_cases()
+    longitudes, latitudes = cases['columns']['Longitude'], cases['columns']['Latitude']
+    polygon = [(-80, 43), (-79, 43.2), (-78.5, 44.5), (-79.5, 44.8), (-80.3, 44)]
+    expected = np.flatnonzero(points_in_polygon(longitudes, latitudes, np.array(polygon)))
+    np.testing.assert_array_equal(build_grid_index(cases).within_polygon(polygon, longitudes, latitudes), expected)
+
+
+def test_cases_without_coordinates():
+    cases = random_cases(10)
+    cases['columns']['Longitude'][:] = np.nan
+    index = build_grid_index(cases)
+    assert len(index.order) == 0
+    assert len(index.within_radius(-79, 43, 50, cases['columns']['Longitude'], cases['columns']['Latitude'])) == 0
+
+
+def test_area_panel_counts_like_count_cases():
+    cases = random_cases()
+    rows = np.arange(0, 5000)
+    panel = area_panel(cases, {'area': rows})
+    ages, days = cases['columns'][AGE_KEY][rows], cases['columns'][DATE_KEY][rows]
+    assert panel.series('area').sum() == np.count_nonzero(ages < 10)
+    assert panel.first_day == days[ages < 10].min()
@@ -0,0 +1,62 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from status import StatusTable, parse_status_csv
+
+HEADER = 'Reported Date,Total Cases,"Tests, completed",Note,Deaths\n'
+ROWS = ['2020-07-28,10,100,"Stage 2, Toronto",1\n',
+        '2020-07-29,15,,,2\n',
+        '2020-07-30,,260,"said ""hold""",\n',
+        '2020-07-31,30,300,Stage 3,4']
+TEXTS = {
+    'quoted_and_empty': HEADER + ''.join(ROWS) + '\n',
+    'no_trailing_newline': HEADER + ''.join(ROWS),
+    'windows_newlines': (HEADER + ''.join(ROWS)).replace('\n', '\r\n'),
+    'trailing_blank_lines': HEADER + ''.join(ROWS) + '\n\n\n',
+    'numbers_only': 'Reported Date,Total Cases,Deaths\n2020-07-28,10,1\n2020-07-29,,2\n2020-07-30,22,',
+}
+
+
+def cell(value):
+    # Empty cells are NaN in pandas, NaN for numbers and '' for text in the table
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value or None
+
+
+def table_columns(table):
+    return {header: dict(zip(table.date_strings(), map(cell, table[header].tolist())))
+            for header in table.headers + list(table.text)}
+
+
+def pandas_columns(text):
+    frame = pd.read_csv(io.StringIO(text), index_col=0)
+    return {header: {date: cell(value) for date, value in column.items()}
+            for header, column in frame.to_dict().items()}
+
+
+@pytest.mark.parametrize('name', TEXTS)
+def test_parse_matches_pandas(name):
+    table = parse_status_csv(TEXTS[name])
+    assert table_columns(table) == pandas_columns(TEXTS[name])
+    assert table.date_strings()[-1] == ('2020-07-30' if name == 'numbers_only' else '2020-07-31')
+
+
+def test_text_columns_stay_text():
+    table = parse_status_csv(TEXTS['quoted_and_empty'])
+    assert table.headers == ['Total Cases', 'Tests, completed', 'Deaths']
+    assert table['Note'].tolist() == ['Stage 2, Toronto', '', 'said "hold"', 'Stage 3']
+
+
+def test_dictionary_round_trip():
+    table = parse_status_csv(TEXTS['numbers_only'])
+    data = table.to_dict()
+    assert data['2020-07-29'] == {'Total Cases': 0, 'Deaths': 2}
+    assert StatusTable.from_dict(data).to_dict() == data
+
+
+def test_empty_file():
+    assert len(parse_status_csv('')) == 0
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from window import blocked_mean, rolling_mean, window_sums
+
+
+def test_rolling_mean_matches_pandas():
+    values = np.random.default_rng(0).poisson(30, (4, 50))
+    for window_length in (1, 4, 7):
+        for center in (False, True):
+            expected = pd.DataFrame(values.T).rolling(window_length, center=center).mean().values.T
+            np.testing.assert_allclose(rolling_mean(values, window_length, center=center), expected)
+            np.testing.assert_allclose(rolling_mean(values.T, window_length, axis=0, center=center), expected.T)
+
+
+def test_window_sums_are_exact():
+    values = np.random.default_rng(1).integers(0, 1 << 40, 100)
+    starts = np.array([0, 10, 50, 99, 30])
+    ends = np.array([100, 11, 50, 100, 80])
+    assert window_sums(values, starts, ends).tolist() == [int(values[s:e].sum()) for s, e in zip(starts, ends)]
+
+
+def test_blocked_mean_matches_a_loop():
+    values = np.random.default_rng(2).poisson(10, (3, 23)).astype(float)
+    last_days, means = blocked_mean(values, 7)
+    assert last_days.tolist() == [22, 15, 8, 1]
+    for block, last_day in enumerate(last_days):
+        np.testing.assert_allclose(means[:, block], values[:, max(last_day - 6, 0):last_day + 1].sum(axis=1) / 7)
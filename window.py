@@ -0,0 +1,65 @@
+import numpy as np
+
+
+def cumulative_sums(values, axis=-1):
+    '''
+    :param values: Array of daily values
+    :param axis: Axis of the days
+    :return: Array of running totals along axis with a leading 0, one longer than values along axis
+    '''
+    values = np.moveaxis(np.asarray(values), axis, -1)
+    # Integer counts stay integers so the window sums are exact
+    dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+    sums = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,), dtype=dtype)
+    np.cumsum(values, axis=-1, dtype=dtype, out=sums[..., 1:])
+    return sums
+
+
+def window_sums(values, starts, ends, axis=-1):
+    '''
+    :param values: Array of daily values
+    :param starts: Array of the first day of each window
+    :param ends: Array of the day after the last day of each window
+    :param axis: Axis of the days
+    :return: Array of the sum of each window, windows replace the days along axis
+    '''
+    sums = cumulative_sums(values, axis)
+    return np.moveaxis(sums[..., ends] - sums[..., starts], -1, axis)
+
+
+def rolling_mean(values, window_length, axis=-1, center=False):
+    '''
+    :param values: Array of daily values, e.g. regions x days
+    :param window_length: Number of days averaged
+    :param axis: Axis of the days
+    :param center: Label each window with its middle day instead of its last day
+    :return: Array of the same shape as values, NaN where the window doesn't fit
+    '''
+    values = np.asarray(values)
+    n = values.shape[axis]
+    ends = np.arange(window_length, n + 1)
+    means = window_sums(values, ends - window_length, ends, axis) / window_length
+
+    # Place each mean on the day that labels its window, the same days as pandas rolling
+    lead = window_length // 2 if center else window_length - 1
+    shape = list(means.shape)
+    shape[axis] = n
+    result = np.full(shape, np.nan)
+    index = [slice(None)] * result.ndim
+    index[axis] = slice(lead, lead + len(ends))
+    result[tuple(index)] = means
+    return result
+
+
+def blocked_mean(values, window_length, axis=-1):
+    '''
+    :param values: Array of daily values, e.g. regions x days
+    :param window_length: Number of days in each block
+    :param axis: Axis of the days
+    :return: Array of the last day of each block and array of block means along axis, latest block first.
+             The earliest block may be short but is still divided by window_length
+    '''
+    n = np.shape(values)[axis]
+    last_days = np.arange(n - 1, -1, -window_length)
+    means = window_sums(values, np.maximum(last_days + 1 - window_length, 0), last_days + 1, axis) / window_length
+    return last_days, means